@@ -8,16 +8,242 @@
 import os
 import sys
 import json
+import errno
+import random
 import shutil
 import hashlib
+import sqlite3
+import zlib
+import lzma
 import tempfile
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from threading import Thread
+import argparse
+import multiprocessing
+from threading import Thread, BoundedSemaphore, Lock, Event, get_ident
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import traceback
 
+# zstd 為選用壓縮編碼：Python 3.14 起內建，舊版需安裝 zstandard 套件
+try:
+    from compression import zstd as _zstd
+except ImportError:
+    try:
+        import zstandard as _zstd
+    except ImportError:
+        _zstd = None
+
+# 解壓縮資料損壞時可能拋出的錯誤類型
+_DECOMPRESS_ERRORS = (zlib.error, lzma.LZMAError) + (
+    (_zstd.ZstdError,) if _zstd is not None and hasattr(_zstd, 'ZstdError') else ()
+)
+
+
+# tkinter 延遲載入：無圖形介面環境（cron、headless 主機）使用 CLI 時完全不載入
+tk = ttk = filedialog = messagebox = None
+
+
+def _load_tkinter():
+    """載入 tkinter（只在啟動圖形介面時呼叫）"""
+    global tk, ttk, filedialog, messagebox
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as tk_ttk, filedialog as tk_filedialog, messagebox as tk_messagebox
+        tk, ttk, filedialog, messagebox = tkinter, tk_ttk, tk_filedialog, tk_messagebox
+
+
+# CLI 非互動策略：遇到需要確認的情況時中止，或清除紀錄並完整備份
+POLICY_ABORT = "abort"
+POLICY_RESET = "reset"
+
+# 應用資料夾（日誌、設定、鎖檔）
+DEFAULT_APP_DIR = os.path.join(os.path.expanduser("~"), ".backup_tool")
+
+# 掃描來源資料夾時的執行緒數量（0 或 1 = 單執行緒掃描）
+# 慢速或網路磁碟的 metadata 延遲可透過多執行緒重疊
+SCAN_WORKERS = 8
+
+# 平行複製設定：小檔案受每檔延遲限制，大檔案受頻寬限制，因此分開設定並行數量
+COPY_SMALL_WORKERS = 8
+COPY_LARGE_WORKERS = 2
+LARGE_FILE_THRESHOLD = 8 * 1024 * 1024  # 8 MB
+
+# 複製引擎設定
+COPY_BUFFER_SIZE = 1024 * 1024          # 分塊複製的緩衝區大小（1 MB）
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024    # copy_file_range / sendfile 每次呼叫的最大位元組數
+_FICLONE = 0x40049409                   # Linux ioctl FICLONE（reflink）
+
+# 複製方式（記錄於備份歷史，用於確認零複製路徑是否生效）
+COPY_METHOD_REFLINK = "reflink"
+COPY_METHOD_COPY_FILE_RANGE = "copy_file_range"
+COPY_METHOD_SENDFILE = "sendfile"
+COPY_METHOD_CHUNKED = "chunked"
+COPY_METHOD_BLOCK_DELTA = "block_delta"
+COPY_METHOD_DEDUP = "dedup"    # 物件庫已有相同內容，只建立硬連結
+
+# I/O 限速（權杖桶）：複製、刪除、驗證與還原共用同一組上限，執行中可用 IO_LIMITER.set_limits 調整
+IO_RATE_LIMIT_MB = 0        # 讀寫速率上限（MB/s，0 = 不限速）
+IO_RATE_LIMIT_OPS = 0       # 檔案操作上限（次/秒，0 = 不限制）
+IO_BURST_SECONDS = 1        # 權杖桶容量（可瞬間使用的秒數）
+IO_CHUNK_SECONDS = 0.1      # 限速時核心複製每次呼叫的資料量（秒數）
+IO_WAIT_SLICE_SECONDS = 0.25   # 等待權杖時每次最多睡眠的秒數（讓調整後的上限盡快生效）
+
+# 來源索引：於應用資料夾記錄來源每個資料夾的 mtime 與其中檔案的 stat 結果，
+# mtime 與 inode 未變的資料夾不重新列出；原地改寫檔案不會改變資料夾 mtime，
+# 因此每隔 SOURCE_INDEX_FULL_SCAN_HOURS 小時完整掃描一次（0 = 每次都完整掃描）
+SOURCE_INDEX = False
+SOURCE_INDEX_DIRNAME = "source_index"
+SOURCE_INDEX_FULL_SCAN_HOURS = 24
+# mtime 距掃描開始不到此秒數的資料夾不寫入索引（同一時間刻度內的後續修改無法由 mtime 區分）
+SOURCE_INDEX_RACY_SECONDS = 2
+
+# 變更監看（Linux inotify）：監看程式將變動的路徑寫入應用資料夾的 watch/，
+# 備份時只重新 stat 這些路徑；監看程式未執行或事件遺失時改為完整掃描
+WATCH_DIRNAME = "watch"
+WATCH_BATCH_SECONDS = 2     # 變動路徑累積此秒數後寫入一批
+WATCH_POLL_SECONDS = 1      # 檢查停止要求的間隔
+
+# 排程備份：定時、每日固定時刻、目的地裝置接上時觸發；觸發後等待 SCHEDULE_DEBOUNCE_SECONDS
+# 沒有新的觸發才開始（連續觸發合併為一次），備份進行中的觸發合併為結束後的一次備份
+SCHEDULE_INTERVAL_MINUTES = 60          # 0 = 不定時備份
+SCHEDULE_TIMES = ()                     # 每日固定時刻，例如 ("02:00", "13:30")
+SCHEDULE_ON_MOUNT = True                # 目的地從不存在變為存在時備份
+SCHEDULE_DEBOUNCE_SECONDS = 30
+SCHEDULE_MAX_DELAY_SECONDS = 600        # 觸發持續不斷時，最多延後此秒數
+SCHEDULE_POLL_SECONDS = 5
+# 排程備份以低優先權執行（POSIX nice 與 Linux I/O 優先權），避免拖慢使用者的其他工作
+SCHEDULE_LOW_PRIORITY = True
+SCHEDULE_NICE = 10
+SCHEDULE_IOPRIO_CLASS = 2               # 2 = best-effort（3 = idle，磁碟忙碌時可能完全不執行）
+SCHEDULE_IOPRIO_LEVEL = 7               # best-effort 中最低的優先權
+
+# 備份進度：各階段累計處理量，事件最多每 PROGRESS_INTERVAL_SECONDS 秒產生一次
+PHASE_INTEGRITY = "integrity"
+PHASE_SCAN = "scan"
+PHASE_SYNC = "sync"
+PHASE_VERIFY = "verify"
+PHASE_FINALIZE = "finalize"
+PROGRESS_PHASE_NAMES = {
+    PHASE_INTEGRITY: "檢查備份", PHASE_SCAN: "掃描來源", PHASE_SYNC: "同步檔案",
+    PHASE_VERIFY: "驗證備份", PHASE_FINALIZE: "更新紀錄",
+}
+PROGRESS_INTERVAL_SECONDS = 1
+PROGRESS_WINDOW_SECONDS = 10    # 計算目前吞吐量的時間範圍
+PROGRESS_POLL_MS = 500          # 圖形介面更新進度的間隔
+
+# 區塊差異複製：大於門檻且已有舊備份的檔案只改寫變動的區塊（0 = 停用）
+BLOCK_DELTA_THRESHOLD = 64 * 1024 * 1024   # 64 MB
+BLOCK_DELTA_BLOCK_SIZE = 1024 * 1024       # 1 MB
+
+# 可續傳複製：大於門檻的新檔案每寫入 CHECKPOINT_INTERVAL 位元組就將已完成的位移記錄於
+# manifest 日誌，中斷後下次備份從斷點繼續（0 = 停用）
+CHECKPOINT_THRESHOLD = 64 * 1024 * 1024    # 64 MB
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024     # 64 MB
+COPY_METHOD_RESUMED = "resumed"            # 從上次中斷的位移繼續複製
+
+# 內容雜湊模式：以檔案內容摘要判斷修改（摘要記錄於 manifest 並作為快取）
+CONTENT_HASH_MODE = False
+HASH_ALGORITHM = "sha256"
+
+# 複製時同時計算來源摘要並記錄於 manifest（來源只讀取一次；改用分塊複製，不走核心零複製路徑）
+FUSED_HASH_COPY = False
+# 寫入後略過頁面快取重新讀取目的地，與複製時的摘要比對（每個檔案多一次讀取）
+VERIFY_READBACK = False
+
+# 內容定址物件庫：相同內容只寫入一次，backup_data 中的檔案為物件的硬連結
+DEDUP_STORE = False
+OBJECT_STORE_DIRNAME = "objects"
+
+# 目的地 manifest 檔名；COMPACT_MANIFEST 啟用時使用 SQLite 精簡格式（舊版 JSON 會自動遷移）
+MANIFEST_FILENAME = ".backup_manifest"
+COMPACT_MANIFEST_FILENAME = ".backup_manifest.db"
+COMPACT_MANIFEST = True
+
+# 串流差異模式：依排序走訪來源並與排序的 manifest 合併比對，邊掃描邊複製
+STREAMING_DELTA = False
+
+# 差異事件類型（metadata = 內容未變但 manifest 需更新 metadata；moved = 搬移或改名）
+CHANGE_ADDED = "added"
+CHANGE_MODIFIED = "modified"
+CHANGE_DELETED = "deleted"
+CHANGE_METADATA = "metadata"
+CHANGE_MOVED = "moved"
+
+# 搬移偵測：將刪除與新增的檔案配對，於 backup_data 內直接改名而不重新複製
+DETECT_MOVES = True
+
+# 版本快照：每次備份後以硬連結建立 backup_data 的時間點副本（未變更的檔案不佔額外空間）
+SNAPSHOTS = False
+SNAPSHOT_DIRNAME = "snapshots"
+SNAPSHOT_NAME_FORMAT = "%Y-%m-%dT%H%M%S"
+
+# 串流壓縮：backup_data 中的檔案以自描述格式（魔術標頭 + 編碼代號）壓縮存放，還原時自動解壓縮
+COMPRESSION_CODEC = None                # None = 不壓縮；"zlib"、"lzma"，或可用時的 "zstd"
+COMPRESSION_MIN_SIZE = 4096             # 小於此大小的檔案不壓縮（標頭與延遲不划算）
+COMPRESSION_PROBE_SIZE = 64 * 1024      # 先試壓縮的區塊大小
+COMPRESSION_MIN_SAVING = 0.1            # 試壓縮節省不到 10% 時原樣複製
+COMPRESSION_PROCESSES = os.cpu_count() or 1   # 壓縮用的行程數（0 或 1 = 在複製執行緒中壓縮）
+# 已壓縮格式的副檔名：直接原樣複製
+COMPRESSED_EXTENSIONS = frozenset((
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".m4a", ".ogg", ".flac",
+    ".mp4", ".mkv", ".mov", ".avi", ".webm", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst",
+    ".7z", ".rar", ".docx", ".xlsx", ".pptx", ".odt", ".pdf", ".epub", ".apk", ".jar",
+))
+
+# 壓縮檔格式：BACKUP_FRAME_MAGIC + 編碼代號（1 位元組）+ 壓縮資料
+# "raw" 只加標頭不壓縮，用於內容剛好以魔術標頭開頭的檔案，讓還原時的判斷不會誤認
+BACKUP_FRAME_MAGIC = b"\x89BKZ\r\n\x1a\n"
+CODEC_RAW = "raw"
+CODEC_ZLIB = "zlib"
+CODEC_LZMA = "lzma"
+CODEC_ZSTD = "zstd"
+CODEC_IDS = {CODEC_RAW: 0, CODEC_ZLIB: 1, CODEC_LZMA: 2, CODEC_ZSTD: 3}
+COPY_METHOD_COMPRESS = "compress"   # 複製方式記錄為 compress_<編碼>
+
+# 小檔案封裝：小於門檻的檔案依序追加到 packs/ 下的大型區段檔，manifest 記錄所在區段與位移
+# （0 = 停用；版本快照以硬連結複製 backup_data，啟用快照時不封裝）
+PACK_THRESHOLD = 0                      # 例如 64 * 1024
+PACK_DIRNAME = "packs"
+PACK_SEGMENT_PREFIX = "segment-"
+PACK_SEGMENT_SUFFIX = ".pack"
+PACK_SEGMENT_SIZE = 256 * 1024 * 1024   # 區段達此大小後改寫入新的區段
+PACK_REPACK_RATIO = 0.5                 # 區段中有效資料低於此比例時重新封裝
+COPY_METHOD_PACK = "pack"
+
+# 快照保留策略：保留最近 RETENTION_LAST 個快照，以及最近 N 個有快照的日、週、月
+# 各自的最後一個快照（最新的快照一律保留）
+RETENTION_LAST = 3
+RETENTION_DAILY = 7
+RETENTION_WEEKLY = 4
+RETENTION_MONTHLY = 12
+
+# manifest 日誌：每完成一個檔案操作就追加一行，累積筆數達門檻時合併回 manifest
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_COMPACT_INTERVAL = 5000
+
+# manifest 中除 path/size/modified 外，存在時才寫入的選用欄位
+MANIFEST_OPTIONAL_FIELDS = ('mtime_ns', 'inode', 'hash', 'pack', 'offset')
+# 封裝檔案在區段中的位置（內容未變的檔案沿用）
+PACK_LOCATION_FIELDS = ('pack', 'offset')
+
+# 分層完整性檢查：平時只抽樣檢查部分 manifest 紀錄，以及 mtime 有變動的備份資料夾；
+# 距上次完整檢查超過指定天數時才掃描整個備份資料夾（0 = 每次都完整檢查）
+INTEGRITY_SAMPLE_RATIO = 0.05
+INTEGRITY_FULL_CHECK_DAYS = 7
+INTEGRITY_CHECK_FULL = "full"
+INTEGRITY_CHECK_SAMPLE = "sample"
+
+# 背景內容驗證（scrub）：重新讀取備份檔案並與 manifest 中的內容摘要比對，偵測位元衰減
+SCRUB_RATE_LIMIT_MB = 20    # 讀取速率上限（MB/s，0 = 不限速）
+SCRUB_CYCLE_DAYS = 30       # 每次驗證總大小的 1/N，每天執行一次時約 N 天驗證完整份備份
+
+# manifest 表頭中的完整性檢查與內容驗證狀態（更新檔案清單時保留）
+# manifestGeneration: 備份流程以外移除檔案紀錄（scrub、重新封裝）的次數
+MANIFEST_INTEGRITY_FIELDS = ('lastFullIntegrityCheck', 'directoryMtimes',
+                             'scrubCursor', 'lastScrubPassCompleted', 'manifestGeneration')
+
 
 class BackupIntegrityError(Exception):
     """備份完整性錯誤"""
@@ -112,6 +338,17 @@ class BackupLock:
         except Exception as e:
             raise Exception(f"無法建立備份鎖: {e}")
     
+    def holder(self):
+        """其他仍在執行的程序持有鎖定時回傳其 PID，否則回傳 None（不修改鎖檔）"""
+        try:
+            with open(self.lock_file, 'r') as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        if self.locked or not self._is_process_alive(pid):
+            return None
+        return pid
+    
     def release(self):
         """釋放鎖定"""
         if self.locked and os.path.exists(self.lock_file):
@@ -172,47 +409,29 @@ class FailureReport:
 
 
 class RecoveryMode:
-    """備份復原模式 (P2-7) - 從失敗狀態恢復"""
+    """備份復原模式 (P2-7) - 從失敗狀態恢復
+    
+    同步途中每完成一個檔案操作就寫入 manifest 日誌，備份失敗時將日誌合併回 manifest
+    即可反映實際備份狀態，不需重新掃描備份資料夾；大型檔案的複製位移保留在日誌中，
+    下次備份從斷點繼續。
+    """
     
     @staticmethod
-    def recover_from_failed_backup(backup_folder, manifest_path, source_folder):
-        """
-        從失敗狀態恢復：重新同步 manifest 與實際備份
+    def recover_from_failed_backup(manifest_path, journal=None):
+        """合併日誌並回傳復原資訊
         
-        場景: 備份中斷，manifest 不準確或損毀
-        
-        操作流程:
-        1. 掃描實際備份資料夾的內容
-        2. 比較 manifest 記錄
-        3. 修正 manifest 為實際狀態
-        4. 列出缺失的檔案
+        沒有日誌表示尚未開始同步、manifest 仍正確，回傳 None
         """
+        journal = journal or ManifestJournal.for_manifest(manifest_path)
+        if not journal.exists():
+            return None
         try:
-            # 掃描實際備份資料夾
-            actual_files = DeltaBackupEngine.scan_folder(backup_folder)
-            
-            # 載入舊 manifest
-            manifest = BackupManifest(manifest_path)
-            old_manifest_files = manifest.get_files_dict()
-            
-            # 計算差異
-            missing_in_backup = set(old_manifest_files.keys()) - set(actual_files.keys())
-            extra_in_backup = set(actual_files.keys()) - set(old_manifest_files.keys())
-            
-            # 更新 manifest 為實際狀態
-            manifest.update(source_folder, os.path.dirname(manifest_path), actual_files)
-            
-            recovery_info = {
+            return {
                 "recovered": True,
-                "actual_files_count": len(actual_files),
-                "missing_files_count": len(missing_in_backup),
-                "extra_files_count": len(extra_in_backup),
-                "missing_files": list(missing_in_backup)[:10],  # 只列出前10個
+                "journalOperations": journal.compact(BackupManifest.open(manifest_path)),
+                "partialFiles": len(journal.read_partials()),
                 "timestamp": datetime.now().isoformat()
             }
-            
-            return recovery_info
-            
         except Exception as e:
             raise Exception(f"復原失敗: {e}")
 
@@ -223,6 +442,32 @@ class BackupManifest:
         self.manifest_path = manifest_path
         self.data = self._load()
     
+    @staticmethod
+    def locate(target_folder, migrate=True):
+        """取得目的地的 manifest 路徑
+        
+        COMPACT_MANIFEST 啟用時回傳 SQLite 精簡格式路徑，
+        若只有舊版 JSON manifest 則先自動遷移。
+        migrate=False: 不修改目的地（還原、驗證等唯讀用途，或目的地以唯讀方式掛載），
+        只有舊版 JSON manifest 時直接回傳其路徑；遷移只在已鎖定的備份流程中進行。
+        """
+        json_path = os.path.join(target_folder, MANIFEST_FILENAME)
+        if not COMPACT_MANIFEST:
+            return json_path
+        db_path = os.path.join(target_folder, COMPACT_MANIFEST_FILENAME)
+        if not os.path.exists(db_path) and os.path.exists(json_path):
+            if not migrate:
+                return json_path
+            SqliteManifest.migrate_from_json(json_path, db_path)
+        return db_path
+    
+    @staticmethod
+    def open(manifest_path):
+        """依檔名選擇 manifest 格式（.db 為 SQLite，其餘為 JSON）"""
+        if manifest_path.endswith(".db"):
+            return SqliteManifest(manifest_path)
+        return BackupManifest(manifest_path)
+    
     def _load(self):
         """載入元資料"""
         if os.path.exists(self.manifest_path):
@@ -292,10 +537,14 @@ class BackupManifest:
         """取得檔案字典（path -> {size, modified}）"""
         result = {}
         for file_info in self.data.get('filesList', []):
-            result[file_info['path']] = {
+            info = {
                 'size': file_info['size'],
                 'modified': file_info['modified']
             }
+            for field in MANIFEST_OPTIONAL_FIELDS:
+                if field in file_info:
+                    info[field] = file_info[field]
+            result[file_info['path']] = info
         return result
     
     def update(self, source_folder, target_folder, files_info):
@@ -307,207 +556,3573 @@ class BackupManifest:
             "filesCount": len(files_info),
             "totalSize": sum(f['size'] for f in files_info.values()),
             "filesList": [
-                {"path": path, "size": info['size'], "modified": info['modified']}
+                self._file_entry(path, info)
                 for path, info in files_info.items()
-            ]
+            ],
+            **self._integrity_state()
         }
         self.save()
     
+    def _integrity_state(self):
+        """取得目前的完整性檢查狀態（更新檔案清單時保留）"""
+        return {field: self.data[field] for field in MANIFEST_INTEGRITY_FIELDS if field in self.data}
+    
+    def bump_generation(self):
+        """備份流程以外移除檔案紀錄時遞增世代（隨下次寫入表頭保存）
+        
+        監看程式的變更紀錄不包含這些路徑；DirtySet 發現世代不同時改為完整掃描，
+        被移除的檔案才會重新複製。
+        """
+        self.data['manifestGeneration'] = (self.data.get('manifestGeneration') or 0) + 1
+    
+    def record_integrity_state(self, directory_mtimes, full_check_time=None):
+        """記錄備份資料夾的 mtime 快照；full_check_time 為本次完整檢查的時間"""
+        self.data['directoryMtimes'] = directory_mtimes
+        if full_check_time is not None:
+            self.data['lastFullIntegrityCheck'] = full_check_time
+        self.save()
+    
+    def iter_files(self, start_after=None):
+        """依路徑排序產生 (path, info)（JSON 格式需先整份載入）
+        
+        start_after: 只產生路徑大於此值的紀錄（用於從上次進度繼續）
+        """
+        for path, info in sorted(self.get_files_dict().items()):
+            if start_after is None or path > start_after:
+                yield path, info
+    
+    def apply_changes(self, upserts, deletes, source_folder=None, target_folder=None):
+        """套用逐筆檔案變更（JSON 格式只能整份重寫）"""
+        files = self.get_files_dict()
+        for path in deletes:
+            files.pop(path, None)
+        files.update(upserts)
+        self.update(
+            source_folder or self.data.get('sourceFolder', ''),
+            target_folder or self.data.get('targetFolder', ''),
+            files
+        )
+    
+    @staticmethod
+    def _file_entry(path, info):
+        """建立 filesList 中的單筆紀錄（選用欄位存在時才寫入）"""
+        entry = {"path": path, "size": info['size'], "modified": info['modified']}
+        for field in MANIFEST_OPTIONAL_FIELDS:
+            if field in info:
+                entry[field] = info[field]
+        return entry
+    
     def reset(self):
         """重置元資料（清除備份紀錄）"""
         self.data = self._default_manifest()
         self.save()
 
 
-class DeltaBackupEngine:
-    """差異備份引擎"""
+class ScanResult:
+    """單次掃描結果 - 由空間檢查、差異檢測與元資料更新共用
+
+    大型來源資料夾的 walk + stat 成本很高，因此每次備份只掃描一次，
+    之後各階段都使用同一份結果，不再重新掃描。
+    """
+    def __init__(self, folder_path, files):
+        self.folder_path = folder_path
+        self.files = files
+        self.total_size = sum(info['size'] for info in files.values())
+        self.scanned_at = datetime.now().isoformat()
+
+    def __len__(self):
+        return len(self.files)
+
+
+class SourceIndex:
+    """來源端 metadata 索引 - 未變更的資料夾不需重新列出與 stat
+    
+    存於應用資料夾（預設 ~/.backup_tool/source_index/），每個來源資料夾一個 SQLite 檔，
+    記錄每個資料夾的 (mtime_ns, inode) 與其中檔案、子資料夾的 stat 結果。
+    掃描時先 stat 資料夾本身：與索引相同時直接沿用索引中的檔案資訊並繼續檢查子資料夾，
+    不同時才以 scandir 重新列出。資料夾內新增、刪除或改名項目都會改變其 mtime；
+    inode 不同表示整個資料夾被替換。
+    
+    限制：原地改寫檔案內容不會改變資料夾 mtime，因此每隔 SOURCE_INDEX_FULL_SCAN_HOURS
+    小時一律完整掃描一次。
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS dirs ("
+        " path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+        " files TEXT NOT NULL, subdirs TEXT NOT NULL"
+        ") WITHOUT ROWID",
+    )
+    
+    def __init__(self, index_path, source_folder):
+        self.index_path = index_path
+        self.source_folder = source_folder
+        self.stats = {}
     
     @staticmethod
-    def get_file_info(file_path):
-        """取得檔案資訊"""
-        stat = os.stat(file_path)
-        return {
-            'size': stat.st_size,
-            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-        }
+    def source_key(source_folder):
+        """來源資料夾的識別碼（正規化路徑的摘要）"""
+        key = os.path.normcase(os.path.normpath(os.path.abspath(source_folder)))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
     
     @staticmethod
-    def scan_folder(folder_path):
-        """掃描資料夾並取得所有檔案資訊"""
-        result = {}
+    def for_source(app_dir, source_folder):
+        """取得來源資料夾對應的索引"""
+        name = SourceIndex.source_key(source_folder) + ".db"
+        return SourceIndex(os.path.join(app_dir, SOURCE_INDEX_DIRNAME, name), source_folder)
+    
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        conn = sqlite3.connect(self.index_path)
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        return conn
+    
+    def _load(self):
+        """載入索引，回傳 (資料夾紀錄, 上次完整掃描時間)；索引損毀時視為空索引"""
+        if not os.path.exists(self.index_path):
+            return {}, None
         try:
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(file_path, folder_path)
-                    try:
-                        result[rel_path] = DeltaBackupEngine.get_file_info(file_path)
-                    except Exception as e:
-                        print(f"無法讀取檔案 {rel_path}: {e}")
-            return result
-        except Exception as e:
-            raise Exception(f"掃描資料夾失敗: {e}")
+            conn = self._connect()
+            try:
+                meta = dict(conn.execute("SELECT key, value FROM meta"))
+                dirs = {
+                    path: (mtime_ns, inode, files, subdirs)
+                    for path, mtime_ns, inode, files, subdirs in conn.execute(
+                        "SELECT path, mtime_ns, inode, files, subdirs FROM dirs"
+                    )
+                }
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"載入來源索引失敗: {e}")
+            return {}, None
+        return dirs, meta.get('lastFullScan')
     
-    @staticmethod
-    def detect_changes(old_files, new_files):
-        """檢測檔案異動"""
-        added = {}
-        modified = {}
-        deleted = {}
+    def full_scan_due(self, last_full_scan, now=None):
+        """距上次完整掃描是否已超過 SOURCE_INDEX_FULL_SCAN_HOURS（或從未完整掃描過）"""
+        if SOURCE_INDEX_FULL_SCAN_HOURS <= 0 or not last_full_scan:
+            return True
+        now = now or datetime.now()
+        return now - datetime.fromisoformat(last_full_scan) >= \
+            timedelta(hours=SOURCE_INDEX_FULL_SCAN_HOURS)
+    
+    def scan(self, workers=None, full=False, on_directory=None):
+        """以索引掃描來源資料夾，回傳與 scan_folder 相同格式的檔案資訊字典
         
-        # 新增和修改的檔案
-        for path, info in new_files.items():
-            if path not in old_files:
-                added[path] = info
-            elif (old_files[path]['size'] != info['size'] or 
-                  old_files[path]['modified'] != info['modified']):
-                modified[path] = info
+        full: 忽略索引，重新列出所有資料夾（到期時自動完整掃描）
+        on_directory: 同 scan_folder，每處理完一個資料夾以其檔案數呼叫
+        掃描結果寫回索引；self.stats 記錄 {'full', 'dirsListed', 'dirsReused'}
+        """
+        if workers is None:
+            workers = SCAN_WORKERS
+        stored, last_full_scan = self._load()
+        full = full or self.full_scan_due(last_full_scan)
+        racy_after = time.time_ns() - SOURCE_INDEX_RACY_SECONDS * 10**9
+        result = {}
+        listed = {}     # 重新列出的資料夾: 相對前綴 -> 紀錄
+        visited = set()
+        racy = set()    # 重新列出但不寫入索引的資料夾
         
-        # 已刪除的檔案
-        for path in old_files:
-            if path not in new_files:
-                deleted[path] = old_files[path]
+        def scan_one(dir_path, rel_prefix):
+            # 先 stat 再列出：列出途中資料夾被修改時 mtime 會晚於紀錄，下次仍會重新列出
+            try:
+                stat = os.stat(dir_path)
+            except OSError as e:
+                print(f"無法讀取資料夾 {dir_path}: {e}")
+                return rel_prefix, {}, [], False
+            entry = None if full else stored.get(rel_prefix)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_ino:
+                files = {
+                    rel_prefix + name: {'size': size, 'modified': modified,
+                                        'mtime_ns': mtime_ns, 'inode': inode}
+                    for name, (size, modified, mtime_ns, inode) in json.loads(entry[2]).items()
+                }
+                subdirs = [(os.path.join(dir_path, name), rel_prefix + name + os.sep)
+                           for name in json.loads(entry[3])]
+                return rel_prefix, files, subdirs, None
+            files, subdirs = DeltaBackupEngine._scan_directory(dir_path, rel_prefix)
+            if stat.st_mtime_ns >= racy_after:
+                # 剛修改過的資料夾：本次列出，但不寫入索引，下次仍重新列出
+                return rel_prefix, files, subdirs, False
+            record = (
+                stat.st_mtime_ns, stat.st_ino,
+                json.dumps({
+                    path[len(rel_prefix):]: [info['size'], info['modified'],
+                                             info['mtime_ns'], info['inode']]
+                    for path, info in files.items()
+                }, ensure_ascii=False),
+                json.dumps([sub_prefix[len(rel_prefix):-len(os.sep)] for _, sub_prefix in subdirs],
+                           ensure_ascii=False)
+            )
+            return rel_prefix, files, subdirs, record
         
-        return added, modified, deleted
-    
-    @staticmethod
-    def copy_file(src, dst):
-        """複製檔案並驗證"""
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        def collect(rel_prefix, files, subdirs, record):
+            result.update(files)
+            if on_directory is not None:
+                on_directory(len(files))
+            if record is False:
+                racy.add(rel_prefix)
+            else:
+                visited.add(rel_prefix)
+                if record is not None:
+                    listed[rel_prefix] = record
+            return subdirs
         
-        # 複製
-        shutil.copy2(src, dst)
+        try:
+            if workers <= 1:
+                pending = [(self.source_folder, '')]
+                while pending:
+                    pending.extend(collect(*scan_one(*pending.pop())))
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = {pool.submit(scan_one, self.source_folder, '')}
+                    while futures:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            for sub_path, sub_prefix in collect(*future.result()):
+                                futures.add(pool.submit(scan_one, sub_path, sub_prefix))
+        except Exception as e:
+            raise Exception(f"掃描資料夾失敗: {e}")
         
-        # 驗證大小
-        src_size = os.path.getsize(src)
-        dst_size = os.path.getsize(dst)
-        if src_size != dst_size:
-            raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+        self._save(listed, set(stored) - visited, datetime.now().isoformat() if full else None)
+        self.stats = {'full': full, 'dirsListed': len(listed) + len(racy),
+                      'dirsReused': len(visited) - len(listed)}
+        return result
     
-    @staticmethod
-    def delete_file(dst_path):
-        """刪除檔案"""
-        if os.path.exists(dst_path):
+    def _save(self, listed, removed, full_scan_time=None):
+        """寫回重新列出的資料夾並移除已不存在的資料夾（沒有變更時不寫入）"""
+        if not listed and not removed and full_scan_time is None:
+            return
+        try:
+            conn = self._connect()
             try:
-                os.remove(dst_path)
-            except Exception as e:
-                raise Exception(f"檔案刪除失敗: {dst_path} - {str(e)}")
+                with conn:
+                    conn.executemany("DELETE FROM dirs WHERE path = ?", [(p,) for p in removed])
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO dirs (path, mtime_ns, inode, files, subdirs) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(path, *record) for path, record in listed.items()]
+                    )
+                    if full_scan_time is not None:
+                        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                     ('lastFullScan', full_scan_time))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # 索引只是快取：寫入失敗時下次重新列出即可
+            print(f"儲存來源索引失敗: {e}")
+    
+    def clear(self):
+        """刪除索引（下次掃描重新列出所有資料夾）"""
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+
+class DirtySet:
+    """來源變更紀錄（dirty set）- 由監看程式寫入、備份流程消化
+    
+    存於應用資料夾的 watch/<來源摘要>/：
+    - status.json: 監看程式的工作階段（session、pid、是否已監看所有資料夾、停止時間）
+    - batch-*.json: 每批變更的相對路徑，以暫存檔改名寫入，讀取時不會看到寫到一半的內容
+    - consumed.json: 上次成功備份時已涵蓋的工作階段與 manifest 世代
+    
+    只有監看程式仍在執行、且自上次成功備份起都是同一個工作階段、沒有佇列溢位、
+    manifest 也沒有在備份以外被移除紀錄（世代相同）時，變更路徑才足以代表所有差異；
+    其餘情況備份流程改為完整掃描。
+    """
+    def __init__(self, folder, source_folder):
+        self.folder = folder
+        self.source_folder = source_folder
+        self.status_path = os.path.join(folder, "status.json")
+        self.consumed_path = os.path.join(folder, "consumed.json")
     
     @staticmethod
-    def verify_backup(source_folder, target_folder, files_to_check):
-        """驗證備份完整性"""
-        errors = []
-        for rel_path in files_to_check:
-            src = os.path.join(source_folder, rel_path)
-            dst = os.path.join(target_folder, rel_path)
-            
-            if os.path.exists(src) and os.path.exists(dst):
-                if os.path.getsize(src) != os.path.getsize(dst):
-                    errors.append(f"大小不符: {rel_path}")
-        
-        return errors
+    def for_source(app_dir, source_folder):
+        return DirtySet(
+            os.path.join(app_dir, WATCH_DIRNAME, SourceIndex.source_key(source_folder)),
+            source_folder
+        )
+    
+    def _write_json(self, path, data):
+        """以暫存檔改名原子寫入"""
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
     
     @staticmethod
-    def verify_backup_integrity(manifest_files, backup_folder):
-        """驗證備份是否與 manifest 一致 (P1-1)"""
-        # 掃描實際備份（異常處理改善）
+    def _read_json(path):
         try:
-            actual_files = DeltaBackupEngine.scan_folder(backup_folder)
-        except Exception as e:
-            raise BackupIntegrityError(
-                f"❌ 無法掃描備份資料夾: {str(e)}\n"
-                f"備份可能被防病毒軟體保護、被鎖定或已損毀。"
-            )
-        
-        actual_keys = set(actual_files.keys())
-        manifest_keys = set(manifest_files.keys())
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def write_status(self, session, complete=True, stopped=False):
+        """記錄監看程式的工作階段"""
+        self._write_json(self.status_path, {
+            "session": session,
+            "sourceFolder": self.source_folder,
+            "pid": os.getpid(),
+            "complete": complete,
+            "stopped": datetime.now().isoformat() if stopped else None
+        })
+    
+    def write_batch(self, session, paths, overflow=False):
+        """寫入一批變更路徑；overflow 表示有事件遺失"""
+        name = f"batch-{time.time_ns():020d}-{os.getpid()}.json"
+        self._write_json(os.path.join(self.folder, name),
+                         {"session": session, "paths": sorted(paths), "overflow": overflow})
+    
+    def exists(self):
+        """是否曾有監看程式為此來源記錄變更"""
+        return os.path.isdir(self.folder)
+    
+    def list_batches(self):
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if name.startswith("batch-") and name.endswith(".json"))
+    
+    def watcher_alive(self, status=None):
+        """監看程式是否仍在執行（只支援 POSIX；Windows 上 os.kill 會結束程序）"""
+        status = status if status is not None else self._read_json(self.status_path)
+        if not status or status.get("stopped") or os.name != 'posix':
+            return False
+        try:
+            os.kill(status["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    
+    def consume(self, manifest_generation=0):
+        """讀取目前所有的變更批次（不刪除），回傳
+        {'paths': 變更路徑集合（不可信時為 None）, 'batches': 批次檔名, 'session': 工作階段,
+         'manifestGeneration': manifest 世代}
         
-        # 檢查缺失的檔案
-        missing = manifest_keys - actual_keys
-        if missing:
-            missing_list = list(missing)[:5]  # 只顯示前5個
-            raise BackupIntegrityError(
-                f"❌ 備份不完整: 預期 {len(manifest_keys)} 個檔案，"
-                f"實際只有 {len(actual_keys)} 個。"
-                f"缺少 {len(missing)} 個檔案。"
-                f"示例: {', '.join(missing_list)}"
-                + (f" ... 等{len(missing)-5}個" if len(missing) > 5 else "")
-            )
+        session 為讀取時仍在執行的工作階段；完整掃描後以此記錄涵蓋範圍。
+        manifest_generation: 目前 manifest 的 manifestGeneration，與上次涵蓋時不同則不可信。
+        讀取後才產生的批次不在此次結果中，下次備份再處理。
+        """
+        status = self._read_json(self.status_path)
+        alive = self.watcher_alive(status)
+        session = status["session"] if alive else None
+        consumed = self._read_json(self.consumed_path) or {}
+        valid = alive and status.get("complete") and consumed.get("session") == session \
+            and consumed.get("manifestGeneration", 0) == manifest_generation
         
-        return True
+        batches = self.list_batches()
+        paths = set()
+        for name in batches:
+            batch = self._read_json(os.path.join(self.folder, name))
+            if batch is None or batch.get("session") != session or batch.get("overflow"):
+                valid = False
+                continue
+            paths.update(batch["paths"])
+        return {"paths": paths if valid else None, "batches": batches, "session": session,
+                "manifestGeneration": manifest_generation}
+    
+    def acknowledge(self, delta):
+        """備份成功後刪除已處理的批次，並記錄已涵蓋的工作階段"""
+        for name in delta["batches"]:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+        if delta["session"]:
+            self._write_json(self.consumed_path, {"session": delta["session"],
+                                                  "manifestGeneration": delta["manifestGeneration"]})
+        elif os.path.exists(self.consumed_path):
+            os.remove(self.consumed_path)
+
+
+class ChangeWatcher:
+    """來源變更監看程式（Linux inotify，以 ctypes 呼叫）
+    
+    監看來源中的每個資料夾，將有變動的相對路徑每隔 batch_seconds 秒寫入 DirtySet；
+    新建或移入的資料夾加入監看並整個記錄為變動（加入監看前建立的檔案由備份時重新掃描）。
+    佇列溢位或監看數量超過系統上限時寫入溢位標記，下次備份改為完整掃描。
+    """
+    # inotify 事件（<sys/inotify.h>）
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_DONT_FOLLOW = 0x2000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+    
+    def __init__(self, source_folder, dirty_set, batch_seconds=None):
+        self.source_folder = os.path.abspath(source_folder)
+        self.dirty_set = dirty_set
+        self.batch_seconds = WATCH_BATCH_SECONDS if batch_seconds is None else batch_seconds
+        self.session = f"{os.getpid()}-{time.time_ns()}"
+        self._libc = None
+        self._fd = None
+        self._watches = {}      # wd -> 相對路徑（根目錄為 ''）
+        self._complete = True
+        self._dirty = set()
+        self._overflow = False
     
     @staticmethod
-    def check_disk_space(source_folder, target_folder):
-        """檢查磁碟空間是否充足 (P1-3)"""
+    def available():
+        """目前平台是否支援 inotify"""
+        return sys.platform.startswith('linux')
+    
+    def _load_libc(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._libc = libc
+        self._get_errno = ctypes.get_errno
+    
+    def _add_tree(self, rel_dir):
+        """監看 rel_dir 與其下所有資料夾"""
+        for root, dirs, _ in os.walk(os.path.join(self.source_folder, rel_dir)):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), self.WATCH_MASK)
+            if wd < 0:
+                if self._get_errno() in (errno.ENOSPC, errno.EMFILE):
+                    # 超過 max_user_watches 等系統上限
+                    print(f"無法監看資料夾 {root}: 超過系統監看數量上限")
+                    self._complete = False
+                    self._overflow = True
+                    return
+                # 資料夾在走訪途中被刪除：略過
+                dirs[:] = []
+                continue
+            rel_path = os.path.relpath(root, self.source_folder)
+            self._watches[wd] = '' if rel_path == os.curdir else rel_path
+    
+    def _remove_tree(self, rel_dir):
+        """移除 rel_dir 與其下所有資料夾的監看（資料夾被搬走時）"""
+        prefix = rel_dir + os.sep
+        for wd, path in list(self._watches.items()):
+            if path == rel_dir or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+    
+    def _handle(self, wd, mask, name):
+        """處理一個 inotify 事件"""
+        if mask & self.IN_Q_OVERFLOW:
+            self._overflow = True
+            return
+        rel_dir = self._watches.get(wd)
+        if rel_dir is None:
+            return
+        if mask & self.IN_IGNORED:
+            del self._watches[wd]
+            return
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            if rel_dir == '':
+                # 來源資料夾本身被刪除或搬走：無法再追蹤
+                self._overflow = True
+            return
+        if not name:
+            return
+        rel_path = os.path.join(rel_dir, name) if rel_dir else name
+        self._dirty.add(rel_path)
+        if mask & self.IN_ISDIR:
+            if mask & self.IN_MOVED_FROM:
+                self._remove_tree(rel_path)
+            elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._add_tree(rel_path)
+    
+    def _flush(self):
+        if self._dirty or self._overflow:
+            self.dirty_set.write_batch(self.session, self._dirty, self._overflow)
+            if self._overflow:
+                self.dirty_set.write_status(self.session, complete=self._complete)
+            self._dirty = set()
+            self._overflow = False
+    
+    def run(self, stop_event=None):
+        """監看到 stop_event 被設定（或收到 KeyboardInterrupt）為止"""
+        import select
+        import struct
+        if not self.available():
+            raise OSError("變更監看只支援 Linux（inotify）")
+        self._load_libc()
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 失敗")
+        header = struct.Struct("iIII")
         try:
-            # 計算源資料夾總大小
-            total_size = sum(
-                f['size'] for f in 
-                DeltaBackupEngine.scan_folder(source_folder).values()
-            )
-            
-            # 取得目標磁碟可用空間
-            available = shutil.disk_usage(target_folder).free
-            
-            # 保留 20% 緩衝
-            required_with_buffer = total_size / 0.8
-            
-            if required_with_buffer > available:
-                available_gb = available / 1e9
-                required_gb = required_with_buffer / 1e9
-                raise Exception(
-                    f"❌ 磁碟空間不足！\n"
-                    f"需要: {required_gb:.2f} GB (含 20% 緩衝)\n"
-                    f"可用: {available_gb:.2f} GB"
-                )
-            
-            return True
-        except Exception as e:
-            if isinstance(e, Exception) and "磁碟空間不足" in str(e):
-                raise
-            raise Exception(f"檢查磁碟空間失敗: {str(e)}")
+            self._add_tree('')
+            # 所有資料夾都已監看後才記錄工作階段：之後的變更都會被記錄
+            self.dirty_set.write_status(self.session, complete=self._complete)
+            pending_since = None
+            while stop_event is None or not stop_event.is_set():
+                readable, _, _ = select.select([self._fd], [], [], WATCH_POLL_SECONDS)
+                if readable:
+                    data = os.read(self._fd, 64 * 1024)
+                    offset = 0
+                    while offset < len(data):
+                        wd, mask, _, length = header.unpack_from(data, offset)
+                        offset += header.size
+                        name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                        offset += length
+                        self._handle(wd, mask, name)
+                    if pending_since is None:
+                        pending_since = time.monotonic()
+                if pending_since is not None and \
+                        (self._overflow or time.monotonic() - pending_since >= self.batch_seconds):
+                    self._flush()
+                    pending_since = None
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._flush()
+            self.dirty_set.write_status(self.session, complete=self._complete, stopped=True)
+            os.close(self._fd)
+            self._fd = None
 
 
-class BackupLogger:
-    """備份日誌管理"""
-    def __init__(self, log_path):
-        self.log_path = log_path
-        self.history = self._load_history()
+class SqliteManifest(BackupManifest):
+    """SQLite 精簡元資料後端
     
-    def _load_history(self):
-        """載入歷史紀錄"""
-        if os.path.exists(self.log_path):
+    JSON manifest 每次都要整份載入、縮排寫出再讀回驗證，百萬筆檔案時
+    需要數百 MB 記憶體。此後端將檔案清單逐筆存於以 path 排序的資料表，
+    self.data 只保留表頭欄位，檔案清單可依路徑順序串流讀取。
+    備份資料夾的 mtime 快照（directoryMtimes）存於 dirs 資料表，只在
+    record_integrity_state 時寫入有變動的資料夾，不隨每次表頭儲存整份重寫。
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS files ("
+        " path TEXT PRIMARY KEY, size INTEGER NOT NULL, modified TEXT NOT NULL, extra TEXT"
+        ") WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER) WITHOUT ROWID",
+    )
+    HEADER_KEYS = ("lastBackupTime", "sourceFolder", "targetFolder", "filesCount", "totalSize",
+                   *(field for field in MANIFEST_INTEGRITY_FIELDS if field != 'directoryMtimes'))
+    
+    def _connect(self):
+        """開啟資料庫連線並確保資料表存在"""
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.manifest_path)
+        # WAL 模式：串流讀取檔案清單時，日誌合併仍可同時寫入
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        return conn
+    
+    def _load(self):
+        """載入表頭（檔案清單不載入記憶體）"""
+        data = self._default_manifest()
+        del data["filesList"]
+        if not os.path.exists(self.manifest_path):
+            return data
+        try:
+            conn = self._connect()
             try:
-                with open(self.log_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
+                for key, value in conn.execute("SELECT key, value FROM meta"):
+                    data[key] = json.loads(value)
+                directory_mtimes = dict(conn.execute("SELECT path, mtime_ns FROM dirs"))
+                if directory_mtimes:
+                    data['directoryMtimes'] = directory_mtimes
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            print(f"載入元資料失敗: {e}")
+        return data
     
-    def add_record(self, record):
-        """新增紀錄"""
-        self.history.insert(0, record)
+    def _write_header(self, conn):
+        """寫入表頭欄位"""
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, json.dumps(self.data.get(key), ensure_ascii=False)) for key in self.HEADER_KEYS]
+        )
+    
+    @staticmethod
+    def _row(path, info):
+        """建立 files 資料表的一列（選用欄位以 JSON 存於 extra）"""
+        extra = {field: info[field] for field in MANIFEST_OPTIONAL_FIELDS if field in info}
+        return (path, info['size'], info['modified'],
+                json.dumps(extra, ensure_ascii=False) if extra else None)
+    
+    @staticmethod
+    def _info(size, modified, extra):
+        """由資料列還原檔案資訊"""
+        info = {'size': size, 'modified': modified}
+        if extra:
+            info.update(json.loads(extra))
+        return info
+    
+    def save(self):
+        """儲存表頭（SQLite 交易保證原子性）"""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    self._write_header(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            raise Exception(f"儲存元資料失敗: {e}")
+    
+    def record_integrity_state(self, directory_mtimes, full_check_time=None):
+        """只寫入 mtime 有變動、新增或已不存在的資料夾"""
+        previous = self.data.get('directoryMtimes') or {}
+        missing = object()
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany("DELETE FROM dirs WHERE path = ?",
+                                     [(path,) for path in previous if path not in directory_mtimes])
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                        [(path, mtime) for path, mtime in directory_mtimes.items()
+                         if previous.get(path, missing) != mtime]
+                    )
+                    # 舊版資料庫把整份快照存於表頭
+                    conn.execute("DELETE FROM meta WHERE key = 'directoryMtimes'")
+                    self.data['directoryMtimes'] = directory_mtimes
+                    if full_check_time is not None:
+                        self.data['lastFullIntegrityCheck'] = full_check_time
+                    self._write_header(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            raise Exception(f"儲存元資料失敗: {e}")
+    
+    def iter_files(self, start_after=None):
+        """依路徑排序逐筆串流檔案清單，產生 (path, info)"""
+        conn = self._connect()
+        try:
+            if start_after is None:
+                rows = conn.execute("SELECT path, size, modified, extra FROM files ORDER BY path")
+            else:
+                rows = conn.execute(
+                    "SELECT path, size, modified, extra FROM files WHERE path > ? ORDER BY path",
+                    (start_after,)
+                )
+            for path, size, modified, extra in rows:
+                yield path, self._info(size, modified, extra)
+        finally:
+            conn.close()
+    
+    def get_files_dict(self):
+        """取得檔案字典（path -> {size, modified, ...}）"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        return dict(self.iter_files())
+    
+    def update(self, source_folder, target_folder, files_info):
+        """以單一交易取代整份檔案清單並更新表頭"""
+        self.data = {
+            "lastBackupTime": datetime.now().isoformat(),
+            "sourceFolder": source_folder,
+            "targetFolder": target_folder,
+            "filesCount": len(files_info),
+            "totalSize": sum(f['size'] for f in files_info.values()),
+            **self._integrity_state()
+        }
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM files")
+                    conn.executemany(
+                        "INSERT INTO files (path, size, modified, extra) VALUES (?, ?, ?, ?)",
+                        (self._row(path, info) for path, info in files_info.items())
+                    )
+                    self._write_header(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            raise Exception(f"儲存元資料失敗: {e}")
+    
+    def apply_changes(self, upserts, deletes, source_folder=None, target_folder=None):
+        """以單一交易套用逐筆檔案變更，成本與變更數量成正比"""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    count = self.data.get('filesCount') or 0
+                    total = self.data.get('totalSize') or 0
+                    for path in deletes:
+                        row = conn.execute(
+                            "SELECT size FROM files WHERE path = ?", (path,)
+                        ).fetchone()
+                        if row:
+                            conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                            count -= 1
+                            total -= row[0]
+                    for path, info in upserts.items():
+                        row = conn.execute(
+                            "SELECT size FROM files WHERE path = ?", (path,)
+                        ).fetchone()
+                        if row:
+                            total -= row[0]
+                        else:
+                            count += 1
+                        total += info['size']
+                        conn.execute(
+                            "INSERT OR REPLACE INTO files (path, size, modified, extra) "
+                            "VALUES (?, ?, ?, ?)", self._row(path, info)
+                        )
+                    self.data.update({
+                        "lastBackupTime": datetime.now().isoformat(),
+                        "sourceFolder": source_folder or self.data.get('sourceFolder', ''),
+                        "targetFolder": target_folder or self.data.get('targetFolder', ''),
+                        "filesCount": count,
+                        "totalSize": total,
+                    })
+                    self._write_header(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            raise Exception(f"儲存元資料失敗: {e}")
+    
+    def reset(self):
+        """重置元資料（清除備份紀錄）"""
+        self.data = self._default_manifest()
+        del self.data["filesList"]
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM files")
+                    conn.execute("DELETE FROM dirs")
+                    conn.execute("DELETE FROM meta WHERE key = 'directoryMtimes'")
+                    self._write_header(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            raise Exception(f"儲存元資料失敗: {e}")
+    
+    @staticmethod
+    def migrate_from_json(json_path, db_path):
+        """將舊版 JSON manifest 遷移為 SQLite 格式
+        
+        先寫入臨時資料庫再原子重命名；完成後舊檔改名為 .migrated 保留備查。
+        """
+        legacy = BackupManifest(json_path)
+        temp_path = db_path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        
+        migrated = SqliteManifest(temp_path)
+        migrated.update(
+            legacy.data.get('sourceFolder', ''),
+            legacy.data.get('targetFolder', ''),
+            legacy.get_files_dict()
+        )
+        # 保留原本的備份時間
+        migrated.data['lastBackupTime'] = legacy.data.get('lastBackupTime')
+        migrated.save()
+        
+        os.replace(temp_path, db_path)
+        os.replace(json_path, json_path + ".migrated")
+
+
+class ManifestJournal:
+    """manifest 追加式日誌 - 逐筆記錄已完成的檔案操作
+    
+    每複製或刪除一個檔案就追加一行 JSON，備份中斷時已完成的操作不會遺失；
+    下次備份先把日誌合併回 manifest，只需重做剩下的差異。
+    累積筆數達 compact_interval 時合併一次，避免日誌無限增長。
+    大型檔案複製途中的位移（partial）合併後仍保留在日誌中，直到該檔案完成或被刪除。
+    """
+    def __init__(self, journal_path, compact_interval=None):
+        self.journal_path = journal_path
+        self.compact_interval = compact_interval or JOURNAL_COMPACT_INTERVAL
+        self.pending = 0
+        self._file = None
+        self._lock = Lock()
+    
+    @staticmethod
+    def for_manifest(manifest_path):
+        """取得 manifest 對應的日誌"""
+        return ManifestJournal(manifest_path + JOURNAL_SUFFIX)
+    
+    def _append(self, entry):
+        """追加一行並立即寫出（執行緒安全）"""
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.pending += 1
+    
+    def record_begin(self, source_folder, target_folder):
+        """記錄本次備份的來源與目的地（合併時寫入 manifest 表頭）"""
+        self._append({"op": "begin", "sourceFolder": source_folder, "targetFolder": target_folder})
+    
+    def record_put(self, path, info):
+        """記錄已完成複製（或 metadata 已更新）的檔案"""
+        self._append({"op": "put", "path": path, "info": info})
+    
+    def record_delete(self, path):
+        """記錄已從備份刪除的檔案"""
+        self._append({"op": "delete", "path": path})
+    
+    def record_partial(self, path, offset, info):
+        """記錄複製到一半的檔案已寫入磁碟的位移（連同來源大小與 mtime_ns，用於確認來源未變）"""
+        self._append({"op": "partial", "path": path, "offset": offset,
+                      "size": info['size'], "mtime_ns": info.get('mtime_ns')})
+    
+    def should_compact(self):
+        """累積筆數是否已達合併門檻"""
+        return self.pending >= self.compact_interval
+    
+    def exists(self):
+        """日誌是否有尚未合併的內容"""
+        return os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0
+    
+    def read(self):
+        """重播日誌，回傳 (header, upserts, deletes)；中斷時寫到一半的最後一行會被忽略"""
+        header = {}
+        upserts = {}
+        deletes = set()
+        if not os.path.exists(self.journal_path):
+            return header, upserts, deletes
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                op = entry.get("op")
+                if op == "begin":
+                    header = entry
+                elif op == "put":
+                    upserts[entry["path"]] = entry["info"]
+                    deletes.discard(entry["path"])
+                elif op == "delete":
+                    upserts.pop(entry["path"], None)
+                    deletes.add(entry["path"])
+        return header, upserts, deletes
+    
+    def read_partials(self):
+        """尚未完成的複製進度，回傳 {路徑: {'offset', 'size', 'mtime_ns'}}"""
+        partials = {}
+        if not os.path.exists(self.journal_path):
+            return partials
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                op = entry.get("op")
+                if op == "partial":
+                    partials[entry["path"]] = {
+                        field: entry.get(field) for field in ("offset", "size", "mtime_ns")
+                    }
+                elif op in ("put", "delete"):
+                    partials.pop(entry["path"], None)
+        return partials
+    
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def compact(self, manifest):
+        """將日誌合併回 manifest 並清空日誌，回傳合併的檔案操作數
+        
+        合併後才刪除日誌；兩者之間中斷時重播同一份日誌結果相同。
+        尚未完成的複製進度改寫為新的日誌保留下來。
+        """
+        with self._lock:
+            self._close()
+            header, upserts, deletes = self.read()
+            partials = self.read_partials()
+            if upserts or deletes or header:
+                manifest.apply_changes(
+                    upserts, deletes,
+                    header.get("sourceFolder"), header.get("targetFolder")
+                )
+            if partials:
+                temp_path = self.journal_path + ".tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for path, entry in partials.items():
+                        f.write(json.dumps(dict(entry, op="partial", path=path),
+                                           ensure_ascii=False) + "\n")
+                os.replace(temp_path, self.journal_path)
+            elif os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.pending = 0
+            return len(upserts) + len(deletes)
+    
+    def clear(self):
+        """捨棄日誌（manifest 重置時使用）"""
+        with self._lock:
+            self._close()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.pending = 0
+
+
+class RateLimiter:
+    """權杖桶（token bucket）速率限制 - 位元組與檔案操作各一個桶
+    
+    權杖依速率持續補充，最多累積 burst_seconds 秒的量；consume 取用不足時等待。
+    單次取用超過桶容量（大檔案）時，等桶滿後先透支，之後的取用再等待補回。
+    等待以短時間分段進行，執行中以 set_limits 調整上限後立即生效。
+    多個複製執行緒共用同一個實例。
+    """
+    def __init__(self, mb_per_second=0, ops_per_second=0, burst_seconds=None):
+        self.burst_seconds = IO_BURST_SECONDS if burst_seconds is None else burst_seconds
+        self._lock = Lock()
+        self._byte_rate = 0.0
+        self._op_rate = 0.0
+        self._bytes = 0.0
+        self._ops = 0.0
+        self._updated = time.monotonic()
+        self.set_limits(mb_per_second, ops_per_second)
+    
+    @property
+    def limits(self):
+        """目前的上限 {'mbPerSecond', 'opsPerSecond'}（0 = 不限制）"""
+        return {"mbPerSecond": self._byte_rate / 1e6, "opsPerSecond": self._op_rate}
+    
+    @property
+    def enabled(self):
+        return bool(self._byte_rate or self._op_rate)
+    
+    def set_limits(self, mb_per_second=None, ops_per_second=None):
+        """調整上限（None = 不變，0 = 不限制）；從不限制改為限制時桶為滿的"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if mb_per_second is not None:
+                rate = max(0.0, float(mb_per_second)) * 1e6
+                capacity = rate * self.burst_seconds
+                self._bytes = capacity if not self._byte_rate else min(self._bytes, capacity)
+                self._byte_rate = rate
+            if ops_per_second is not None:
+                rate = max(0.0, float(ops_per_second))
+                capacity = rate * self.burst_seconds
+                self._ops = capacity if not self._op_rate else min(self._ops, capacity)
+                self._op_rate = rate
+    
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self._byte_rate:
+            self._bytes = min(self._bytes + elapsed * self._byte_rate, self._byte_rate * self.burst_seconds)
+        if self._op_rate:
+            self._ops = min(self._ops + elapsed * self._op_rate, self._op_rate * self.burst_seconds)
+    
+    def chunk_size(self, default):
+        """限速時縮小單次核心複製的資料量，讓速率平均而不是整塊複製後長時間停頓"""
+        rate = self._byte_rate
+        if not rate:
+            return default
+        return max(64 * 1024, min(default, int(rate * IO_CHUNK_SECONDS)))
+    
+    def consume(self, nbytes=0, ops=0):
+        """取用 nbytes 位元組與 ops 次操作的權杖，不足時等待"""
+        if not self._byte_rate and not self._op_rate:
+            return
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                wait = 0.0
+                if self._byte_rate and nbytes:
+                    need = min(nbytes, self._byte_rate * self.burst_seconds)
+                    if self._bytes < need:
+                        wait = (need - self._bytes) / self._byte_rate
+                if self._op_rate and ops:
+                    need = min(ops, self._op_rate * self.burst_seconds)
+                    if self._ops < need:
+                        wait = max(wait, (need - self._ops) / self._op_rate)
+                if wait <= 0:
+                    if self._byte_rate:
+                        self._bytes -= nbytes
+                    if self._op_rate:
+                        self._ops -= ops
+                    return
+            time.sleep(min(wait, IO_WAIT_SLICE_SECONDS))
+
+
+# 複製、刪除、驗證與還原共用的限速器
+IO_LIMITER = RateLimiter(IO_RATE_LIMIT_MB, IO_RATE_LIMIT_OPS)
+
+
+class DeltaBackupEngine:
+    """差異備份引擎"""
+    
+    @staticmethod
+    def get_file_info(file_path):
+        """取得檔案資訊"""
+        return DeltaBackupEngine._info_from_stat(os.stat(file_path))
+    
+    @staticmethod
+    def _info_from_stat(stat):
+        """由 os.stat 結果建立檔案資訊"""
+        return {
+            'size': stat.st_size,
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'mtime_ns': stat.st_mtime_ns,
+            'inode': stat.st_ino
+        }
+    
+    @staticmethod
+    def _scan_directory(dir_path, rel_prefix):
+        """掃描單一資料夾（不遞迴）
+        
+        使用 os.scandir 並重複利用 DirEntry.stat()（Windows 上不需額外系統呼叫），
+        相對路徑以前綴字串累加，避免每個檔案都呼叫 os.path.relpath。
+        
+        回傳: (檔案資訊字典, [(子資料夾路徑, 子資料夾相對路徑前綴), ...])
+        """
+        files = {}
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    rel_path = rel_prefix + entry.name
+                    try:
+                        # 與 os.walk 相同：不追蹤資料夾的符號連結
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append((entry.path, rel_path + os.sep))
+                        elif entry.is_file():
+                            files[rel_path] = DeltaBackupEngine._info_from_stat(entry.stat())
+                    except OSError as e:
+                        print(f"無法讀取檔案 {rel_path}: {e}")
+        except OSError as e:
+            # 與 os.walk 相同：無法讀取的資料夾略過，不中止整個掃描
+            print(f"無法讀取資料夾 {dir_path}: {e}")
+        return files, subdirs
+    
+    @staticmethod
+    def scan_folder(folder_path, workers=None, on_directory=None):
+        """掃描資料夾並取得所有檔案資訊
+        
+        workers: 掃描執行緒數量，預設為 SCAN_WORKERS；0 或 1 為單執行緒掃描。
+                 子資料夾會分派到執行緒池，讓慢速裝置的 metadata 延遲互相重疊。
+        on_directory: 每掃描完一個資料夾，以該資料夾的檔案數呼叫（於呼叫端執行緒）
+        """
+        if workers is None:
+            workers = SCAN_WORKERS
+        result = {}
+        try:
+            if workers <= 1:
+                pending = [(folder_path, '')]
+                while pending:
+                    files, subdirs = DeltaBackupEngine._scan_directory(*pending.pop())
+                    result.update(files)
+                    if on_directory is not None:
+                        on_directory(len(files))
+                    pending.extend(subdirs)
+                return result
+            
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(DeltaBackupEngine._scan_directory, folder_path, '')}
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        files, subdirs = future.result()
+                        result.update(files)
+                        if on_directory is not None:
+                            on_directory(len(files))
+                        for sub_path, sub_prefix in subdirs:
+                            futures.add(
+                                pool.submit(DeltaBackupEngine._scan_directory, sub_path, sub_prefix)
+                            )
+            return result
+        except Exception as e:
+            raise Exception(f"掃描資料夾失敗: {e}")
+    
+    @staticmethod
+    def apply_dirty_paths(source_folder, old_files, dirty_paths, workers=None, on_directory=None):
+        """以變更路徑更新上次的檔案清單，只 stat 變更過的路徑（不走訪整個來源）
+        
+        檔案 → 重新取得資訊；資料夾 → 重新掃描整個子樹；不存在 → 移除該路徑與其下所有檔案。
+        回傳與 scan_folder 相同格式的檔案資訊字典。
+        on_directory: 同 scan_folder；單一檔案的變更路徑以 1 呼叫
+        """
+        if '' in dirty_paths:
+            return DeltaBackupEngine.scan_folder(source_folder, workers, on_directory)
+        updates = {}
+        for path in dirty_paths:
+            full_path = os.path.join(source_folder, path)
+            try:
+                if os.path.isdir(full_path) and not os.path.islink(full_path):
+                    for rel_path, info in DeltaBackupEngine.scan_folder(
+                        full_path, workers, on_directory
+                    ).items():
+                        updates[os.path.join(path, rel_path)] = info
+                elif os.path.isfile(full_path):
+                    updates[path] = DeltaBackupEngine.get_file_info(full_path)
+                    if on_directory is not None:
+                        on_directory(1)
+            except OSError as e:
+                print(f"無法讀取檔案 {path}: {e}")
+        
+        # 變更路徑原本的內容（檔案或整個資料夾）先移除，再放入目前的狀態
+        dirty = set(dirty_paths)
+        prefixes = tuple(path + os.sep for path in dirty)
+        new_files = {
+            path: info for path, info in old_files.items()
+            if path not in dirty and not path.startswith(prefixes)
+        }
+        new_files.update(updates)
+        return new_files
+    
+    @staticmethod
+    def scan_source(folder_path, workers=None, on_directory=None):
+        """掃描來源資料夾一次，回傳可重複使用的 ScanResult"""
+        return ScanResult(
+            folder_path, DeltaBackupEngine.scan_folder(folder_path, workers, on_directory)
+        )
+    
+    @staticmethod
+    def iter_sorted_scan(folder_path, rel_prefix=''):
+        """依完整路徑的字串順序逐一產生 (rel_path, info)
+        
+        每個資料夾只暫存自己的項目；子資料夾以「名稱 + 分隔符號」排序，
+        使深度優先走訪的順序與整條路徑的字串排序一致，
+        可直接與依 path 排序的 manifest 合併比對。
+        """
+        entries = []
+        try:
+            with os.scandir(folder_path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            entries.append((entry.name + os.sep, entry, True))
+                        elif entry.is_file():
+                            entries.append((entry.name, entry, False))
+                    except OSError as e:
+                        print(f"無法讀取檔案 {rel_prefix + entry.name}: {e}")
+        except OSError as e:
+            print(f"無法讀取資料夾 {folder_path}: {e}")
+            return
+        
+        entries.sort(key=lambda item: item[0])
+        for key, entry, is_dir in entries:
+            if is_dir:
+                yield from DeltaBackupEngine.iter_sorted_scan(entry.path, rel_prefix + key)
+                continue
+            try:
+                info = DeltaBackupEngine._info_from_stat(entry.stat())
+            except OSError as e:
+                print(f"無法讀取檔案 {rel_prefix + key}: {e}")
+                continue
+            yield rel_prefix + key, info
+    
+    @staticmethod
+    def iter_changes(old_iter, new_iter, hash_source=None):
+        """排序合併比對（merge-join），逐一產生差異事件 (change, path, info)
+        
+        old_iter / new_iter 都必須依 path 排序（manifest.iter_files() 與
+        iter_sorted_scan()），記憶體用量與資料夾大小無關。
+        hash_source: 同 detect_changes，提供時以內容摘要判斷修改。
+        """
+        sentinel = (None, None)
+        old_path, old_info = next(old_iter, sentinel)
+        new_path, new_info = next(new_iter, sentinel)
+        
+        while old_path is not None or new_path is not None:
+            if new_path is not None and (old_path is None or new_path < old_path):
+                # 複製時計算摘要的模式下，新增檔案不需事先讀取
+                if hash_source is not None and not FUSED_HASH_COPY:
+                    DeltaBackupEngine._attach_hash(hash_source, new_path, new_info)
+                yield CHANGE_ADDED, new_path, new_info
+                new_path, new_info = next(new_iter, sentinel)
+            elif old_path is not None and (new_path is None or old_path < new_path):
+                yield CHANGE_DELETED, old_path, old_info
+                old_path, old_info = next(old_iter, sentinel)
+            else:
+                change = DeltaBackupEngine._compare_entry(old_info, new_info, hash_source, new_path)
+                if change is not None:
+                    yield change, new_path, new_info
+                old_path, old_info = next(old_iter, sentinel)
+                new_path, new_info = next(new_iter, sentinel)
+    
+    @staticmethod
+    def _attach_hash(source_folder, path, info):
+        """計算摘要並寫入 info['hash']，回傳摘要（失敗時為 None）"""
+        try:
+            info['hash'] = DeltaBackupEngine.compute_hash(os.path.join(source_folder, path))
+            return info['hash']
+        except OSError as e:
+            print(f"無法計算檔案摘要 {path}: {e}")
+            return None
+    
+    @staticmethod
+    def _compare_entry(old_info, new_info, hash_source, path):
+        """比較同一路徑的新舊資訊，回傳差異事件類型（無需處理時為 None）"""
+        if hash_source is None:
+            if old_info['size'] != new_info['size'] or \
+                    old_info['modified'] != new_info['modified']:
+                return CHANGE_MODIFIED
+            DeltaBackupEngine._keep_hash(old_info, new_info)
+        elif old_info.get('hash') and \
+                DeltaBackupEngine._stat_key(old_info) == DeltaBackupEngine._stat_key(new_info):
+            new_info['hash'] = old_info['hash']
+        else:
+            if old_info['size'] != new_info['size']:
+                # 大小不同必定已修改；複製時計算摘要的模式下不需事先讀取
+                if not FUSED_HASH_COPY:
+                    DeltaBackupEngine._attach_hash(hash_source, path, new_info)
+                return CHANGE_MODIFIED
+            digest = DeltaBackupEngine._attach_hash(hash_source, path, new_info)
+            if old_info.get('hash'):
+                if digest is None or digest != old_info['hash']:
+                    return CHANGE_MODIFIED
+            elif old_info['modified'] != new_info['modified']:
+                return CHANGE_MODIFIED
+        DeltaBackupEngine._keep_location(old_info, new_info)
+        return CHANGE_METADATA if old_info != new_info else None
+    
+    @staticmethod
+    def iter_change_events(added, modified, deleted, old_files, new_files, moves=None):
+        """將 detect_changes 的結果轉為與 iter_changes 相同的差異事件
+        
+        順序維持原本的同步流程：搬移 → 新增 → 修改 → metadata 更新 → 刪除。
+        moves: detect_moves 的結果（新路徑 -> 舊路徑），搬移的檔案不應再出現在 added/deleted
+        """
+        moves = moves or {}
+        for path in moves:
+            yield CHANGE_MOVED, path, new_files[path]
+        for path, info in added.items():
+            yield CHANGE_ADDED, path, info
+        for path, info in modified.items():
+            yield CHANGE_MODIFIED, path, info
+        for path, info in new_files.items():
+            if path not in added and path not in modified and path not in moves \
+                    and old_files.get(path) != info:
+                yield CHANGE_METADATA, path, info
+        for path, info in deleted.items():
+            yield CHANGE_DELETED, path, info
+    
+    @staticmethod
+    def detect_changes(old_files, new_files, hash_source=None):
+        """檢測檔案異動
+        
+        hash_source: 提供來源資料夾路徑時啟用內容雜湊模式 —
+                     以檔案內容摘要判斷是否修改，並將摘要寫入 new_files 的 'hash' 欄位
+        """
+        if hash_source is not None:
+            return DeltaBackupEngine._detect_changes_by_hash(old_files, new_files, hash_source)
+        
+        added = {}
+        modified = {}
+        deleted = {}
+        
+        # 新增和修改的檔案
+        for path, info in new_files.items():
+            if path not in old_files:
+                added[path] = info
+            elif (old_files[path]['size'] != info['size'] or 
+                  old_files[path]['modified'] != info['modified']):
+                modified[path] = info
+            else:
+                DeltaBackupEngine._keep_hash(old_files[path], info)
+                DeltaBackupEngine._keep_location(old_files[path], info)
+        
+        # 已刪除的檔案
+        for path in old_files:
+            if path not in new_files:
+                deleted[path] = old_files[path]
+        
+        return added, modified, deleted
+    
+    @staticmethod
+    def detect_moves(added, deleted):
+        """將刪除與新增的檔案配對為搬移，回傳 {新路徑: 舊路徑}
+        
+        配對條件（只接受唯一配對，多個候選時視為一般的新增與刪除）：
+        1. 雙方都有內容摘要 → (大小, 摘要) 相同
+        2. 否則 → (大小, 修改時間 ns, inode) 相同（同一檔案系統內改名不會改變 inode）
+        只比對大小與修改時間可能誤配內容不同的檔案，因此不單獨使用。
+        """
+        by_hash = {}
+        by_stat = {}
+        for path, info in deleted.items():
+            if info.get('hash'):
+                by_hash.setdefault((info['size'], info['hash']), []).append(path)
+            if info.get('mtime_ns') is not None and info.get('inode'):
+                by_stat.setdefault(DeltaBackupEngine._stat_key(info), []).append(path)
+        
+        moves = {}
+        used = set()
+        for path, info in added.items():
+            candidates = None
+            if info.get('hash'):
+                candidates = by_hash.get((info['size'], info['hash']))
+            if candidates is None and info.get('mtime_ns') is not None and info.get('inode'):
+                candidates = by_stat.get(DeltaBackupEngine._stat_key(info))
+            if not candidates or len(candidates) != 1 or candidates[0] in used:
+                continue
+            old_path = candidates[0]
+            used.add(old_path)
+            moves[path] = old_path
+            # 內容相同：沿用舊摘要與封裝位置
+            DeltaBackupEngine._keep_hash(deleted[old_path], info)
+            DeltaBackupEngine._keep_location(deleted[old_path], info)
+        return moves
+    
+    @staticmethod
+    def _stat_key(info):
+        """雜湊快取鍵：(大小, 修改時間 ns, inode) 都不變時沿用舊摘要"""
+        return (info.get('size'), info.get('mtime_ns'), info.get('inode'))
+    
+    @staticmethod
+    def _keep_hash(old_info, new_info):
+        """未修改的檔案沿用 manifest 中的摘要（例如背景驗證建立的基準摘要）"""
+        if old_info.get('hash') and \
+                DeltaBackupEngine._stat_key(old_info) == DeltaBackupEngine._stat_key(new_info):
+            new_info['hash'] = old_info['hash']
+    
+    @staticmethod
+    def _keep_location(old_info, new_info):
+        """內容未變的檔案沿用 manifest 中的封裝位置（備份內容仍在同一區段）"""
+        for field in PACK_LOCATION_FIELDS:
+            if field in old_info:
+                new_info[field] = old_info[field]
+    
+    @staticmethod
+    def compute_hash(file_path):
+        """計算檔案內容摘要（HASH_ALGORITHM）"""
+        with open(file_path, 'rb') as f:
+            return hashlib.file_digest(f, HASH_ALGORITHM).hexdigest()
+    
+    @staticmethod
+    def _detect_changes_by_hash(old_files, new_files, source_folder):
+        """內容雜湊模式的差異檢測
+        
+        manifest 中的摘要即為持久化的雜湊快取：
+        1. (大小, mtime_ns, inode) 與上次相同 → 沿用舊摘要，不讀取檔案
+        2. 大小不同 → 必定已修改，只需計算新摘要
+        3. 大小相同但 metadata 改變 → 重新計算摘要，內容相同則不視為修改
+           （例如只被 touch），內容不同則視為修改（例如保留 mtime 的工具寫入）
+        FUSED_HASH_COPY 啟用時，新增與大小不同的檔案改由複製時計算摘要。
+        """
+        added = {}
+        modified = {}
+        deleted = {}
+        to_hash = []
+        
+        for path, info in new_files.items():
+            old_info = old_files.get(path)
+            if old_info is None:
+                added[path] = info
+                if not FUSED_HASH_COPY:
+                    to_hash.append(path)
+            elif old_info.get('hash') and \
+                    DeltaBackupEngine._stat_key(old_info) == DeltaBackupEngine._stat_key(info):
+                info['hash'] = old_info['hash']
+            elif old_info['size'] != info['size']:
+                modified[path] = info
+                if not FUSED_HASH_COPY:
+                    to_hash.append(path)
+            else:
+                to_hash.append(path)
+        
+        # 雜湊計算以執行緒池平行處理（hashlib 計算時會釋放 GIL）
+        def hash_one(path):
+            try:
+                return DeltaBackupEngine.compute_hash(os.path.join(source_folder, path))
+            except OSError as e:
+                print(f"無法計算檔案摘要 {path}: {e}")
+                return None
+        
+        with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+            for path, digest in zip(to_hash, pool.map(hash_one, to_hash)):
+                info = new_files[path]
+                if digest is not None:
+                    info['hash'] = digest
+                if path in added or path in modified:
+                    continue
+                
+                old_info = old_files[path]
+                if old_info.get('hash'):
+                    changed = digest is None or digest != old_info['hash']
+                else:
+                    # 舊 manifest 沒有摘要（剛啟用雜湊模式）：以 metadata 判斷並建立快取
+                    changed = old_info['modified'] != info['modified']
+                if changed:
+                    modified[path] = info
+        
+        for path, info in new_files.items():
+            if path in old_files and path not in modified:
+                DeltaBackupEngine._keep_location(old_files[path], info)
+        
+        for path in old_files:
+            if path not in new_files:
+                deleted[path] = old_files[path]
+        
+        return added, modified, deleted
+    
+    @staticmethod
+    def copy_file(src, dst, buffer_size=None, digest=None, verify=None):
+        """複製檔案並驗證
+        
+        依序嘗試核心加速路徑，失敗時退回下一種方式：
+        1. reflink（FICLONE，來源與目的地在同一檔案系統時，不實際複製資料）
+        2. os.copy_file_range（資料不經過使用者空間）
+        3. os.sendfile
+        4. 大緩衝區分塊複製（buffer_size，預設 COPY_BUFFER_SIZE）
+        
+        目的地已存在且檔案大於 BLOCK_DELTA_THRESHOLD 時改用 block_delta_copy；
+        目的地有其他硬連結（快照、物件庫）時一律寫入新檔再原子取代，不改寫共用的內容。
+        
+        digest: 複製途中計算來源內容摘要（預設 FUSED_HASH_COPY），改用分塊複製
+        verify: 寫入後略過快取重新讀取目的地並比對摘要（預設 VERIFY_READBACK）
+        
+        回傳: {'method': 實際使用的複製方式, 'size': 檔案大小, 'written': 實際寫入位元組數,
+               'digest': 來源內容摘要（僅 digest/verify 啟用時）}
+        """
+        if digest is None:
+            digest = FUSED_HASH_COPY
+        if verify is None:
+            verify = VERIFY_READBACK
+        hashing = digest or verify
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        
+        # 目的地與快照或物件庫共用 inode（硬連結）時不可原地改寫，改為寫入新檔再取代
+        if DeltaBackupEngine._is_shared(dst):
+            temp_path = f"{dst}.{get_ident()}.tmp"
+            try:
+                result = DeltaBackupEngine.copy_file(src, temp_path, buffer_size, digest, verify)
+                os.replace(temp_path, dst)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return result
+        
+        # 大型檔案已有舊備份時，只改寫有差異的區塊
+        if BLOCK_DELTA_THRESHOLD and os.path.isfile(dst) and \
+                os.path.getsize(src) >= BLOCK_DELTA_THRESHOLD:
+            result = DeltaBackupEngine.block_delta_copy(src, dst, digest=hashing)
+        else:
+            # 複製（大小以已開啟的檔案描述元取得，不再額外呼叫 getsize）
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                if hashing:
+                    source_digest = DeltaBackupEngine._hashing_copy(
+                        fsrc, fdst, buffer_size or COPY_BUFFER_SIZE
+                    )
+                    method = COPY_METHOD_CHUNKED
+                else:
+                    method = DeltaBackupEngine._copy_data(fsrc, fdst, buffer_size)
+                fdst.flush()
+                src_size = os.fstat(fsrc.fileno()).st_size
+                dst_size = os.fstat(fdst.fileno()).st_size
+            shutil.copystat(src, dst)
+            
+            # 驗證大小
+            if src_size != dst_size:
+                raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+            
+            result = {'method': method, 'size': dst_size, 'written': dst_size}
+            if hashing:
+                result['digest'] = source_digest
+        
+        # 重新讀取目的地驗證內容（取代事後多次 stat 的大小比對）
+        if verify and DeltaBackupEngine.read_back_digest(dst) != result['digest']:
+            raise Exception(f"檔案驗證失敗: {src} (內容不符)")
+        return result
+    
+    @staticmethod
+    def _is_shared(path):
+        """檔案是否有其他硬連結（st_nlink > 1）"""
+        try:
+            return os.stat(path).st_nlink > 1
+        except OSError:
+            return False
+    
+    @staticmethod
+    def _hashing_copy(fsrc, fdst, buffer_size):
+        """分塊複製並同時計算來源內容摘要（來源只讀取一次），回傳摘要"""
+        digest = hashlib.new(HASH_ALGORITHM)
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            read = fsrc.readinto(buffer)
+            if not read:
+                break
+            IO_LIMITER.consume(read)
+            digest.update(view[:read])
+            fdst.write(view[:read])
+        return digest.hexdigest()
+    
+    @staticmethod
+    def read_back_digest(file_path, decode=False):
+        """重新讀取檔案並計算摘要
+        
+        支援 posix_fadvise 的平台先 fsync 再以 POSIX_FADV_DONTNEED 丟棄頁面快取，
+        確保讀到的是裝置上實際寫入的資料，而不是記憶體中剛寫入的快取。
+        decode: 壓縮存放的檔案以解壓縮後的內容計算摘要
+        """
+        with open(file_path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.fsync(f.fileno())
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            if not decode:
+                IO_LIMITER.consume(os.fstat(f.fileno()).st_size)
+                return hashlib.file_digest(f, HASH_ALGORITHM).hexdigest()
+        digest = hashlib.new(HASH_ALGORITHM)
+        for chunk in DeltaBackupEngine.iter_backup_chunks(file_path):
+            digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def select_codec(src_path, size):
+        """依大小與副檔名選擇壓縮編碼（None = 原樣複製）"""
+        if not COMPRESSION_CODEC or size < COMPRESSION_MIN_SIZE:
+            return None
+        if os.path.splitext(src_path)[1].lower() in COMPRESSED_EXTENSIONS:
+            return None
+        if COMPRESSION_CODEC == CODEC_ZSTD and _zstd is None:
+            return CODEC_ZLIB
+        return COMPRESSION_CODEC
+    
+    @staticmethod
+    def starts_with_frame_magic(file_path):
+        """檔案內容是否以壓縮檔標頭開頭（原樣存放會在還原時被誤認為壓縮檔）"""
+        with open(file_path, 'rb') as f:
+            return f.read(len(BACKUP_FRAME_MAGIC)) == BACKUP_FRAME_MAGIC
+    
+    @staticmethod
+    def _compressor(codec):
+        """建立串流壓縮器（具有 compress / flush）"""
+        if codec == CODEC_ZLIB:
+            return zlib.compressobj()
+        if codec == CODEC_LZMA:
+            return lzma.LZMACompressor()
+        if codec == CODEC_ZSTD and _zstd is not None:
+            compressor = _zstd.ZstdCompressor()
+            # zstandard 套件需透過 compressobj 串流壓縮；內建模組可直接使用
+            return compressor.compressobj() if hasattr(compressor, 'compressobj') else compressor
+        raise ValueError(f"不支援的壓縮編碼: {codec}")
+    
+    @staticmethod
+    def _decompressor(codec):
+        """建立串流解壓縮器（具有 decompress）"""
+        if codec == CODEC_ZLIB:
+            return zlib.decompressobj()
+        if codec == CODEC_LZMA:
+            return lzma.LZMADecompressor()
+        if codec == CODEC_ZSTD and _zstd is not None:
+            decompressor = _zstd.ZstdDecompressor()
+            if hasattr(decompressor, 'decompressobj'):
+                return decompressor.decompressobj()
+            return decompressor
+        raise BackupIntegrityError(f"不支援的壓縮編碼: {codec}")
+    
+    @staticmethod
+    def compress_file(src, dst, codec, buffer_size=None, verify=None):
+        """串流壓縮複製（來源只讀取一次，同時計算來源摘要）
+        
+        先試壓縮第一個區塊，節省不到 COMPRESSION_MIN_SAVING 時改用 copy_file 原樣複製
+        （此時回傳 copy_file 的結果）；
+        寫入暫存檔再原子取代，不改寫與快照共用的內容。
+        codec: CODEC_RAW 只加標頭不壓縮（內容剛好以魔術標頭開頭的檔案）
+        
+        回傳: 與 copy_file 相同格式，'written' 為壓縮後的大小
+        """
+        buffer_size = buffer_size or COPY_BUFFER_SIZE
+        if verify is None:
+            verify = VERIFY_READBACK
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        
+        with open(src, 'rb') as fsrc:
+            chunk = fsrc.read(COMPRESSION_PROBE_SIZE)
+            if codec != CODEC_RAW:
+                probe = DeltaBackupEngine._compressor(codec)
+                probe_size = len(probe.compress(chunk)) + len(probe.flush())
+                if probe_size > len(chunk) * (1 - COMPRESSION_MIN_SAVING):
+                    if not chunk.startswith(BACKUP_FRAME_MAGIC):
+                        return DeltaBackupEngine.copy_file(src, dst, buffer_size, verify=verify)
+                    codec = CODEC_RAW
+            
+            compressor = None if codec == CODEC_RAW else DeltaBackupEngine._compressor(codec)
+            digest = hashlib.new(HASH_ALGORITHM)
+            size = 0
+            temp_path = f"{dst}.{get_ident()}.tmp"
+            try:
+                with open(temp_path, 'wb') as fdst:
+                    fdst.write(BACKUP_FRAME_MAGIC + bytes([CODEC_IDS[codec]]))
+                    while chunk:
+                        IO_LIMITER.consume(len(chunk))
+                        digest.update(chunk)
+                        size += len(chunk)
+                        fdst.write(compressor.compress(chunk) if compressor else chunk)
+                        chunk = fsrc.read(buffer_size)
+                    if compressor:
+                        fdst.write(compressor.flush())
+                    fdst.flush()
+                    written = fdst.tell()
+                if size != os.fstat(fsrc.fileno()).st_size:
+                    raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+                shutil.copystat(src, temp_path)
+                os.replace(temp_path, dst)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        
+        result = {'method': f"{COPY_METHOD_COMPRESS}_{codec}", 'size': size,
+                  'written': written, 'digest': digest.hexdigest()}
+        if verify and DeltaBackupEngine.read_back_digest(dst, decode=True) != result['digest']:
+            raise Exception(f"檔案驗證失敗: {src} (內容不符)")
+        return result
+    
+    @staticmethod
+    def compress_in_worker(src, dst, codec, buffer_size, verify, mb_per_second):
+        """於壓縮行程池中執行 compress_file
+        
+        子行程有自己的 IO_LIMITER，每次以送出當下的上限設定（由呼叫端依行程數分配）；
+        檔案操作次數已由複製管線在主行程計算，子行程只限制讀寫速率。
+        """
+        IO_LIMITER.set_limits(mb_per_second, 0)
+        return DeltaBackupEngine.compress_file(src, dst, codec, buffer_size, verify)
+    
+    @staticmethod
+    def iter_backup_chunks(file_path, buffer_size=None):
+        """讀取備份檔案的原始內容（壓縮存放的檔案自動解壓縮），逐塊產生
+        
+        壓縮資料損壞或不完整時拋出 BackupIntegrityError
+        """
+        buffer_size = buffer_size or COPY_BUFFER_SIZE
+        header_size = len(BACKUP_FRAME_MAGIC) + 1
+        with open(file_path, 'rb') as f:
+            header = f.read(header_size)
+            decompressor = None
+            if len(header) == header_size and header.startswith(BACKUP_FRAME_MAGIC):
+                codecs = {code: name for name, code in CODEC_IDS.items()}
+                if header[-1] not in codecs:
+                    raise BackupIntegrityError(f"未知的壓縮編碼: {file_path}")
+                if codecs[header[-1]] != CODEC_RAW:
+                    decompressor = DeltaBackupEngine._decompressor(codecs[header[-1]])
+            elif header:
+                yield header
+            
+            try:
+                while True:
+                    chunk = f.read(buffer_size)
+                    if not chunk:
+                        break
+                    IO_LIMITER.consume(len(chunk))
+                    yield decompressor.decompress(chunk) if decompressor else chunk
+                if decompressor is not None:
+                    if hasattr(decompressor, 'flush'):
+                        yield decompressor.flush()
+                    if not getattr(decompressor, 'eof', True):
+                        raise BackupIntegrityError(f"壓縮資料不完整: {file_path}")
+            except _DECOMPRESS_ERRORS as e:
+                raise BackupIntegrityError(f"壓縮資料損壞: {file_path} ({e})")
+    
+    @staticmethod
+    def restore_file(src, dst):
+        """還原單一備份檔案（壓縮存放的檔案自動解壓縮），保留修改時間"""
+        IO_LIMITER.consume(ops=1)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        with open(dst, 'wb') as fdst:
+            for chunk in DeltaBackupEngine.iter_backup_chunks(src):
+                fdst.write(chunk)
+        shutil.copystat(src, dst)
+    
+    @staticmethod
+    def restore_tree(src_dir, dst_dir):
+        """還原整個備份資料夾（壓縮存放的檔案自動解壓縮）"""
+        for root, dirs, files in os.walk(src_dir):
+            rel_dir = os.path.relpath(root, src_dir)
+            os.makedirs(os.path.join(dst_dir, rel_dir), exist_ok=True)
+            for name in files:
+                DeltaBackupEngine.restore_file(
+                    os.path.join(root, name), os.path.join(dst_dir, rel_dir, name)
+                )
+    
+    @staticmethod
+    def resumable_copy(src, dst, offset=0, checkpoint=None, buffer_size=None,
+                       digest=None, verify=None):
+        """可續傳的複製：從 offset 繼續寫入 dst
+        
+        每寫入 CHECKPOINT_INTERVAL 位元組就 fsync 目的地，再呼叫 checkpoint(已寫入磁碟的位移)；
+        中斷後以該位移再次呼叫即可從斷點繼續，已完成的部分不需重新複製。
+        不需摘要時以 copy_file_range 分段複製（資料不經過使用者空間），否則分塊複製；
+        需要摘要時，已完成部分的摘要由來源重新讀取計算（不需重新寫入）。
+        
+        回傳: 與 copy_file 相同格式的結果（'written' 只計本次寫入的位元組）
+        """
+        if digest is None:
+            digest = FUSED_HASH_COPY
+        if verify is None:
+            verify = VERIFY_READBACK
+        hasher = hashlib.new(HASH_ALGORITHM) if digest or verify else None
+        buffer_size = buffer_size or COPY_BUFFER_SIZE
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        
+        with open(src, 'rb') as fsrc, open(dst, 'r+b' if offset else 'wb') as fdst:
+            if offset:
+                if hasher is not None:
+                    remaining = offset
+                    while remaining:
+                        chunk = fsrc.read(min(buffer_size, remaining))
+                        if not chunk:
+                            raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+                        hasher.update(chunk)
+                        remaining -= len(chunk)
+                else:
+                    fsrc.seek(offset)
+                fdst.seek(offset)
+                fdst.truncate()
+            
+            method = COPY_METHOD_CHUNKED
+            use_kernel = hasher is None and sys.platform.startswith('linux') and \
+                hasattr(os, 'copy_file_range')
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            position = last_checkpoint = offset
+            while True:
+                if use_kernel:
+                    try:
+                        read = os.copy_file_range(
+                            fsrc.fileno(), fdst.fileno(),
+                            IO_LIMITER.chunk_size(min(KERNEL_COPY_CHUNK, CHECKPOINT_INTERVAL))
+                        )
+                        method = COPY_METHOD_COPY_FILE_RANGE
+                    except OSError:
+                        # 尚未複製任何資料時改用分塊複製；複製途中失敗則直接拋出
+                        if method == COPY_METHOD_COPY_FILE_RANGE:
+                            raise
+                        use_kernel = False
+                        continue
+                else:
+                    read = fsrc.readinto(buffer)
+                    if read:
+                        fdst.write(view[:read])
+                        if hasher is not None:
+                            hasher.update(view[:read])
+                if not read:
+                    break
+                IO_LIMITER.consume(read)
+                position += read
+                if checkpoint is not None and position - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    checkpoint(position)
+                    last_checkpoint = position
+            fdst.flush()
+            src_size = os.fstat(fsrc.fileno()).st_size
+            dst_size = os.fstat(fdst.fileno()).st_size
+        shutil.copystat(src, dst)
+        
+        if src_size != dst_size:
+            raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+        
+        result = {'method': COPY_METHOD_RESUMED if offset else method,
+                  'size': dst_size, 'written': dst_size - offset}
+        if hasher is not None:
+            result['digest'] = hasher.hexdigest()
+        if verify and DeltaBackupEngine.read_back_digest(dst) != result['digest']:
+            raise Exception(f"檔案驗證失敗: {src} (內容不符)")
+        return result
+    
+    @staticmethod
+    def block_delta_copy(src, dst, block_size=None, digest=False):
+        """區塊差異複製：只改寫與舊備份內容不同的區塊
+        
+        來源與舊備份都在本機可直接讀取，因此以固定位移的區塊逐一比對
+        （相當於 rsync 的區塊簽章比對，但不需要滾動校驗來應付網路傳輸），
+        只有內容不同的區塊才寫入目的地，最後截斷到來源大小。
+        多 GB 的虛擬機映像、PST、資料庫傾印通常只有少數區塊改變。
+        
+        digest: 比對時同時計算來源內容摘要（來源本來就會完整讀取一次）
+        
+        回傳: {'method': 'block_delta', 'size': 檔案大小, 'written': 實際寫入位元組數,
+               'digest': 來源內容摘要（僅 digest 啟用時）}
+        """
+        block_size = block_size or BLOCK_DELTA_BLOCK_SIZE
+        written = 0
+        source_digest = hashlib.new(HASH_ALGORITHM) if digest else None
+        with open(src, 'rb') as fsrc, open(dst, 'r+b') as fdst:
+            offset = 0
+            while True:
+                src_block = fsrc.read(block_size)
+                if not src_block:
+                    break
+                IO_LIMITER.consume(len(src_block))
+                if source_digest is not None:
+                    source_digest.update(src_block)
+                dst_block = fdst.read(len(src_block))
+                if src_block != dst_block:
+                    fdst.seek(offset)
+                    fdst.write(src_block)
+                    written += len(src_block)
+                offset += len(src_block)
+                # 讀寫共用同一個檔案指標，寫入後需回到下一個區塊的位置
+                fdst.seek(offset)
+            fdst.truncate(offset)
+            fdst.flush()
+            src_size = os.fstat(fsrc.fileno()).st_size
+            dst_size = os.fstat(fdst.fileno()).st_size
+        shutil.copystat(src, dst)
+        
+        if src_size != dst_size:
+            raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+        
+        result = {'method': COPY_METHOD_BLOCK_DELTA, 'size': dst_size, 'written': written}
+        if source_digest is not None:
+            result['digest'] = source_digest.hexdigest()
+        return result
+    
+    @staticmethod
+    def _copy_data(fsrc, fdst, buffer_size=None):
+        """在兩個已開啟的檔案間複製資料，回傳使用的複製方式"""
+        if sys.platform.startswith('linux'):
+            if DeltaBackupEngine._try_reflink(fsrc, fdst):
+                return COPY_METHOD_REFLINK
+            if hasattr(os, 'copy_file_range') and \
+                    DeltaBackupEngine._try_kernel_copy(fsrc, fdst, os.copy_file_range):
+                return COPY_METHOD_COPY_FILE_RANGE
+            if hasattr(os, 'sendfile') and \
+                    DeltaBackupEngine._try_kernel_copy(fsrc, fdst, DeltaBackupEngine._sendfile):
+                return COPY_METHOD_SENDFILE
+        
+        DeltaBackupEngine._chunked_copy(fsrc, fdst, buffer_size or COPY_BUFFER_SIZE)
+        return COPY_METHOD_CHUNKED
+    
+    @staticmethod
+    def _try_reflink(fsrc, fdst):
+        """嘗試以 FICLONE 建立 reflink（Btrfs/XFS 等支援 CoW 的檔案系統）"""
+        try:
+            import fcntl
+        except ImportError:
+            return False
+        
+        # 不同檔案系統之間無法 reflink，直接略過
+        if os.fstat(fsrc.fileno()).st_dev != os.fstat(fdst.fileno()).st_dev:
+            return False
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            return False
+    
+    @staticmethod
+    def _sendfile(in_fd, out_fd, count):
+        """以 copy_file_range 相同的參數順序呼叫 os.sendfile"""
+        return os.sendfile(out_fd, in_fd, None, count)
+    
+    @staticmethod
+    def _try_kernel_copy(fsrc, fdst, copy_func):
+        """以核心複製函式複製整個檔案
+        
+        尚未複製任何資料就失敗時（不支援的檔案系統、跨裝置等）回傳 False
+        讓呼叫端改用下一種方式；複製途中失敗則直接拋出錯誤。
+        部分虛擬或 FUSE 檔案系統對非空檔案第一次呼叫就回傳 0，同樣回傳 False。
+        """
+        in_fd = fsrc.fileno()
+        out_fd = fdst.fileno()
+        copied = 0
+        while True:
+            try:
+                sent = copy_func(in_fd, out_fd, IO_LIMITER.chunk_size(KERNEL_COPY_CHUNK))
+            except OSError:
+                if copied == 0:
+                    return False
+                raise
+            if sent == 0:
+                return copied > 0 or os.fstat(in_fd).st_size == 0
+            IO_LIMITER.consume(sent)
+            copied += sent
+    
+    @staticmethod
+    def _chunked_copy(fsrc, fdst, buffer_size):
+        """以固定大小的緩衝區分塊複製（重複使用同一塊記憶體）"""
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            read = fsrc.readinto(buffer)
+            if not read:
+                break
+            IO_LIMITER.consume(read)
+            fdst.write(view[:read])
+    
+    @staticmethod
+    def move_file(src_path, dst_path):
+        """在備份資料夾內搬移檔案（同一檔案系統內只改名，不複製資料）"""
+        IO_LIMITER.consume(ops=1)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        os.replace(src_path, dst_path)
+    
+    @staticmethod
+    def delete_file(dst_path):
+        """刪除檔案"""
+        IO_LIMITER.consume(ops=1)
+        if os.path.exists(dst_path):
+            try:
+                os.remove(dst_path)
+            except Exception as e:
+                raise Exception(f"檔案刪除失敗: {dst_path} - {str(e)}")
+    
+    @staticmethod
+    def verify_backup(source_folder, target_folder, files_to_check):
+        """驗證備份完整性
+        
+        大小不符時再確認是否為加上 raw 標頭存放的檔案（大小多出標頭長度）
+        """
+        raw_header_size = len(BACKUP_FRAME_MAGIC) + 1
+        errors = []
+        for rel_path in files_to_check:
+            src = os.path.join(source_folder, rel_path)
+            dst = os.path.join(target_folder, rel_path)
+            
+            if os.path.exists(src) and os.path.exists(dst):
+                src_size, dst_size = os.path.getsize(src), os.path.getsize(dst)
+                if src_size != dst_size and not (
+                    dst_size == src_size + raw_header_size
+                    and DeltaBackupEngine.starts_with_frame_magic(dst)
+                ):
+                    errors.append(f"大小不符: {rel_path}")
+        
+        return errors
+    
+    @staticmethod
+    def verify_backup_integrity(manifest_files, backup_folder, workers=None):
+        """驗證備份是否與 manifest 一致 (P1-1)
+        
+        完整檢查：以平行掃描（scan_folder）對備份資料夾做一次 stat，
+        平時改用 sample_backup_integrity 快速檢查。
+        封裝的小檔案不在備份資料夾中，改為確認所在區段檔存在且長度足夠。
+        """
+        # 掃描實際備份（異常處理改善）
+        try:
+            actual_files = DeltaBackupEngine.scan_folder(backup_folder, workers)
+        except Exception as e:
+            raise BackupIntegrityError(
+                f"❌ 無法掃描備份資料夾: {str(e)}\n"
+                f"備份可能被防病毒軟體保護、被鎖定或已損毀。"
+            )
+        
+        actual_keys = set(actual_files.keys())
+        manifest_keys = {path for path, info in manifest_files.items() if not info.get('pack')}
+        
+        # 檢查缺失的檔案
+        missing = manifest_keys - actual_keys
+        missing.update(PackStore(os.path.dirname(backup_folder)).missing_entries(
+            (path, info) for path, info in manifest_files.items() if info.get('pack')
+        ))
+        if missing:
+            missing_list = list(missing)[:5]  # 只顯示前5個
+            raise BackupIntegrityError(
+                f"❌ 備份不完整: 預期 {len(manifest_keys)} 個檔案，"
+                f"實際只有 {len(actual_keys)} 個。"
+                f"缺少 {len(missing)} 個檔案。"
+                f"示例: {', '.join(missing_list)}"
+                + (f" ... 等{len(missing)-5}個" if len(missing) > 5 else "")
+            )
+        
+        return True
+    
+    @staticmethod
+    def integrity_check_due(manifest_data, now=None):
+        """距上次完整檢查是否已超過 INTEGRITY_FULL_CHECK_DAYS（或從未完整檢查過）"""
+        last_full = manifest_data.get('lastFullIntegrityCheck')
+        if INTEGRITY_FULL_CHECK_DAYS <= 0 or not last_full or not manifest_data.get('directoryMtimes'):
+            return True
+        now = now or datetime.now()
+        return now - datetime.fromisoformat(last_full) >= timedelta(days=INTEGRITY_FULL_CHECK_DAYS)
+    
+    @staticmethod
+    def _stat_directories(backup_folder, rel_dirs, workers=None):
+        """平行取得備份資料夾的 mtime_ns（不存在的資料夾為 None）"""
+        def stat_one(rel_dir):
+            try:
+                return rel_dir, os.stat(os.path.join(backup_folder, rel_dir)).st_mtime_ns
+            except OSError:
+                return rel_dir, None
+        
+        workers = workers or SCAN_WORKERS
+        if workers <= 1:
+            return dict(map(stat_one, rel_dirs))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(pool.map(stat_one, rel_dirs))
+    
+    @staticmethod
+    def snapshot_directory_mtimes(manifest_files, backup_folder, workers=None):
+        """記錄 manifest 中每個檔案所在備份資料夾的 mtime_ns
+        
+        manifest_files: 可迭代的 (path, info)；資料夾內新增、刪除或改名檔案時
+        資料夾 mtime 會改變，下次快速檢查只需完整確認這些資料夾。
+        """
+        rel_dirs = {os.path.dirname(path) for path, info in manifest_files if not info.get('pack')}
+        return DeltaBackupEngine._stat_directories(backup_folder, rel_dirs, workers)
+    
+    @staticmethod
+    def sample_backup_integrity(manifest_files, backup_folder, directory_mtimes,
+                                sample_ratio=None, workers=None):
+        """快速驗證備份是否與 manifest 一致（不走訪備份資料夾）
+        
+        只確認兩類 manifest 紀錄是否存在：
+        1. 所在資料夾 mtime 與快照不同（或快照中沒有）的檔案 - 全部檢查
+        2. 其餘檔案 - 依 sample_ratio 隨機抽樣
+        3. 封裝的小檔案 - 全部檢查（只需 stat 所在區段檔一次）
+        manifest_files 可為依序產生 (path, info) 的串流，不需整份載入記憶體。
+        
+        回傳: 實際檢查的檔案數
+        """
+        if sample_ratio is None:
+            sample_ratio = INTEGRITY_SAMPLE_RATIO
+        current = DeltaBackupEngine._stat_directories(backup_folder, directory_mtimes, workers)
+        changed_dirs = {
+            rel_dir for rel_dir, mtime_ns in current.items()
+            if mtime_ns is None or mtime_ns != directory_mtimes[rel_dir]
+        }
+        
+        def is_missing(path):
+            return not os.path.lexists(os.path.join(backup_folder, path))
+        
+        to_check = []
+        packed = []
+        for path, info in manifest_files:
+            if info.get('pack'):
+                packed.append((path, info))
+            elif os.path.dirname(path) not in current \
+                    or os.path.dirname(path) in changed_dirs \
+                    or random.random() < sample_ratio:
+                to_check.append(path)
+        with ThreadPoolExecutor(max_workers=workers or SCAN_WORKERS) as pool:
+            missing = [path for path, lost in zip(to_check, pool.map(is_missing, to_check)) if lost]
+        missing.extend(PackStore(os.path.dirname(backup_folder)).missing_entries(packed))
+        
+        checked = len(to_check) + len(packed)
+        if missing:
+            raise BackupIntegrityError(
+                f"❌ 備份不完整: 快速檢查 {checked} 個檔案，"
+                f"缺少 {len(missing)} 個檔案。"
+                f"示例: {', '.join(missing[:5])}"
+                + (f" ... 等{len(missing)-5}個" if len(missing) > 5 else "")
+            )
+        return checked
+    
+    @staticmethod
+    def calculate_delta_size(added, modified, deleted):
+        """計算本次同步實際需要的空間（新增 + 修改 - 刪除，最小為 0）"""
+        incoming = sum(info['size'] for info in added.values())
+        incoming += sum(info['size'] for info in modified.values())
+        released = sum(info['size'] for info in deleted.values())
+        return max(0, incoming - released)
+    
+    @staticmethod
+    def check_disk_space(source_folder, target_folder, required_bytes=None):
+        """檢查磁碟空間是否充足 (P1-3)
+        
+        required_bytes: 本次差異實際需要的位元組數（由 calculate_delta_size 計算）；
+                        未提供時退回掃描整個來源資料夾的大小
+        """
+        try:
+            if required_bytes is None:
+                # 計算源資料夾總大小
+                required_bytes = DeltaBackupEngine.scan_source(source_folder).total_size
+            total_size = required_bytes
+            
+            # 取得目標磁碟可用空間
+            available = shutil.disk_usage(target_folder).free
+            
+            # 保留 20% 緩衝
+            required_with_buffer = total_size / 0.8
+            
+            if required_with_buffer > available:
+                available_gb = available / 1e9
+                required_gb = required_with_buffer / 1e9
+                raise Exception(
+                    f"❌ 磁碟空間不足！\n"
+                    f"需要: {required_gb:.2f} GB (含 20% 緩衝)\n"
+                    f"可用: {available_gb:.2f} GB"
+                )
+            
+            return True
+        except Exception as e:
+            if isinstance(e, Exception) and "磁碟空間不足" in str(e):
+                raise
+            raise Exception(f"檢查磁碟空間失敗: {str(e)}")
+
+
+class CopyPipeline:
+    """平行複製管線 - 小檔案與大檔案使用不同的執行緒池
+    
+    大量小檔案的備份時間主要花在每個檔案的開啟、建立、關閉延遲，
+    以較多執行緒重疊這些延遲；大檔案則限制並行數量，避免外接裝置
+    因隨機寫入而降速。送出的工作數量有上限，避免一次建立數萬個 Future。
+    """
+    def __init__(self, small_workers=None, large_workers=None, large_threshold=None,
+                 buffer_size=None, copy_func=None):
+        # copy_func(src, dst, buffer_size) -> 與 copy_file 相同格式的結果
+        self.copy_func = copy_func or DeltaBackupEngine.copy_file
+        self.small_workers = max(1, small_workers or COPY_SMALL_WORKERS)
+        self.large_workers = max(1, large_workers or COPY_LARGE_WORKERS)
+        self.large_threshold = large_threshold or LARGE_FILE_THRESHOLD
+        self.buffer_size = buffer_size or COPY_BUFFER_SIZE
+        # 複製統計：各複製方式的檔案數、邏輯大小與實際寫入位元組數
+        self.stats = {'methods': {}, 'bytes': 0, 'written': 0}
+        self._stats_lock = Lock()
+    
+    def _copy_one(self, rel_path, src, dst, slots, on_complete):
+        """執行單一複製並釋放送出名額，回傳錯誤（成功時為 None）"""
+        try:
+            IO_LIMITER.consume(ops=1)
+            result = self.copy_func(src, dst, self.buffer_size)
+            if on_complete is not None:
+                on_complete(rel_path, result)
+            with self._stats_lock:
+                methods = self.stats['methods']
+                methods[result['method']] = methods.get(result['method'], 0) + 1
+                self.stats['bytes'] += result['size']
+                self.stats['written'] += result['written']
+            return None
+        except Exception as e:
+            return e
+        finally:
+            slots.release()
+    
+    def run(self, jobs, on_complete=None):
+        """平行複製
+        
+        jobs: [(rel_path, src, dst, size), ...]
+        on_complete: 每個檔案複製成功後呼叫 on_complete(rel_path, result)（在複製執行緒中）
+        回傳: 與 jobs 相同順序的 [(rel_path, error), ...]，成功時 error 為 None
+        """
+        return list(self.iter_run(jobs, on_complete))
+    
+    def iter_run(self, jobs, on_complete=None):
+        """平行複製並依 jobs 順序逐一產生 (rel_path, error)
+        
+        jobs 可以是產生器（例如串流差異事件），邊產生邊複製；
+        只保留尚未回報的工作，記憶體用量與工作總數無關。
+        """
+        small_slots = BoundedSemaphore(self.small_workers * 4)
+        large_slots = BoundedSemaphore(self.large_workers * 2)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.small_workers) as small_pool, \
+                ThreadPoolExecutor(max_workers=self.large_workers) as large_pool:
+            for rel_path, src, dst, size in jobs:
+                if size >= self.large_threshold:
+                    pool, slots = large_pool, large_slots
+                else:
+                    pool, slots = small_pool, small_slots
+                slots.acquire()
+                pending.append((rel_path, pool.submit(
+                    self._copy_one, rel_path, src, dst, slots, on_complete
+                )))
+                while pending and pending[0][1].done():
+                    rel_path, future = pending.popleft()
+                    yield rel_path, future.result()
+            
+            while pending:
+                rel_path, future = pending.popleft()
+                yield rel_path, future.result()
+
+
+class ObjectStore:
+    """內容定址物件庫 - 相同內容只寫入一次
+    
+    物件依內容摘要存放於 目的地/objects/ab/cdef...，backup_data 中的檔案是物件的
+    硬連結，瀏覽與還原方式不變。來源中重複的檔案只佔一份空間、只複製一次；
+    搬移或改名的檔案內容已在物件庫中，只需建立新的硬連結，不需重新複製。
+    物件不會被原地改寫，更新 backup_data 一律以新連結原子取代。
+    沒有任何 backup_data 連結的物件（st_nlink == 1）由 collect_garbage 移除。
+    """
+    def __init__(self, target_folder):
+        self.root = os.path.join(target_folder, OBJECT_STORE_DIRNAME)
+        self.temp_dir = os.path.join(self.root, "tmp")
+    
+    def object_path(self, digest):
+        """物件路徑（以摘要前兩碼分資料夾，避免單一資料夾過多檔案）"""
+        return os.path.join(self.root, digest[:2], digest[2:])
+    
+    def clear_temp(self):
+        """清除上次中斷時留下的暫存檔"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def store_file(self, src, dst, buffer_size=None, digest=None):
+        """將來源存入物件庫並於 dst 建立硬連結
+        
+        digest: 已知的來源摘要（內容雜湊模式），未提供時先讀取來源計算；
+                物件已存在時不寫入任何資料
+        回傳: 與 copy_file 相同格式的結果（含 'digest'）
+        """
+        if digest is None:
+            digest = DeltaBackupEngine.compute_hash(src)
+        obj = self.object_path(digest)
+        
+        if os.path.exists(obj):
+            result = {'method': COPY_METHOD_DEDUP, 'size': os.path.getsize(obj), 'written': 0}
+        else:
+            # 先寫入暫存檔再連結到物件路徑；複製途中來源被修改時以實際寫入的內容為準
+            os.makedirs(self.temp_dir, exist_ok=True)
+            temp_path = os.path.join(self.temp_dir, f"{digest}.{get_ident()}")
+            try:
+                if DeltaBackupEngine.starts_with_frame_magic(src):
+                    # 內容以壓縮檔標頭開頭：加上 raw 標頭存放，還原時才不會誤認為壓縮檔
+                    result = DeltaBackupEngine.compress_file(src, temp_path, CODEC_RAW, buffer_size)
+                else:
+                    result = DeltaBackupEngine.copy_file(src, temp_path, buffer_size, digest=True)
+                digest = result['digest']
+                obj = self.object_path(digest)
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                try:
+                    os.link(temp_path, obj)
+                except FileExistsError:
+                    # 其他執行緒已存入相同內容
+                    result.update(method=COPY_METHOD_DEDUP, written=0)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        result['digest'] = digest
+        self._link(obj, dst, buffer_size)
+        return result
+    
+    @staticmethod
+    def _link(obj, dst, buffer_size=None):
+        """以硬連結原子取代 dst；檔案系統不支援硬連結（FAT/exFAT）時改為複製"""
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        temp_dst = f"{dst}.{get_ident()}.dedup-tmp"
+        try:
+            os.link(obj, temp_dst)
+        except FileExistsError:
+            os.remove(temp_dst)
+            os.link(obj, temp_dst)
+        except OSError:
+            DeltaBackupEngine.copy_file(obj, temp_dst, buffer_size)
+        os.replace(temp_dst, dst)
+    
+    def discard(self, digest):
+        """移除物件（例如背景驗證發現內容損壞），下次備份時重新寫入"""
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+    
+    def collect_garbage(self, workers=None):
+        """移除沒有任何 backup_data 連結的物件，回傳 (物件數, 位元組數)"""
+        if not os.path.isdir(self.root):
+            return 0, 0
+        
+        def collect(prefix_dir):
+            removed = freed = 0
+            try:
+                with os.scandir(prefix_dir) as entries:
+                    for entry in entries:
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                            if stat.st_nlink <= 1:
+                                os.remove(entry.path)
+                                removed += 1
+                                freed += stat.st_size
+                        except OSError as e:
+                            print(f"無法清理物件 {entry.path}: {e}")
+            except OSError as e:
+                print(f"無法讀取資料夾 {prefix_dir}: {e}")
+            return removed, freed
+        
+        prefix_dirs = [
+            entry.path for entry in os.scandir(self.root)
+            if entry.is_dir(follow_symlinks=False) and entry.path != self.temp_dir
+        ]
+        with ThreadPoolExecutor(max_workers=workers or SCAN_WORKERS) as pool:
+            results = list(pool.map(collect, prefix_dirs))
+        return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+class PackStore:
+    """小檔案封裝區段 - 大量小檔案依序追加到少數大型區段檔
+    
+    小於 PACK_THRESHOLD 的檔案不在 backup_data 中建立個別檔案，而是追加到
+    目的地/packs/segment-000001.pack，manifest 記錄所在區段（'pack'）與位移（'offset'），
+    長度即為檔案大小。目的地只需循序寫入少數大型檔案，省去逐檔的建立資料夾、
+    建立檔案與設定 metadata；完整性檢查只需 stat 區段檔，還原時依位移讀取。
+    區段只會追加、不會原地改寫；刪除或修改的檔案留下的無效資料由 repack 回收。
+    """
+    def __init__(self, target_folder):
+        self.root = os.path.join(target_folder, PACK_DIRNAME)
+        self._lock = Lock()
+        self._name = None
+        self._file = None
+    
+    def segment_path(self, name):
+        return os.path.join(self.root, name)
+    
+    def list_segments(self):
+        """依編號排序的區段檔名"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            name for name in names
+            if name.startswith(PACK_SEGMENT_PREFIX) and name.endswith(PACK_SEGMENT_SUFFIX)
+        )
+    
+    def _open_segment(self, new=False):
+        """開啟追加用的區段：沿用最後一個未滿的區段，或建立下一個編號"""
+        segments = self.list_segments()
+        if segments and not new and \
+                os.path.getsize(self.segment_path(segments[-1])) < PACK_SEGMENT_SIZE:
+            name = segments[-1]
+        else:
+            number = int(segments[-1][len(PACK_SEGMENT_PREFIX):-len(PACK_SEGMENT_SUFFIX)]) + 1 \
+                if segments else 1
+            name = f"{PACK_SEGMENT_PREFIX}{number:06d}{PACK_SEGMENT_SUFFIX}"
+        os.makedirs(self.root, exist_ok=True)
+        self._file = open(self.segment_path(name), 'ab')
+        self._name = name
+    
+    def _append(self, data, new_segment=False):
+        """追加資料到目前區段（呼叫端需持有鎖），回傳 {'pack': 區段, 'offset': 位移}"""
+        if self._file is None:
+            self._open_segment(new=new_segment)
+        elif self._file.tell() and self._file.tell() + len(data) > PACK_SEGMENT_SIZE:
+            self._close_segment()
+            self._open_segment(new=True)
+        offset = self._file.tell()
+        self._file.write(data)
+        # 寫入作業系統後才回報完成，之後日誌才會記錄這筆位置
+        self._file.flush()
+        return {'pack': self._name, 'offset': offset}
+    
+    def _close_segment(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._name = None
+    
+    def close(self):
+        """將目前區段寫入磁碟並關閉"""
+        with self._lock:
+            self._close_segment()
+    
+    def append_file(self, src, size):
+        """讀取小檔案並追加到區段
+        
+        size: 掃描時的檔案大小；讀到的長度不同（複製途中被修改）時視為驗證失敗，下次重試
+        回傳: 與 copy_file 相同格式的結果，另含 'digest' 與區段位置（'pack'、'offset'）
+        """
+        with open(src, 'rb') as f:
+            data = f.read(size + 1)
+        if len(data) != size:
+            raise Exception(f"檔案驗證失敗: {src} (大小不符)")
+        IO_LIMITER.consume(size)
+        digest = hashlib.new(HASH_ALGORITHM, data).hexdigest()
+        with self._lock:
+            location = self._append(data)
+        return dict(location, method=COPY_METHOD_PACK, size=size, written=size, digest=digest)
+    
+    def iter_chunks(self, info, buffer_size=None):
+        """依 manifest 紀錄讀取封裝的檔案內容（區段被截斷時提早結束）"""
+        remaining = info['size']
+        with open(self.segment_path(info['pack']), 'rb') as f:
+            f.seek(info['offset'])
+            while remaining > 0:
+                chunk = f.read(min(remaining, buffer_size or COPY_BUFFER_SIZE))
+                if not chunk:
+                    break
+                IO_LIMITER.consume(len(chunk))
+                remaining -= len(chunk)
+                yield chunk
+    
+    def read(self, info):
+        return b"".join(self.iter_chunks(info))
+    
+    def restore_file(self, info, dst):
+        """還原單一封裝的檔案，保留修改時間"""
+        IO_LIMITER.consume(ops=1)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        with open(dst, 'wb') as fdst:
+            for chunk in self.iter_chunks(info):
+                fdst.write(chunk)
+        if info.get('mtime_ns') is not None:
+            os.utime(dst, ns=(info['mtime_ns'], info['mtime_ns']))
+        else:
+            mtime = datetime.fromisoformat(info['modified']).timestamp()
+            os.utime(dst, (mtime, mtime))
+    
+    def restore_entries(self, entries, rel_path, dst):
+        """還原 rel_path（檔案或資料夾）下所有封裝的檔案到 dst，回傳還原的檔案數
+        
+        entries: packed_entries 的結果（路徑 -> manifest 紀錄）
+        """
+        restored = 0
+        for path, info in entries.items():
+            if path == rel_path:
+                self.restore_file(info, dst)
+            elif not rel_path or path.startswith(rel_path + os.sep):
+                self.restore_file(info, os.path.join(dst, os.path.relpath(path, rel_path or ".")))
+            else:
+                continue
+            restored += 1
+        return restored
+    
+    @staticmethod
+    def packed_entries(manifest_files):
+        """從 (path, info) 中挑出封裝的檔案，回傳 {路徑: manifest 紀錄}"""
+        return {path: info for path, info in manifest_files if info.get('pack')}
+    
+    def missing_entries(self, entries):
+        """確認封裝的檔案是否完整（每個區段只 stat 一次），回傳缺少的路徑"""
+        sizes = {}
+        missing = []
+        for path, info in entries:
+            name = info['pack']
+            if name not in sizes:
+                try:
+                    sizes[name] = os.path.getsize(self.segment_path(name))
+                except OSError:
+                    sizes[name] = -1
+            if sizes[name] < info['offset'] + info['size']:
+                missing.append(path)
+        return missing
+    
+    def repack(self, manifest, min_live_ratio=None):
+        """重新封裝有效資料比例過低的區段，回傳 (重寫的區段數, 釋放的位元組數)
+        
+        仍被 manifest 參照的檔案依序寫入新的區段，manifest 更新後才刪除舊區段；
+        中途中斷時舊區段仍完整，manifest 不會指向不存在的資料。
+        """
+        if min_live_ratio is None:
+            min_live_ratio = PACK_REPACK_RATIO
+        live = {}
+        for path, info in manifest.iter_files():
+            if info.get('pack'):
+                live.setdefault(info['pack'], []).append((path, info))
+        
+        stale = []
+        for name in self.list_segments():
+            size = os.path.getsize(self.segment_path(name))
+            used = sum(info['size'] for _, info in live.get(name, ()))
+            if used < size * min_live_ratio:
+                stale.append((name, size))
+        if not stale:
+            return 0, 0
+        
+        upserts = {}
+        deletes = []
+        rewritten = 0
+        with self._lock:
+            self._close_segment()
+            new_segment = True
+            for name, _ in stale:
+                for path, info in live.get(name, ()):
+                    try:
+                        data = self.read(info)
+                    except OSError:
+                        data = b""
+                    if len(data) != info['size']:
+                        # 區段已損壞：從 manifest 移除，下次備份時由來源重新複製
+                        deletes.append(path)
+                        continue
+                    upserts[path] = dict(info, **self._append(data, new_segment))
+                    new_segment = False
+                    rewritten += len(data)
+            self._close_segment()
+        
+        if deletes:
+            manifest.bump_generation()
+        if upserts or deletes:
+            manifest.apply_changes(upserts, deletes)
+        for name, _ in stale:
+            os.remove(self.segment_path(name))
+        return len(stale), sum(size for _, size in stale) - rewritten
+
+
+class RetentionPolicy:
+    """快照保留策略 - 取代依檔案修改時間刪除的一年期清理
+    
+    依快照時間由新到舊，保留最近 last 個快照，以及最近 daily 個「有快照的日」、
+    weekly 個週、monthly 個月各自的最後一個快照；同一個快照可同時滿足多個規則。
+    """
+    def __init__(self, last=None, daily=None, weekly=None, monthly=None):
+        self.last = RETENTION_LAST if last is None else last
+        self.daily = RETENTION_DAILY if daily is None else daily
+        self.weekly = RETENTION_WEEKLY if weekly is None else weekly
+        self.monthly = RETENTION_MONTHLY if monthly is None else monthly
+    
+    def select(self, snapshot_times):
+        """回傳要保留的快照時間集合（最新的快照一律保留）"""
+        ordered = sorted(snapshot_times, reverse=True)
+        keep = set(ordered[:max(1, self.last)])
+        rules = (
+            (self.daily, lambda t: t.date()),
+            (self.weekly, lambda t: t.isocalendar()[:2]),
+            (self.monthly, lambda t: (t.year, t.month)),
+        )
+        for limit, bucket_of in rules:
+            buckets = set()
+            for snapshot_time in ordered:
+                if len(buckets) >= limit:
+                    break
+                bucket = bucket_of(snapshot_time)
+                if bucket not in buckets:
+                    buckets.add(bucket)
+                    keep.add(snapshot_time)
+        return keep
+
+
+class SnapshotManager:
+    """版本快照 - 以硬連結建立 backup_data 的時間點副本
+    
+    每個快照是 目的地/snapshots/<時間>/ 下的完整目錄樹，檔案都是 backup_data 的硬連結：
+    未變更的檔案在各快照間共用同一份資料，只有本次變更的檔案佔用新空間。
+    backup_data 中被修改的檔案一律寫入新檔再取代（見 copy_file），刪除只移除
+    backup_data 的連結，因此舊快照的內容不受之後的同步影響。
+    """
+    def __init__(self, target_folder):
+        self.root = os.path.join(target_folder, SNAPSHOT_DIRNAME)
+        self.backup_folder = os.path.join(target_folder, "backup_data")
+    
+    def list(self):
+        """回傳 [(快照時間, 快照路徑), ...]，由舊到新（建立中的快照不列入）"""
+        snapshots = []
+        if not os.path.isdir(self.root):
+            return snapshots
+        for name in os.listdir(self.root):
+            try:
+                snapshot_time = datetime.strptime(name, SNAPSHOT_NAME_FORMAT)
+            except ValueError:
+                continue
+            snapshots.append((snapshot_time, os.path.join(self.root, name)))
+        return sorted(snapshots)
+    
+    def create(self, paths, snapshot_time=None, workers=None):
+        """以 manifest 中的路徑建立快照，回傳快照路徑
+        
+        先建立於暫存名稱，全部連結完成後才改名，中斷時不會留下不完整的快照。
+        目的地不支援硬連結（FAT/exFAT）時拋出錯誤。
+        """
+        snapshot_time = (snapshot_time or datetime.now()).replace(microsecond=0)
+        # 快照名稱精確到秒，同一秒內再次備份時順延
+        while os.path.exists(os.path.join(self.root, snapshot_time.strftime(SNAPSHOT_NAME_FORMAT))):
+            snapshot_time += timedelta(seconds=1)
+        name = snapshot_time.strftime(SNAPSHOT_NAME_FORMAT)
+        final_path = os.path.join(self.root, name)
+        temp_path = os.path.join(self.root, f".{name}.partial")
+        shutil.rmtree(temp_path, ignore_errors=True)
+        
+        paths = list(paths)
+        for rel_dir in {os.path.dirname(path) for path in paths}:
+            os.makedirs(os.path.join(temp_path, rel_dir), exist_ok=True)
+        
+        def link_one(rel_path):
+            try:
+                os.link(os.path.join(self.backup_folder, rel_path), os.path.join(temp_path, rel_path))
+            except FileNotFoundError:
+                # 本次複製失敗、尚未存在於備份的檔案
+                pass
+        
+        try:
+            with ThreadPoolExecutor(max_workers=workers or SCAN_WORKERS) as pool:
+                list(pool.map(link_one, paths))
+        except OSError as e:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise Exception(f"無法建立快照（目的地可能不支援硬連結）: {e}")
+        os.replace(temp_path, final_path)
+        return final_path
+    
+    def prune(self, policy=None):
+        """依保留策略刪除過期快照，回傳刪除的快照名稱"""
+        snapshots = self.list()
+        keep = (policy or RetentionPolicy()).select([t for t, _ in snapshots])
+        removed = []
+        for snapshot_time, path in snapshots:
+            if snapshot_time not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(os.path.basename(path))
+        return removed
+
+
+class BackupScrubber:
+    """背景內容驗證（scrub）- 偵測外接裝置上的位元衰減
+    
+    verify_backup 只比對新增檔案的大小，備份寫入後才損壞的內容永遠不會被發現。
+    此類別依路徑順序重新讀取備份檔案，與 manifest 中的內容摘要比對：
+    - 有摘要：內容不一致即視為損壞
+    - 沒有摘要（非內容雜湊模式備份的檔案）：以目前內容建立基準摘要，之後以此比對
+    損壞或遺失的檔案會從 manifest 移除，下次備份時自動由來源重新複製。
+    
+    每次只驗證約 1/cycle_days 的資料量並限制讀取速率，進度（scrubCursor）
+    記錄於 manifest，下次從中斷處繼續，循環驗證整份備份。
+    """
+    def __init__(self, manifest, backup_folder, rate_limit_mb=None, cycle_days=None,
+                 object_store=None):
+        self.manifest = manifest
+        self.backup_folder = backup_folder
+        # 使用物件庫時，損壞的物件也要移除，否則下次備份會重新連結到同一個損壞的物件
+        self.object_store = object_store
+        self.pack_store = PackStore(os.path.dirname(backup_folder))
+        # 驗證本身的讀取上限；同時受複製、還原共用的 IO_LIMITER 限制
+        self.limiter = RateLimiter(SCRUB_RATE_LIMIT_MB if rate_limit_mb is None else rate_limit_mb)
+        self.cycle_days = cycle_days or SCRUB_CYCLE_DAYS
+    
+    def budget(self):
+        """本次執行的驗證位元組數（總大小的 1/cycle_days，無條件進位）"""
+        total = self.manifest.data.get('totalSize') or 0
+        return -(-total // self.cycle_days)
+    
+    def _hash_file(self, path, info):
+        """限速讀取並計算內容摘要（壓縮存放的檔案以解壓縮後的內容計算，
+        封裝的檔案讀取所在區段的範圍）
+        
+        回傳: (摘要, 原始內容大小)
+        """
+        IO_LIMITER.consume(ops=1)
+        if info.get('pack'):
+            chunks = self.pack_store.iter_chunks(info)
+        else:
+            chunks = DeltaBackupEngine.iter_backup_chunks(os.path.join(self.backup_folder, path))
+        digest = hashlib.new(HASH_ALGORITHM)
+        size = 0
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            self.limiter.consume(len(chunk))
+        return digest.hexdigest(), size
+    
+    def _discard(self, path, info, report, deletes):
+        """記錄損壞的檔案並從 manifest（與物件庫）移除"""
+        report["corrupted"].append(path)
+        deletes.append(path)
+        if self.object_store is not None and info.get('hash'):
+            self.object_store.discard(info['hash'])
+    
+    def run(self, max_bytes=None):
+        """從上次進度繼續驗證，回傳驗證報告
+        
+        max_bytes: 本次驗證的位元組數上限（預設為 budget()），每次至少驗證一個檔案
+        回傳: {'checked', 'bytes', 'baselined', 'corrupted', 'missing', 'passCompleted'}
+        """
+        if max_bytes is None:
+            max_bytes = self.budget()
+        report = {
+            "checked": 0,
+            "bytes": 0,
+            "baselined": 0,
+            "corrupted": [],
+            "missing": [],
+            "passCompleted": False
+        }
+        upserts = {}
+        deletes = []
+        cursor = self.manifest.data.get('scrubCursor')
+        
+        files = self.manifest.iter_files(start_after=cursor)
+        try:
+            for path, info in files:
+                if report["checked"] and report["bytes"] >= max_bytes:
+                    break
+                try:
+                    digest, size = self._hash_file(path, info)
+                    if size != info['size']:
+                        self._discard(path, info, report, deletes)
+                    else:
+                        if not info.get('hash'):
+                            info['hash'] = digest
+                            upserts[path] = info
+                            report["baselined"] += 1
+                        elif digest != info['hash']:
+                            self._discard(path, info, report, deletes)
+                except FileNotFoundError:
+                    report["missing"].append(path)
+                    deletes.append(path)
+                except BackupIntegrityError:
+                    # 壓縮資料損壞
+                    self._discard(path, info, report, deletes)
+                except OSError as e:
+                    print(f"無法驗證檔案 {path}: {e}")
+                report["checked"] += 1
+                report["bytes"] += info['size']
+                cursor = path
+            else:
+                # 已驗證到最後一筆：下次從頭開始新的一輪
+                cursor = None
+                report["passCompleted"] = True
+        finally:
+            files.close()
+        
+        # 驗證不是備份：套用變更後保留上次備份時間
+        last_backup_time = self.manifest.data.get('lastBackupTime')
+        if deletes:
+            # 監看模式的下次備份改為完整掃描，才會重新複製被移除的檔案
+            self.manifest.bump_generation()
+        if upserts or deletes:
+            self.manifest.apply_changes(upserts, deletes)
+        self.manifest.data['lastBackupTime'] = last_backup_time
+        self.manifest.data['scrubCursor'] = cursor
+        if report["passCompleted"]:
+            self.manifest.data['lastScrubPassCompleted'] = datetime.now().isoformat()
+        self.manifest.save()
+        return report
+
+
+class BackupLogger:
+    """備份日誌管理"""
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.history = self._load_history()
+    
+    def _load_history(self):
+        """載入歷史紀錄"""
+        if os.path.exists(self.log_path):
+            try:
+                with open(self.log_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except:
+                return []
+        return []
+    
+    def add_record(self, record):
+        """新增紀錄"""
+        self.history.insert(0, record)
         # 只保留最近100筆
         self.history = self.history[:100]
         self._save_history()
     
-    def _save_history(self):
-        """儲存歷史紀錄"""
-        try:
-            with open(self.log_path, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
-        except:
-            pass
+    def _save_history(self):
+        """儲存歷史紀錄"""
+        try:
+            with open(self.log_path, 'w', encoding='utf-8') as f:
+                json.dump(self.history, f, ensure_ascii=False, indent=2)
+        except:
+            pass
+    
+    def get_recent(self, count=5):
+        """取得最近的紀錄"""
+        return self.history[:count]
+
+
+class BackupCancelled(Exception):
+    """使用者（或 CLI 非互動策略）取消備份"""
+    pass
+
+
+class BackupLockError(Exception):
+    """無法取得備份鎖定（已有備份在進行中或鎖檔無法建立）"""
+    pass
+
+
+class BackupProgress:
+    """備份進度（供圖形介面輪詢、CLI 輸出與歷史紀錄使用）
+    
+    各階段累計已處理的檔案數與位元組數；advance 只更新計數器，
+    事件（進度快照）最多每 interval 秒產生一次並傳給已註冊的 listener，
+    不會拖慢複製迴圈。圖形介面以 snapshot() 隨時讀取目前進度。
+    吞吐量以最近 PROGRESS_WINDOW_SECONDS 秒計算，ETA 依剩餘位元組（沒有總大小時依檔案數）估計。
+    """
+    def __init__(self, interval=None):
+        self.interval = PROGRESS_INTERVAL_SECONDS if interval is None else interval
+        self.phase = None
+        self.phases = {}    # 階段 -> {'files', 'bytes', 'filesTotal', 'bytesTotal', 'started', 'seconds'}
+        self.finished = False
+        self._lock = Lock()
+        self._listeners = []
+        self._last_emit = 0.0
+        self._samples = deque()     # 目前階段的 (時間, 位元組數, 檔案數)
+    
+    def add_listener(self, listener):
+        """listener(event) 於產生事件的執行緒中呼叫（可能是複製執行緒）"""
+        self._listeners.append(listener)
+    
+    def _emit(self, event):
+        for listener in self._listeners:
+            listener(event)
+    
+    def _close_phase(self, now):
+        if self.phase is not None and self.phases[self.phase]['seconds'] is None:
+            stats = self.phases[self.phase]
+            stats['seconds'] = now - stats['started']
+    
+    def start_phase(self, phase, files_total=None, bytes_total=None):
+        """結束目前階段並開始新的階段（總數未知時為 None）"""
+        now = time.monotonic()
+        with self._lock:
+            self._close_phase(now)
+            self.phase = phase
+            self.phases[phase] = {'files': 0, 'bytes': 0, 'filesTotal': files_total,
+                                  'bytesTotal': bytes_total, 'started': now, 'seconds': None}
+            self._samples.clear()
+            self._last_emit = now
+            event = self._snapshot_locked(now)
+        self._emit(event)
+    
+    def advance(self, files=1, nbytes=0):
+        """累計目前階段已處理的檔案與位元組"""
+        now = time.monotonic()
+        with self._lock:
+            if self.phase is None:
+                return
+            stats = self.phases[self.phase]
+            stats['files'] += files
+            stats['bytes'] += nbytes
+            if now - self._last_emit < self.interval:
+                return
+            self._last_emit = now
+            event = self._snapshot_locked(now)
+        self._emit(event)
+    
+    def finish(self):
+        """備份結束（成功或失敗）；重複呼叫時不再產生事件"""
+        now = time.monotonic()
+        with self._lock:
+            if self.finished:
+                return
+            self._close_phase(now)
+            self.finished = True
+            event = self._snapshot_locked(now)
+        self._emit(event)
+    
+    def snapshot(self):
+        """目前進度（與事件相同格式）"""
+        with self._lock:
+            return self._snapshot_locked(time.monotonic())
+    
+    def _snapshot_locked(self, now):
+        event = {"phase": self.phase, "finished": self.finished, "files": 0, "filesTotal": None,
+                 "bytes": 0, "bytesTotal": None, "elapsed": 0.0,
+                 "bytesPerSecond": None, "filesPerSecond": None, "eta": None}
+        if self.phase is None:
+            return event
+        stats = self.phases[self.phase]
+        elapsed = stats['seconds'] if stats['seconds'] is not None else now - stats['started']
+        event.update(files=stats['files'], filesTotal=stats['filesTotal'], bytes=stats['bytes'],
+                     bytesTotal=stats['bytesTotal'], elapsed=elapsed)
+        
+        # 最近一段時間的速率；取樣不足一秒時以整個階段的平均速率計算
+        samples = self._samples
+        samples.append((now, stats['bytes'], stats['files']))
+        while len(samples) > 2 and now - samples[1][0] >= PROGRESS_WINDOW_SECONDS:
+            samples.popleft()
+        start_time, start_bytes, start_files = samples[0]
+        if now - start_time < 1:
+            start_time, start_bytes, start_files = stats['started'], 0, 0
+        span = now - start_time
+        if span <= 0:
+            return event
+        bytes_rate = (stats['bytes'] - start_bytes) / span
+        files_rate = (stats['files'] - start_files) / span
+        event.update(bytesPerSecond=bytes_rate, filesPerSecond=files_rate)
+        if self.finished:
+            return event
+        if stats['bytesTotal'] and bytes_rate > 0:
+            event["eta"] = max(0.0, (stats['bytesTotal'] - stats['bytes']) / bytes_rate)
+        elif stats['filesTotal'] and files_rate > 0:
+            event["eta"] = max(0.0, (stats['filesTotal'] - stats['files']) / files_rate)
+        return event
+    
+    def summary(self):
+        """各階段的耗時與處理量（寫入歷史紀錄）"""
+        with self._lock:
+            return {
+                phase: {"seconds": round(stats['seconds'] if stats['seconds'] is not None
+                                         else time.monotonic() - stats['started'], 3),
+                        "files": stats['files'], "bytes": stats['bytes']}
+                for phase, stats in self.phases.items()
+            }
+    
+    @staticmethod
+    def format(event):
+        """進度的單行文字（圖形介面與 CLI 共用）"""
+        if event["phase"] is None:
+            return "準備中..."
+        text = PROGRESS_PHASE_NAMES.get(event["phase"], event["phase"])
+        if event["filesTotal"] is not None:
+            text += f" | {event['files']}/{event['filesTotal']} 個檔案"
+        elif event["files"]:
+            text += f" | {event['files']} 個檔案"
+        if event["bytesTotal"]:
+            text += f" | {event['bytes'] / 1e6:.1f}/{event['bytesTotal'] / 1e6:.1f} MB"
+        if event["bytesPerSecond"]:
+            text += f" | {event['bytesPerSecond'] / 1e6:.1f} MB/s"
+        if event["eta"] is not None:
+            minutes, seconds = divmod(int(event["eta"]), 60)
+            text += f" | 剩餘約 {minutes} 分 {seconds} 秒" if minutes else f" | 剩餘約 {seconds} 秒"
+        text += f" | 已經過 {int(event['elapsed'])} 秒"
+        return text
+
+
+class BackupRunner:
+    """備份流程（不依賴圖形介面）
+    
+    依序執行：鎖定 → 目的地檢查 → 日誌續傳 → 來源路徑驗證 → 完整性檢查 →
+    差異檢測 → 空間檢查 → 同步 → 驗證 → manifest 更新 → 日誌紀錄。
+    需要使用者決定的情況以回呼函式詢問，圖形介面顯示對話框，
+    CLI 則依命令列指定的非互動策略回答。
+    
+    confirm_source_changed(stored_source, source) -> bool: 來源改變時是否清除紀錄並完整備份
+    confirm_integrity_reset(error) -> bool: 備份不完整時是否清除紀錄並完整備份
+    full_integrity_check: 不論排程，本次都完整檢查備份資料夾
+    full_source_scan: 啟用來源索引時，本次仍重新列出所有來源資料夾
+    app_dir: 來源索引存放的應用資料夾（預設為歷史紀錄所在的資料夾）
+    trigger: 排程觸發原因，記錄於歷史（手動備份為 None）
+    progress: 回報進度的 BackupProgress（預設建立新的實例，可由 self.progress 讀取）
+    """
+    def __init__(self, logger, backup_lock, confirm_source_changed=None,
+                 confirm_integrity_reset=None, full_integrity_check=False,
+                 full_source_scan=False, app_dir=None, trigger=None, progress=None):
+        self.logger = logger
+        self.backup_lock = backup_lock
+        self.confirm_source_changed = confirm_source_changed or (lambda stored, current: False)
+        self.confirm_integrity_reset = confirm_integrity_reset or (lambda error: False)
+        self.full_integrity_check = full_integrity_check
+        self.full_source_scan = full_source_scan
+        self.app_dir = app_dir or os.path.dirname(os.path.abspath(logger.log_path))
+        self.trigger = trigger
+        self.progress = progress or BackupProgress()
+        self.error = None
+    
+    def run(self, source, target):
+        """執行一次備份，回傳寫入歷史的紀錄
+        
+        備份失敗不會拋出錯誤，而是記錄於紀錄並存於 self.error；
+        只有無法取得鎖定時拋出 BackupLockError。
+        """
+        self.error = None
+        
+        # P2-5: 取得備份鎖定
+        try:
+            self.backup_lock.acquire()
+        except Exception as e:
+            # 記錄鎖定衝突到歷史（用於追蹤和排查）
+            conflict_record = {
+                "timestamp": datetime.now().isoformat(),
+                "status": "⚠️ 鎖定衝突",
+                "error": str(e),
+                "lockFile": self.backup_lock.lock_file
+            }
+            self.logger.add_record(conflict_record)
+            self.progress.finish()
+            raise BackupLockError(str(e))
+        
+        try:
+            return self._run_locked(source, target)
+        finally:
+            # P2-5: 釋放備份鎖定
+            self.backup_lock.release()
+    
+    def _run_locked(self, source, target):
+        """已取得鎖定後的備份流程"""
+        # P2-6: 初始化詳細失敗報告
+        failure_report = FailureReport()
+        
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "status": "進行中",
+            "changedFiles": 0,
+            "error": "",
+            "failures": None  # P2-6: 詳細失敗報告
+        }
+        if self.trigger:
+            record["trigger"] = self.trigger
+        if IO_LIMITER.enabled:
+            # 開始時的上限（執行中仍可調整）
+            record["rateLimit"] = IO_LIMITER.limits
+        
+        journal = None
+        full_check_time = None
+        progress = self.progress
+        
+        try:
+            # 檢查目標裝置連接
+            if not os.path.exists(target):
+                raise Exception("❌ 目標位置不存在 - 請檢查外接裝置是否已連接")
+            
+            # 建立目標資料夾
+            backup_folder = os.path.join(target, "backup_data")
+            os.makedirs(backup_folder, exist_ok=True)
+            
+            manifest_path = BackupManifest.locate(target)
+            manifest = BackupManifest.open(manifest_path)
+            
+            # 上次備份中斷時，先將已完成的操作合併回 manifest，只重做剩下的差異
+            journal = ManifestJournal.for_manifest(manifest_path)
+            if journal.exists():
+                record["resumedOperations"] = journal.compact(manifest)
+            # 複製到一半的大型檔案：來源未變時從記錄的位移繼續
+            partials = journal.read_partials()
+            
+            # P1-2: 源路徑驗證（防止同步錯誤資料夾）
+            stored_source = manifest.data.get('sourceFolder', '')
+            # 正規化路徑以支持大小寫差異或格式不同
+            if stored_source:
+                stored_norm = os.path.normcase(os.path.normpath(stored_source))
+                current_norm = os.path.normcase(os.path.normpath(source))
+                paths_differ = stored_norm != current_norm
+            else:
+                paths_differ = False
+            
+            if paths_differ:
+                # 源路徑已改變
+                if self.confirm_source_changed(stored_source, source):
+                    manifest.reset()  # 清除舊紀錄
+                    journal.clear()
+                    old_files = {}
+                else:
+                    raise BackupCancelled("使用者取消備份")
+            else:
+                # P1-1: 備份完整性檢查（驗證上次備份是否真實存在）
+                # 平時只做快速抽樣檢查，排程到期時才完整掃描備份資料夾
+                if manifest.data.get('filesCount'):  # 只有在有舊紀錄時才檢查
+                    progress.start_phase(PHASE_INTEGRITY)
+                    try:
+                        if (self.full_integrity_check
+                                or DeltaBackupEngine.integrity_check_due(manifest.data)):
+                            record["integrityCheck"] = INTEGRITY_CHECK_FULL
+                            DeltaBackupEngine.verify_backup_integrity(
+                                manifest.get_files_dict(), backup_folder
+                            )
+                            full_check_time = datetime.now().isoformat()
+                        else:
+                            record["integrityCheck"] = INTEGRITY_CHECK_SAMPLE
+                            DeltaBackupEngine.sample_backup_integrity(
+                                manifest.iter_files(), backup_folder,
+                                manifest.data['directoryMtimes']
+                            )
+                    except BackupIntegrityError as e:
+                        # 備份不完整，提醒使用者
+                        if self.confirm_integrity_reset(e):
+                            manifest.reset()  # 清除損毀紀錄
+                            journal.clear()
+                            old_files = {}
+                        else:
+                            raise BackupCancelled("使用者取消備份")
+                else:
+                    old_files = {}
+            
+            hash_source = source if CONTENT_HASH_MODE else None
+            dirty_set = DirtySet.for_source(self.app_dir, source)
+            watch_delta = None
+            if STREAMING_DELTA:
+                # 串流模式：排序走訪來源並與 manifest 合併比對，邊掃描邊複製；
+                # 差異大小事先未知，改為複製途中累計檢查空間；
+                # 搬移偵測需要完整的新增與刪除清單，串流模式不支援
+                added = None
+                moves = {}
+                progress.start_phase(PHASE_SYNC)
+                changes = DeltaBackupEngine.iter_changes(
+                    manifest.iter_files(), DeltaBackupEngine.iter_sorted_scan(source), hash_source
+                )
+                available = shutil.disk_usage(target).free
+            else:
+                # 取得舊的檔案清單（如果尚未取得）
+                if 'old_files' not in locals():
+                    old_files = manifest.get_files_dict()
+                
+                # 掃描來源資料夾（只掃描一次，後續各階段共用）：
+                # 監看程式持續記錄變更時只 stat 變動的路徑；
+                # 啟用來源索引時，mtime 未變的資料夾沿用索引中的檔案資訊
+                # （清除紀錄後的完整備份一律完整掃描）
+                # 每掃描完一個資料夾即回報檔案數（事件由 BackupProgress 依間隔合併）
+                progress.start_phase(PHASE_SCAN)
+                # 以讀取當下的世代記錄涵蓋範圍：本次備份中重新封裝移除的紀錄，下次仍會完整掃描
+                watch_delta = dirty_set.consume(
+                    manifest.data.get('manifestGeneration') or 0
+                ) if dirty_set.exists() else None
+                if watch_delta is not None and watch_delta["paths"] is not None and old_files:
+                    new_files = DeltaBackupEngine.apply_dirty_paths(
+                        source, old_files, watch_delta["paths"], on_directory=progress.advance
+                    )
+                    record["sourceScan"] = {"watcher": True, "dirtyPaths": len(watch_delta["paths"])}
+                elif SOURCE_INDEX:
+                    source_index = SourceIndex.for_source(self.app_dir, source)
+                    new_files = source_index.scan(full=self.full_source_scan,
+                                                  on_directory=progress.advance)
+                    record["sourceScan"] = source_index.stats
+                else:
+                    new_files = DeltaBackupEngine.scan_source(
+                        source, on_directory=progress.advance
+                    ).files
+                
+                # 檢測變化
+                added, modified, deleted = DeltaBackupEngine.detect_changes(
+                    old_files, new_files, hash_source=hash_source
+                )
+                
+                # 搬移偵測：配對成功的檔案在 backup_data 內改名，不計入新增與刪除
+                moves = DeltaBackupEngine.detect_moves(added, deleted) if DETECT_MOVES else {}
+                for new_path, old_path in moves.items():
+                    del added[new_path]
+                    del deleted[old_path]
+                
+                # P1-3: 空間預檢查（在複製前驗證，以實際差異大小計算）
+                DeltaBackupEngine.check_disk_space(
+                    source, target,
+                    required_bytes=DeltaBackupEngine.calculate_delta_size(added, modified, deleted)
+                )
+                changes = DeltaBackupEngine.iter_change_events(
+                    added, modified, deleted, old_files, new_files, moves
+                )
+                progress.start_phase(
+                    PHASE_SYNC,
+                    files_total=len(added) + len(modified) + len(deleted) + len(moves),
+                    bytes_total=sum(info['size'] for info in added.values())
+                    + sum(info['size'] for info in modified.values())
+                )
+            
+            # 依差異事件同步：新增/修改交給平行複製管線，刪除與 metadata 更新直接處理。
+            # 每完成一個檔案就寫入日誌，中斷時已完成的部分不需重做
+            journal.record_begin(source, target)
+            error_list = []
+            counts = {CHANGE_ADDED: 0, CHANGE_MODIFIED: 0, CHANGE_DELETED: 0, CHANGE_MOVED: 0}
+            in_flight = {}  # 複製中的檔案: rel_path -> (change, info)
+            requested = set()  # 本次交給複製管線、上次複製到一半的檔案
+            # 修改前可能以個別檔案存放的路徑（封裝時需移除舊備份檔；串流模式不保留舊紀錄，一律視為可能）
+            unpacked_before = set()
+            required_bytes = 0
+            
+            def copy_jobs():
+                nonlocal required_bytes
+                for change, rel_path, info in changes:
+                    if change == CHANGE_MOVED:
+                        old_path = moves[rel_path]
+                        try:
+                            # 封裝的檔案只需更新 manifest 中的路徑
+                            if not info.get('pack'):
+                                DeltaBackupEngine.move_file(
+                                    os.path.join(backup_folder, old_path),
+                                    os.path.join(backup_folder, rel_path)
+                                )
+                            journal.record_delete(old_path)
+                            journal.record_put(rel_path, info)
+                            counts[CHANGE_MOVED] += 1
+                            progress.advance()
+                            continue
+                        except OSError:
+                            # 舊備份不存在或無法改名：改為一般的新增與刪除
+                            change = CHANGE_ADDED
+                            try:
+                                DeltaBackupEngine.delete_file(os.path.join(backup_folder, old_path))
+                                journal.record_delete(old_path)
+                            except Exception as e:
+                                failure_report.record_failure(
+                                    old_path, type(e).__name__, str(e),
+                                    action="skip", severity="warning"
+                                )
+                    if change == CHANGE_METADATA:
+                        journal.record_put(rel_path, info)
+                    elif change == CHANGE_DELETED:
+                        # 刪除已刪除的檔案（同步策略）；封裝的檔案只需從 manifest 移除
+                        try:
+                            if not info.get('pack'):
+                                DeltaBackupEngine.delete_file(os.path.join(backup_folder, rel_path))
+                            journal.record_delete(rel_path)
+                            counts[CHANGE_DELETED] += 1
+                            required_bytes -= info['size']
+                        except Exception as e:
+                            # P2-6: 詳細失敗報告
+                            failure_report.record_failure(
+                                rel_path, type(e).__name__, str(e),
+                                action="skip", severity="warning"
+                            )
+                            error_list.append(f"刪除失敗: {rel_path}")
+                        progress.advance()
+                    else:
+                        counts[change] += 1
+                        required_bytes += info['size']
+                        if STREAMING_DELTA and required_bytes / 0.8 > available:
+                            raise Exception(
+                                f"❌ 磁碟空間不足！\n"
+                                f"需要: {required_bytes / 0.8 / 1e9:.2f} GB 以上 (含 20% 緩衝)\n"
+                                f"可用: {available / 1e9:.2f} GB"
+                            )
+                        in_flight[rel_path] = (change, info)
+                        if change == CHANGE_MODIFIED and \
+                                (added is None or not old_files[rel_path].get('pack')):
+                            unpacked_before.add(rel_path)
+                        if rel_path in partials:
+                            requested.add(rel_path)
+                        yield (rel_path, os.path.join(source, rel_path),
+                               os.path.join(backup_folder, rel_path), info['size'])
+            
+            def on_copied(rel_path, result):
+                info = in_flight[rel_path][1]
+                if 'digest' in result:
+                    # 記錄實際寫入備份的內容摘要
+                    info['hash'] = result['digest']
+                for field in PACK_LOCATION_FIELDS:
+                    if field in result:
+                        info[field] = result[field]
+                journal.record_put(rel_path, info)
+                if journal.should_compact():
+                    journal.compact(manifest)
+            
+            copy_func = None
+            object_store = None
+            compress_pool = None
+            resumed = set()
+            # 物件庫依內容摘要共用檔案，不與壓縮同時使用
+            if DEDUP_STORE:
+                object_store = ObjectStore(target)
+                object_store.clear_temp()
+                
+                def copy_func(src, dst, buffer_size):
+                    # 已知摘要（內容雜湊模式）時不需重新讀取來源
+                    info = in_flight[os.path.relpath(dst, backup_folder)][1]
+                    return object_store.store_file(src, dst, buffer_size, info.get('hash'))
+            
+            elif COMPRESSION_CODEC:
+                # 壓縮是 CPU 密集工作，交給行程池；複製執行緒只負責等待與回報。
+                # 複製執行緒已在執行，以 spawn 啟動子行程，避免 fork 複製到被持有的鎖
+                if COMPRESSION_PROCESSES > 1:
+                    compress_pool = ProcessPoolExecutor(
+                        max_workers=COMPRESSION_PROCESSES,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                
+                def copy_func(src, dst, buffer_size):
+                    info = in_flight[os.path.relpath(dst, backup_folder)][1]
+                    codec = DeltaBackupEngine.select_codec(src, info['size'])
+                    if codec is None:
+                        if not DeltaBackupEngine.starts_with_frame_magic(src):
+                            return DeltaBackupEngine.copy_file(src, dst, buffer_size)
+                        codec = CODEC_RAW
+                    if compress_pool is None or codec == CODEC_RAW:
+                        return DeltaBackupEngine.compress_file(src, dst, codec, buffer_size)
+                    # 各行程平分目前的速率上限（執行中調整時從下一個檔案開始生效）
+                    return compress_pool.submit(
+                        DeltaBackupEngine.compress_in_worker, src, dst, codec, buffer_size,
+                        VERIFY_READBACK, IO_LIMITER.limits["mbPerSecond"] / COMPRESSION_PROCESSES
+                    ).result()
+            
+            elif CHECKPOINT_THRESHOLD:
+                # 可續傳複製：還沒有備份的大型檔案定期記錄進度，中斷後從斷點繼續；
+                # 已有舊備份的檔案仍交給 copy_file（區塊差異複製本身不需重新寫入相同的區塊）
+                def copy_func(src, dst, buffer_size):
+                    rel_path = os.path.relpath(dst, backup_folder)
+                    info = in_flight[rel_path][1]
+                    partial = partials.get(rel_path)
+                    offset = 0
+                    if partial and partial['size'] == info['size'] and \
+                            partial['mtime_ns'] == info.get('mtime_ns') and \
+                            os.path.isfile(dst) and os.path.getsize(dst) >= partial['offset']:
+                        offset = partial['offset']
+                    if info['size'] < CHECKPOINT_THRESHOLD or (not offset and os.path.lexists(dst)):
+                        return DeltaBackupEngine.copy_file(src, dst, buffer_size)
+                    if offset:
+                        resumed.add(rel_path)
+                    return DeltaBackupEngine.resumable_copy(
+                        src, dst, offset,
+                        lambda position: journal.record_partial(rel_path, position, info),
+                        buffer_size
+                    )
+            
+            # 還原與 scrub 一律依標頭判斷是否為壓縮檔：原樣存放的路徑（一般、區塊差異、
+            # 可續傳複製）遇到內容剛好以壓縮檔標頭開頭的檔案時，改為加上 raw 標頭存放
+            # （小於標頭長度的檔案不會被誤認，不需檢查）
+            if not DEDUP_STORE and not COMPRESSION_CODEC:
+                store_as_is = copy_func or DeltaBackupEngine.copy_file
+                
+                def copy_func(src, dst, buffer_size):
+                    info = in_flight[os.path.relpath(dst, backup_folder)][1]
+                    if info['size'] > len(BACKUP_FRAME_MAGIC) and \
+                            DeltaBackupEngine.starts_with_frame_magic(src):
+                        return DeltaBackupEngine.compress_file(src, dst, CODEC_RAW, buffer_size)
+                    return store_as_is(src, dst, buffer_size)
+            
+            # 小檔案封裝：小於門檻的檔案追加到區段檔，其餘依上述方式存放
+            pack_store = None
+            if PACK_THRESHOLD and not SNAPSHOTS:
+                pack_store = PackStore(target)
+                store_unpacked = copy_func or DeltaBackupEngine.copy_file
+                
+                def copy_func(src, dst, buffer_size):
+                    rel_path = os.path.relpath(dst, backup_folder)
+                    info = in_flight[rel_path][1]
+                    if info['size'] >= PACK_THRESHOLD:
+                        return store_unpacked(src, dst, buffer_size)
+                    result = pack_store.append_file(src, info['size'])
+                    # 之前以個別檔案存放（例如剛啟用封裝）：移除舊的備份檔；
+                    # 新增或原本已封裝的檔案不需存取備份資料夾
+                    if rel_path in unpacked_before:
+                        DeltaBackupEngine.delete_file(dst)
+                    return result
+            
+            copy_pipeline = CopyPipeline(copy_func=copy_func)
+            # 複製失敗的檔案不寫入日誌，manifest 維持舊狀態，下次備份時會重試
+            try:
+                for rel_path, error in copy_pipeline.iter_run(copy_jobs(), on_complete=on_copied):
+                    change, info = in_flight.pop(rel_path)
+                    progress.advance(1, info['size'])
+                    if error is None:
+                        continue
+                    # P2-6: 詳細失敗報告
+                    failure_report.record_failure(
+                        rel_path, type(error).__name__, str(error),
+                        action="skip", severity="warning"
+                    )
+                    if change == CHANGE_ADDED:
+                        error_list.append(f"複製失敗: {rel_path}")
+                    else:
+                        error_list.append(f"更新失敗: {rel_path}")
+            finally:
+                if compress_pool is not None:
+                    compress_pool.shutdown()
+                if pack_store is not None:
+                    pack_store.close()
+            
+            # 上次複製到一半、本次不再需要的檔案（來源已刪除）：移除寫到一半的備份與進度
+            for rel_path in partials:
+                if rel_path not in requested:
+                    try:
+                        DeltaBackupEngine.delete_file(os.path.join(backup_folder, rel_path))
+                        journal.record_delete(rel_path)
+                    except Exception as e:
+                        error_list.append(str(e))
+            if resumed:
+                record["resumedFiles"] = len(resumed)
+            
+            # 驗證備份（串流模式不保留新增清單，由 copy_file 的大小驗證涵蓋；
+            # 複製時已計算摘要、重新讀取驗證或壓縮存放時不需再次 stat；
+            # 封裝的檔案不在備份資料夾中，append_file 已確認讀到的大小）
+            if added is not None and not (FUSED_HASH_COPY or VERIFY_READBACK or COMPRESSION_CODEC):
+                to_verify = [path for path, info in added.items() if not info.get('pack')]
+                progress.start_phase(PHASE_VERIFY, files_total=len(to_verify))
+                verify_errors = DeltaBackupEngine.verify_backup(source, backup_folder, to_verify)
+                progress.advance(len(to_verify))
+                if verify_errors:
+                    error_list.extend(verify_errors)
+            
+            # 更新元資料：將日誌合併回 manifest（只寫入本次變更）
+            progress.start_phase(PHASE_FINALIZE)
+            journal.compact(manifest)
+            
+            # 版本快照：有變更（或尚無快照）時建立新的時間點副本，並依保留策略刪除過期快照
+            pruned = []
+            if SNAPSHOTS:
+                snapshots = SnapshotManager(target)
+                try:
+                    if sum(counts.values()) or not snapshots.list():
+                        record["snapshot"] = os.path.basename(
+                            snapshots.create(path for path, _ in manifest.iter_files())
+                        )
+                    pruned = snapshots.prune()
+                    record["snapshotsPruned"] = len(pruned)
+                except Exception as e:
+                    error_list.append(str(e))
+            
+            # 有檔案被刪除、取代或快照被刪除時，清理不再被任何連結參照的物件
+            if object_store is not None and \
+                    (counts[CHANGE_DELETED] or counts[CHANGE_MODIFIED] or pruned):
+                record["objectsCollected"], record["bytesFreed"] = object_store.collect_garbage()
+            
+            # 封裝的檔案被刪除或取代後，重新封裝有效資料過少的區段
+            if pack_store is not None and (counts[CHANGE_DELETED] or counts[CHANGE_MODIFIED]):
+                try:
+                    record["segmentsRepacked"], record["packBytesFreed"] = pack_store.repack(manifest)
+                except Exception as e:
+                    error_list.append(f"區段重新封裝失敗: {e}")
+            
+            # 同步完成後記錄備份資料夾的 mtime 快照，供下次快速完整性檢查比對
+            manifest.record_integrity_state(
+                DeltaBackupEngine.snapshot_directory_mtimes(manifest.iter_files(), backup_folder),
+                full_check_time
+            )
+            
+            # 已處理的變更批次：全部成功時才刪除，複製失敗的路徑下次備份仍會重新檢查
+            if watch_delta is not None and not error_list:
+                dirty_set.acknowledge(watch_delta)
+            
+            # 記錄成功狀態
+            changed_count = sum(counts.values())
+            record["status"] = "✅ 備份完成"
+            record["changedFiles"] = changed_count
+            record["addedFiles"] = counts[CHANGE_ADDED]
+            record["modifiedFiles"] = counts[CHANGE_MODIFIED]
+            record["deletedFiles"] = counts[CHANGE_DELETED]
+            record["movedFiles"] = counts[CHANGE_MOVED]
+            record["copyMethods"] = copy_pipeline.stats['methods']
+            record["bytesCopied"] = copy_pipeline.stats['bytes']
+            record["bytesWritten"] = copy_pipeline.stats['written']
+            
+            if error_list:
+                record["error"] = "; ".join(error_list[:3])  # 只記錄前3個錯誤
+                if len(error_list) > 3:
+                    record["error"] += f" ... 等{len(error_list)-3}個錯誤"
+                record["status"] = "⚠️ 備份完成（有錯誤）"
+            
+            progress.finish()
+            record["phases"] = progress.summary()
+            self.logger.add_record(record)
+            
+        except Exception as e:
+            self.error = e
+            record["status"] = "❌ 備份失敗"
+            record["error"] = str(e)
+            
+            # P2-7: 嘗試備份復原模式
+            # 取消時 manifest 未被修改，不可用新的來源路徑覆寫舊紀錄
+            if not isinstance(e, BackupCancelled):
+                try:
+                    recovery_info = RecoveryMode.recover_from_failed_backup(
+                        BackupManifest.locate(target), journal
+                    )
+                    if recovery_info is not None:
+                        record["recovery_attempted"] = recovery_info
+                except:
+                    pass
+            
+            progress.finish()
+            record["phases"] = progress.summary()
+            self.logger.add_record(record)
+        
+        return record
+
+
+class BackupScheduler:
+    """排程備份觸發器（不建立執行緒，由呼叫端定期呼叫 poll）
+    
+    觸發來源：每隔 interval_minutes 分鐘、每日 times 中的固定時刻、目的地從不存在變為存在，
+    以及變更監看程式寫入新的變更批次（提供 dirty_set 時）。
+    觸發後等待 debounce_seconds 秒沒有新的觸發才開始備份；備份進行中、其他程序持有
+    BackupLock 或目的地不存在時，觸發保留為一次待執行的備份，不會累積。
+    
+    poll() 回傳觸發原因時由呼叫端執行備份，結束後呼叫 finished()。
+    """
+    def __init__(self, target, interval_minutes=None, times=None, on_mount=None,
+                 debounce_seconds=None, max_delay_seconds=None, backup_lock=None,
+                 dirty_set=None, now=None):
+        now = time.time() if now is None else now
+        self.target = target
+        self.interval = 60 * (SCHEDULE_INTERVAL_MINUTES if interval_minutes is None else interval_minutes)
+        self.times = [self.parse_time(value) for value in (SCHEDULE_TIMES if times is None else times)]
+        self.on_mount = SCHEDULE_ON_MOUNT if on_mount is None else on_mount
+        self.debounce = SCHEDULE_DEBOUNCE_SECONDS if debounce_seconds is None else debounce_seconds
+        self.max_delay = SCHEDULE_MAX_DELAY_SECONDS if max_delay_seconds is None else max_delay_seconds
+        self.backup_lock = backup_lock
+        self.dirty_set = dirty_set
+        
+        self.running = False
+        self.pending = None             # 待執行備份的觸發原因
+        self.first_trigger = None
+        self.last_trigger = None
+        self.last_run = now
+        self._next_time = self._next_time_of_day(now)
+        self._mounted = self._target_available()
+        self._seen_batches = set(dirty_set.list_batches()) if dirty_set is not None else set()
+    
+    @staticmethod
+    def parse_time(value):
+        """'HH:MM' -> (時, 分)"""
+        try:
+            hour, minute = (int(part) for part in value.split(":"))
+        except ValueError:
+            raise ValueError(f"排程時刻格式錯誤（應為 HH:MM）: {value}")
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"排程時刻超出範圍: {value}")
+        return hour, minute
+    
+    def _next_time_of_day(self, now):
+        """now 之後最近的固定時刻（timestamp），沒有設定時為 None"""
+        if not self.times:
+            return None
+        current = datetime.fromtimestamp(now)
+        candidates = []
+        for hour, minute in self.times:
+            moment = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if moment.timestamp() <= now:
+                moment += timedelta(days=1)
+            candidates.append(moment.timestamp())
+        return min(candidates)
+    
+    def _target_available(self):
+        """目的地是否存在（外接裝置未接上時，掛載點下的目的地資料夾不存在）"""
+        return os.path.isdir(self.target)
+    
+    def trigger(self, reason, now=None):
+        """記錄一次觸發；已有待執行的備份時只延後開始時間"""
+        now = time.time() if now is None else now
+        if self.pending is None:
+            self.pending = reason
+            self.first_trigger = now
+        self.last_trigger = now
+    
+    def _collect_triggers(self, now):
+        if self.interval and now - self.last_run >= self.interval:
+            # 以本次觸發時間重新計時，避免備份執行期間重複觸發
+            self.last_run = now
+            self.trigger("interval", now)
+        if self._next_time is not None and now >= self._next_time:
+            self._next_time = self._next_time_of_day(now)
+            self.trigger("time", now)
+        mounted = self._target_available()
+        if self.on_mount and mounted and not self._mounted:
+            self.trigger("mount", now)
+        self._mounted = mounted
+        if self.dirty_set is not None:
+            batches = set(self.dirty_set.list_batches())
+            if batches - self._seen_batches:
+                self.trigger("changes", now)
+            # 備份失敗時批次不會被刪除，只有新的批次才再次觸發
+            self._seen_batches = batches
+    
+    def poll(self, now=None, busy=False):
+        """檢查觸發條件，應開始備份時回傳觸發原因，否則回傳 None
+        
+        busy: 呼叫端已有其他備份在進行（例如手動備份），觸發保留到下次 poll
+        """
+        now = time.time() if now is None else now
+        self._collect_triggers(now)
+        if self.pending is None or self.running or busy or not self._mounted:
+            return None
+        if now - self.last_trigger < self.debounce and now - self.first_trigger < self.max_delay:
+            return None
+        if self.backup_lock is not None and self.backup_lock.holder() is not None:
+            return None
+        reason = self.pending
+        self.pending = None
+        self.running = True
+        return reason
+    
+    def finished(self, now=None):
+        """備份結束（不論成功與否）；執行期間的觸發於下次 poll 再合併處理"""
+        self.running = False
+        self.last_run = time.time() if now is None else now
     
-    def get_recent(self, count=5):
-        """取得最近的紀錄"""
-        return self.history[:count]
+    @staticmethod
+    def lower_priority():
+        """降低目前執行緒的 CPU 與 I/O 優先權，回傳實際套用的設定
+        
+        Linux 上 nice 與 I/O 優先權以執行緒為單位，之後建立的執行緒（複製、掃描）會繼承；
+        其他 POSIX 平台 nice 套用於整個程序。
+        """
+        applied = {"nice": None, "ioprio": None}
+        if hasattr(os, "nice"):
+            try:
+                applied["nice"] = os.nice(SCHEDULE_NICE)
+            except OSError:
+                pass
+        if sys.platform.startswith("linux"):
+            import ctypes
+            import platform
+            # ioprio_set 沒有 libc 包裝函式，以系統呼叫編號呼叫
+            syscall_number = {"x86_64": 251, "aarch64": 30, "i386": 289, "i686": 289}.get(platform.machine())
+            if syscall_number is not None:
+                ioprio = (SCHEDULE_IOPRIO_CLASS << 13) | SCHEDULE_IOPRIO_LEVEL
+                libc = ctypes.CDLL(None, use_errno=True)
+                # IOPRIO_WHO_PROCESS = 1；pid 0 = 目前執行緒
+                if libc.syscall(syscall_number, 1, 0, ioprio) == 0:
+                    applied["ioprio"] = (SCHEDULE_IOPRIO_CLASS, SCHEDULE_IOPRIO_LEVEL)
+        return applied
 
 
 class BackupToolGUI:
     """備份工具GUI"""
     
     def __init__(self, root):
+        _load_tkinter()
         self.root = root
         self.root.title("簡易差異備份工具 v1.2")
         self.root.geometry("650x750")
@@ -517,9 +4132,15 @@ class BackupToolGUI:
         self.source_folder = tk.StringVar()
         self.target_folder = tk.StringVar()
         self.backup_running = False
+        self.schedule_enabled = tk.BooleanVar(value=False)
+        self.scheduler = None
+        self.schedule_poll_job = None   # 已排入的 _poll_schedule（root.after 的 id）
+        self.progress = None
+        self.rate_limit_mb = tk.DoubleVar(value=IO_LIMITER.limits["mbPerSecond"])
+        self.rate_limit_ops = tk.DoubleVar(value=IO_LIMITER.limits["opsPerSecond"])
         
         # 初始化日誌和清單
-        self.log_dir = os.path.expanduser("~\\.backup_tool")
+        self.log_dir = DEFAULT_APP_DIR
         os.makedirs(self.log_dir, exist_ok=True)
         self.manifest = BackupManifest(os.path.join(self.log_dir, "manifest.json"))
         self.logger = BackupLogger(os.path.join(self.log_dir, "history.json"))
@@ -574,7 +4195,7 @@ class BackupToolGUI:
         action_label.pack(anchor=tk.W, pady=(0, 5))
         
         action_frame = ttk.Frame(main_frame)
-        action_frame.pack(fill=tk.X, pady=(0, 15))
+        action_frame.pack(fill=tk.X, pady=(0, 5))
         
         self.backup_btn = ttk.Button(action_frame, text="開始備份", command=self._on_backup_click, width=20)
         self.backup_btn.pack(side=tk.LEFT, padx=(0, 10))
@@ -582,6 +4203,21 @@ class BackupToolGUI:
         self.restore_btn = ttk.Button(action_frame, text="恢復檔案", command=self._on_restore_click, width=20)
         self.restore_btn.pack(side=tk.LEFT)
         
+        ttk.Checkbutton(action_frame, text="排程自動備份", variable=self.schedule_enabled,
+                        command=self._on_schedule_toggle).pack(side=tk.LEFT, padx=(10, 0))
+        
+        # 限速（備份進行中調整也會立即生效）
+        limit_frame = ttk.Frame(main_frame)
+        limit_frame.pack(fill=tk.X, pady=(0, 15))
+        ttk.Label(limit_frame, text="限速（0 = 不限）：").pack(side=tk.LEFT)
+        for variable, unit in ((self.rate_limit_mb, "MB/s"), (self.rate_limit_ops, "檔案/秒")):
+            spinbox = ttk.Spinbox(limit_frame, from_=0, to=10000, increment=5, width=6,
+                                  textvariable=variable, command=self._apply_rate_limits)
+            spinbox.bind("<Return>", lambda event: self._apply_rate_limits())
+            spinbox.bind("<FocusOut>", lambda event: self._apply_rate_limits())
+            spinbox.pack(side=tk.LEFT, padx=(5, 2))
+            ttk.Label(limit_frame, text=unit).pack(side=tk.LEFT, padx=(0, 10))
+        
         # === 最新結果區域 ===
         result_label = ttk.Label(main_frame, text="📋 最新結果", font=("微軟正黑體", 11, "bold"))
         result_label.pack(anchor=tk.W, pady=(0, 5))
@@ -644,27 +4280,83 @@ class BackupToolGUI:
         thread = Thread(target=self._backup_worker, args=(source, target), daemon=True)
         thread.start()
     
-    def _backup_worker(self, source, target):
-        """備份工作執行緒"""
+    def _apply_rate_limits(self):
+        """套用限速設定（輸入不是數字時忽略）"""
+        try:
+            IO_LIMITER.set_limits(self.rate_limit_mb.get(), self.rate_limit_ops.get())
+        except (tk.TclError, ValueError):
+            pass
+    
+    def _on_schedule_toggle(self):
+        """啟用或停用排程備份（設定由 SCHEDULE_* 常數決定）
+        
+        同一時間只保留一個排入的檢查：切換時先取消上次排入的 _poll_schedule，
+        在檢查間隔內停用再啟用不會產生重複的檢查迴圈。
+        """
+        if self.schedule_poll_job is not None:
+            self.root.after_cancel(self.schedule_poll_job)
+            self.schedule_poll_job = None
+        if not self.schedule_enabled.get():
+            self.scheduler = None
+            return
+        target = self.target_folder.get().strip()
+        if not self.source_folder.get().strip() or not target:
+            messagebox.showerror("錯誤", "請設定來源和目標資料夾")
+            self.schedule_enabled.set(False)
+            return
+        self.scheduler = BackupScheduler(target, backup_lock=self.backup_lock)
+        self.schedule_poll_job = self.root.after(SCHEDULE_POLL_SECONDS * 1000, self._poll_schedule)
+    
+    def _poll_schedule(self):
+        """定期檢查排程（在主執行緒），觸發時於背景執行備份"""
+        self.schedule_poll_job = None
+        scheduler = self.scheduler
+        if scheduler is None:
+            return
+        source = self.source_folder.get().strip()
+        # 設定變更時以新的目的地重新排程
+        if scheduler.target != self.target_folder.get().strip():
+            scheduler = self.scheduler = BackupScheduler(self.target_folder.get().strip(),
+                                                         backup_lock=self.backup_lock)
+        trigger = scheduler.poll(busy=self.backup_running)
+        if trigger is not None:
+            if os.path.isdir(source):
+                Thread(target=self._backup_worker, args=(source, scheduler.target, trigger),
+                       daemon=True).start()
+            else:
+                scheduler.finished()
+        self.schedule_poll_job = self.root.after(SCHEDULE_POLL_SECONDS * 1000, self._poll_schedule)
+    
+    def _backup_worker(self, source, target, trigger=None):
+        """備份工作執行緒（流程由 BackupRunner 執行，此處只負責圖形介面互動）
+        
+        trigger 不為 None 時為排程備份：以低優先權執行，需要確認的情況一律中止，不顯示對話框
+        """
         self.backup_running = True
         self.backup_btn.config(state=tk.DISABLED)
         self.restore_btn.config(state=tk.DISABLED)
         
-        # P2-5: 取得備份鎖定
+        self.progress = BackupProgress()
+        if trigger is None:
+            runner = BackupRunner(
+                self.logger, self.backup_lock,
+                confirm_source_changed=self._confirm_source_changed,
+                confirm_integrity_reset=self._confirm_integrity_reset,
+                progress=self.progress
+            )
+        else:
+            # 只在 Linux 降低優先權：其他平台 nice 套用於整個程序，會連帶拖慢圖形介面
+            if SCHEDULE_LOW_PRIORITY and sys.platform.startswith("linux"):
+                BackupScheduler.lower_priority()
+            runner = BackupRunner(self.logger, self.backup_lock, trigger=trigger,
+                                  progress=self.progress)
+        self.root.after(0, self._poll_progress)
+        
         try:
-            self.backup_lock.acquire()
-        except Exception as e:
+            runner.run(source, target)
+        except BackupLockError as e:
             error_msg = str(e)
             
-            # 記錄鎖定衝突到歷史（用於追蹤和排查）
-            conflict_record = {
-                "timestamp": datetime.now().isoformat(),
-                "status": "⚠️ 鎖定衝突",
-                "error": error_msg,
-                "lockFile": self.backup_lock.lock_file
-            }
-            self.logger.add_record(conflict_record)
-            
             # 提供友善且可操作的提示
             if "備份已在進行中" in error_msg:
                 user_prompt = (
@@ -679,209 +4371,46 @@ class BackupToolGUI:
             else:
                 user_prompt = f"❌ 備份鎖定錯誤：{error_msg}"
             
-            messagebox.showwarning("備份狀態提示", user_prompt)
-            
-            self.backup_running = False
-            self.backup_btn.config(state=tk.NORMAL)
-            self.restore_btn.config(state=tk.NORMAL)
-            
-            # 更新 UI 以反映最新狀態
-            self.root.after(0, self._update_result_display)
-            self.root.after(0, self._update_history_display)
-            return
-        
-        # P2-6: 初始化詳細失敗報告
-        failure_report = FailureReport()
-        
-        record = {
-            "timestamp": datetime.now().isoformat(),
-            "status": "進行中",
-            "changedFiles": 0,
-            "error": "",
-            "failures": None  # P2-6: 詳細失敗報告
-        }
-        
-        try:
-            # 檢查目標裝置連接
-            if not os.path.exists(target):
-                raise Exception("❌ 目標位置不存在 - 請檢查外接裝置是否已連接")
-            
-            # P1-3: 空間預檢查（在複製前驗證）
-            try:
-                DeltaBackupEngine.check_disk_space(source, target)
-            except Exception as e:
-                raise Exception(str(e))
-            
-            # 建立目標資料夾
-            backup_folder = os.path.join(target, "backup_data")
-            os.makedirs(backup_folder, exist_ok=True)
-            
-            manifest_path = os.path.join(target, ".backup_manifest")
-            manifest = BackupManifest(manifest_path)
-            
-            # P1-2: 源路徑驗證（防止同步錯誤資料夾）
-            stored_source = manifest.data.get('sourceFolder', '')
-            # 正規化路徑以支持大小寫差異或格式不同
-            if stored_source:
-                stored_norm = os.path.normcase(os.path.normpath(stored_source))
-                current_norm = os.path.normcase(os.path.normpath(source))
-                paths_differ = stored_norm != current_norm
-            else:
-                paths_differ = False
-            
-            if paths_differ:
-                # 源路徑已改變
-                response = messagebox.askyesno(
-                    "⚠️ 來源資料夾已改變",
-                    f"來源資料夾已改變：\n"
-                    f"舊: {stored_source}\n"
-                    f"新: {source}\n\n"
-                    f"將執行完整備份（舊備份紀錄會被清除）。\n"
-                    f"確認繼續？"
-                )
-                if response:
-                    manifest.reset()  # 清除舊紀錄
-                    old_files = {}
-                else:
-                    raise Exception("使用者取消備份")
-            else:
-                # P1-1: 備份完整性檢查（驗證上次備份是否真實存在）
-                manifest_files = manifest.get_files_dict()
-                if manifest_files:  # 只有在有舊紀錄時才檢查
-                    try:
-                        DeltaBackupEngine.verify_backup_integrity(manifest_files, backup_folder)
-                    except BackupIntegrityError as e:
-                        # 備份不完整，提醒使用者
-                        response = messagebox.askyesno(
-                            "⚠️ 備份不完整",
-                            f"{str(e)}\n\n"
-                            f"備份可能已損毀或被刪除。\n"
-                            f"要重新執行完整備份嗎？"
-                        )
-                        if response:
-                            manifest.reset()  # 清除損毀紀錄
-                            old_files = {}
-                        else:
-                            raise Exception("使用者取消備份")
-                else:
-                    old_files = {}
-            
-            # 掃描來源資料夾
-            new_files = DeltaBackupEngine.scan_folder(source)
-            
-            # 取得舊的檔案清單（如果尚未取得）
-            if 'old_files' not in locals():
-                old_files = manifest.get_files_dict()
-            
-            # 檢測變化
-            added, modified, deleted = DeltaBackupEngine.detect_changes(old_files, new_files)
-            
-            # 複製新增和修改的檔案
-            backup_files = {}
-            error_list = []
-            
-            for rel_path in added:
-                try:
-                    src = os.path.join(source, rel_path)
-                    dst = os.path.join(backup_folder, rel_path)
-                    DeltaBackupEngine.copy_file(src, dst)
-                    backup_files[rel_path] = new_files[rel_path]
-                except Exception as e:
-                    # P2-6: 詳細失敗報告
-                    failure_report.record_failure(
-                        rel_path, type(e).__name__, str(e),
-                        action="skip", severity="warning"
-                    )
-                    error_list.append(f"複製失敗: {rel_path}")
-            
-            for rel_path in modified:
-                try:
-                    src = os.path.join(source, rel_path)
-                    dst = os.path.join(backup_folder, rel_path)
-                    DeltaBackupEngine.copy_file(src, dst)
-                    backup_files[rel_path] = new_files[rel_path]
-                except Exception as e:
-                    # P2-6: 詳細失敗報告
-                    failure_report.record_failure(
-                        rel_path, type(e).__name__, str(e),
-                        action="skip", severity="warning"
-                    )
-                    error_list.append(f"更新失敗: {rel_path}")
-            
-            # 刪除已刪除的檔案（同步策略）
-            for rel_path in deleted:
-                try:
-                    dst = os.path.join(backup_folder, rel_path)
-                    DeltaBackupEngine.delete_file(dst)
-                except Exception as e:
-                    # P2-6: 詳細失敗報告
-                    failure_report.record_failure(
-                        rel_path, type(e).__name__, str(e),
-                        action="skip", severity="warning"
-                    )
-                    error_list.append(f"刪除失敗: {rel_path}")
-            
-            # 記錄所有仍存在的檔案
-            for rel_path in new_files:
-                if rel_path not in error_list:
-                    backup_files[rel_path] = new_files[rel_path]
-            
-            # 驗證備份
-            verify_errors = DeltaBackupEngine.verify_backup(source, backup_folder, added.keys())
-            if verify_errors:
-                error_list.extend(verify_errors)
-            
-            # 更新元資料
-            manifest.update(source, target, backup_files)
-            
-            # 記錄成功狀態
-            changed_count = len(added) + len(modified) + len(deleted)
-            record["status"] = "✅ 備份完成"
-            record["changedFiles"] = changed_count
-            record["addedFiles"] = len(added)
-            record["modifiedFiles"] = len(modified)
-            record["deletedFiles"] = len(deleted)
-            
-            if error_list:
-                record["error"] = "; ".join(error_list[:3])  # 只記錄前3個錯誤
-                if len(error_list) > 3:
-                    record["error"] += f" ... 等{len(error_list)-3}個錯誤"
-                record["status"] = "⚠️ 備份完成（有錯誤）"
-            
-            self.logger.add_record(record)
-            
-            # 在主執行緒更新UI
-            self.root.after(0, self._update_result_display)
-            self.root.after(0, self._update_history_display)
-            
-        except Exception as e:
-            record["status"] = "❌ 備份失敗"
-            record["error"] = str(e)
-            
-            # P2-7: 嘗試備份復原模式
-            try:
-                backup_folder = os.path.join(target, "backup_data")
-                manifest_path = os.path.join(target, ".backup_manifest")
-                if os.path.exists(backup_folder) and os.path.exists(manifest_path):
-                    recovery_info = RecoveryMode.recover_from_failed_backup(
-                        backup_folder, manifest_path, source
-                    )
-                    record["recovery_attempted"] = recovery_info
-            except:
-                pass
-            
-            self.logger.add_record(record)
-            self.root.after(0, self._update_result_display)
-            self.root.after(0, self._update_history_display)
-            self.root.after(0, lambda: messagebox.showerror("備份錯誤", str(e)))
-        
+            # 排程備份遇到鎖定衝突時不打擾使用者，衝突已記錄於歷史
+            if trigger is None:
+                messagebox.showwarning("備份狀態提示", user_prompt)
         finally:
-            # P2-5: 釋放備份鎖定
-            self.backup_lock.release()
-            
             self.backup_running = False
             self.backup_btn.config(state=tk.NORMAL)
             self.restore_btn.config(state=tk.NORMAL)
+            # 排程狀態只在主執行緒修改（與 _poll_schedule 相同）
+            scheduler = self.scheduler
+            if trigger is not None and scheduler is not None:
+                self.root.after(0, scheduler.finished)
+        
+        # 在主執行緒更新UI
+        self.root.after(0, self._update_result_display)
+        self.root.after(0, self._update_history_display)
+        if runner.error is not None and trigger is None:
+            error = runner.error
+            self.root.after(0, lambda: messagebox.showerror("備份錯誤", str(error)))
+    
+    @staticmethod
+    def _confirm_source_changed(stored_source, source):
+        """來源資料夾改變時詢問使用者是否執行完整備份"""
+        return messagebox.askyesno(
+            "⚠️ 來源資料夾已改變",
+            f"來源資料夾已改變：\n"
+            f"舊: {stored_source}\n"
+            f"新: {source}\n\n"
+            f"將執行完整備份（舊備份紀錄會被清除）。\n"
+            f"確認繼續？"
+        )
+    
+    @staticmethod
+    def _confirm_integrity_reset(error):
+        """備份不完整時詢問使用者是否重新執行完整備份"""
+        return messagebox.askyesno(
+            "⚠️ 備份不完整",
+            f"{str(error)}\n\n"
+            f"備份可能已損毀或被刪除。\n"
+            f"要重新執行完整備份嗎？"
+        )
     
     def _on_restore_click(self):
         """恢復檔案按鈕點擊"""
@@ -896,15 +4425,41 @@ class BackupToolGUI:
             messagebox.showerror("錯誤", "備份資料不存在")
             return
         
+        # 封裝的小檔案不在 backup_data 中，由 manifest 取得所在區段
+        try:
+            packed = PackStore.packed_entries(
+                BackupManifest.open(BackupManifest.locate(target, migrate=False)).iter_files()
+            )
+        except Exception:
+            packed = {}
+        
         # 開啟恢復嚮導
-        self._show_restore_wizard(backup_folder)
+        self._show_restore_wizard(backup_folder, SnapshotManager(target).list(),
+                                  PackStore(target), packed)
     
-    def _show_restore_wizard(self, backup_folder):
-        """恢復嚮導"""
+    def _show_restore_wizard(self, backup_folder, snapshots=(), pack_store=None, packed=None):
+        """恢復嚮導
+        
+        snapshots: SnapshotManager.list() 的結果，可選擇恢復到某個時間點的版本
+        pack_store, packed: 目前備份中封裝的小檔案（PackStore.packed_entries 的結果）
+        """
+        packed = packed or {}
         restore_window = tk.Toplevel(self.root)
         restore_window.title("恢復檔案")
         restore_window.geometry("600x500")
         
+        # 選擇版本（目前備份或歷史快照）
+        versions = {"目前備份": backup_folder}
+        for snapshot_time, snapshot_path in reversed(snapshots):
+            versions[snapshot_time.strftime("%Y-%m-%d %H:%M:%S")] = snapshot_path
+        version = tk.StringVar(value="目前備份")
+        if snapshots:
+            version_frame = ttk.Frame(restore_window)
+            version_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+            ttk.Label(version_frame, text="版本：", font=("微軟正黑體", 10)).pack(side=tk.LEFT)
+            ttk.Combobox(version_frame, textvariable=version, values=list(versions),
+                         state="readonly", width=25).pack(side=tk.LEFT)
+        
         # 選擇要恢復的資料夾
         ttk.Label(restore_window, text="選擇要恢復的資料夾或檔案：", font=("微軟正黑體", 10, "bold")).pack(anchor=tk.W, padx=10, pady=10)
         
@@ -915,21 +4470,53 @@ class BackupToolGUI:
         tree = ttk.Treeview(tree_frame, height=15)
         tree.pack(fill=tk.BOTH, expand=True)
         
-        # 填充檔案樹
-        def populate_tree(parent, path, item=''):
+        # 填充檔案樹（節點的 values 記錄相對路徑）
+        nodes = {}
+        
+        def populate_tree(path, item='', rel_dir=''):
             for item_name in os.listdir(path):
                 item_path = os.path.join(path, item_name)
-                node = tree.insert(item, 'end', text=item_name, open=False)
+                rel_path = os.path.join(rel_dir, item_name)
+                node = tree.insert(item, 'end', text=item_name, values=(rel_path,), open=False)
+                nodes[rel_path] = node
                 if os.path.isdir(item_path):
-                    populate_tree(item_path, node)
+                    populate_tree(item_path, node, rel_path)
+        
+        def populate_packed():
+            # 封裝的檔案只屬於目前備份，依路徑補上所需的資料夾節點
+            for rel_path in sorted(packed):
+                parts = rel_path.split(os.sep)
+                parent = ''
+                for depth in range(1, len(parts)):
+                    rel_dir = os.sep.join(parts[:depth])
+                    if rel_dir not in nodes:
+                        nodes[rel_dir] = tree.insert(parent, 'end', text=parts[depth - 1],
+                                                     values=(rel_dir,), open=False)
+                    parent = nodes[rel_dir]
+                nodes[rel_path] = tree.insert(parent, 'end', text=parts[-1], values=(rel_path,))
+        
+        def fill_tree():
+            tree.delete(*tree.get_children())
+            nodes.clear()
+            populate_tree(versions[version.get()])
+            if version.get() == "目前備份":
+                populate_packed()
         
         try:
-            populate_tree('', backup_folder)
+            fill_tree()
         except:
             messagebox.showerror("錯誤", "無法讀取備份資料")
             restore_window.destroy()
             return
         
+        def change_version(*args):
+            try:
+                fill_tree()
+            except:
+                messagebox.showerror("錯誤", "無法讀取備份資料")
+        
+        version.trace_add("write", change_version)
+        
         # 選擇目標位置
         ttk.Label(restore_window, text="恢復到：", font=("微軟正黑體", 10)).pack(anchor=tk.W, padx=10)
         
@@ -964,15 +4551,18 @@ class BackupToolGUI:
             # 簡單實現：複製選中項目
             try:
                 for item in selection:
-                    item_text = tree.item(item, 'text')
-                    src_path = os.path.join(backup_folder, item_text)
-                    dst_path = os.path.join(restore_path, item_text)
+                    rel_path = str(tree.item(item, 'values')[0])
+                    src_path = os.path.join(versions[version.get()], rel_path)
+                    dst_path = os.path.join(restore_path, str(tree.item(item, 'text')))
                     
+                    # 壓縮存放的檔案自動解壓縮
                     if os.path.isdir(src_path):
-                        shutil.copytree(src_path, dst_path, dirs_exist_ok=True)
-                    else:
-                        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                        shutil.copy2(src_path, dst_path)
+                        DeltaBackupEngine.restore_tree(src_path, dst_path)
+                    elif os.path.exists(src_path):
+                        DeltaBackupEngine.restore_file(src_path, dst_path)
+                    # 封裝的檔案依區段位置讀取
+                    if packed and version.get() == "目前備份":
+                        pack_store.restore_entries(packed, rel_path, dst_path)
                 
                 messagebox.showinfo("成功", "檔案恢復完成")
                 restore_window.destroy()
@@ -982,6 +4572,21 @@ class BackupToolGUI:
         ttk.Button(button_frame, text="確認恢復", command=do_restore).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="取消", command=restore_window.destroy).pack(side=tk.LEFT)
     
+    def _poll_progress(self):
+        """備份進行中定期於「最新結果」顯示進度（在主執行緒）"""
+        progress = self.progress
+        if progress is None:
+            return
+        event = progress.snapshot()
+        if event["finished"]:
+            # 結束後由 _update_result_display 顯示結果
+            return
+        self.result_text.config(state=tk.NORMAL)
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(1.0, "⏳ 備份進行中\n" + BackupProgress.format(event).replace(" | ", "\n", 1))
+        self.result_text.config(state=tk.DISABLED)
+        self.root.after(PROGRESS_POLL_MS, self._poll_progress)
+    
     def _update_result_display(self):
         """更新最新結果顯示"""
         self.result_text.config(state=tk.NORMAL)
@@ -1019,8 +4624,8 @@ class BackupToolGUI:
                 status_str = record.get('status', '未知')
                 
                 # 根據記錄類型格式化顯示
-                if '鎖定衝突' in status_str:
-                    # 鎖定衝突的簡要顯示
+                if '鎖定衝突' in status_str or '快照清理失敗' in status_str:
+                    # 鎖定衝突與清理失敗的簡要顯示
                     line = f"{time_str} | {status_str}\n"
                 else:
                     # 正常備份的詳細顯示
@@ -1036,36 +4641,297 @@ class BackupToolGUI:
         self.history_text.config(state=tk.DISABLED)
     
     def _cleanup_old_backups(self):
-        """清理超過1年的備份"""
+        """依保留策略清理過期的版本快照
+        
+        backup_data 是來源的鏡像，不依檔案修改時間刪除（長期未修改的檔案仍是有效備份）；
+        歷史版本由快照保存，過期與否由 RetentionPolicy 決定。
+        與備份共用鎖定（排程或其他程序正在建立快照時略過）；
+        使用物件庫時一併清理只被過期快照參照的物件。失敗時記錄於歷史。
+        """
+        target = self.target_folder.get().strip()
+        if not target or not os.path.exists(target):
+            return
         try:
-            target = self.target_folder.get().strip()
-            if not target or not os.path.exists(target):
-                return
-            
-            backup_folder = os.path.join(target, "backup_data")
-            if not os.path.exists(backup_folder):
-                return
-            
-            one_year_ago = datetime.now() - timedelta(days=365)
-            
-            for root, dirs, files in os.walk(backup_folder, topdown=False):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                        if file_time < one_year_ago:
-                            os.remove(file_path)
-                    except:
-                        pass
-        except:
-            pass
+            self.backup_lock.acquire()
+        except Exception:
+            # 已有備份在進行中，下次啟動再清理
+            return
+        try:
+            pruned = SnapshotManager(target).prune()
+            object_store = ObjectStore(target)
+            if pruned and DEDUP_STORE and os.path.isdir(object_store.root):
+                object_store.collect_garbage()
+        except Exception as e:
+            self.logger.add_record({
+                "timestamp": datetime.now().isoformat(),
+                "status": "⚠️ 快照清理失敗",
+                "error": str(e)
+            })
+            self._update_history_display()
+        finally:
+            self.backup_lock.release()
 
 
 def main():
+    # 帶有命令列參數時以 CLI 執行（python src/backup_tool.py backup 來源 目的地）
+    if len(sys.argv) > 1:
+        sys.exit(cli_main())
+    
+    _load_tkinter()
     root = tk.Tk()
     app = BackupToolGUI(root)
     root.mainloop()
 
 
+def _build_cli_parser():
+    """建立命令列參數解析器"""
+    parser = argparse.ArgumentParser(
+        prog="backup-tool-cli",
+        description="簡易差異備份工具 - 命令列模式（不需要圖形介面）"
+    )
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR,
+                        help=f"日誌與鎖檔資料夾（預設: {DEFAULT_APP_DIR}）")
+    parser.add_argument("--rate-mb", type=float,
+                        help=f"複製、刪除、驗證的讀寫速率上限 MB/s（預設: {IO_RATE_LIMIT_MB}，0 = 不限速）")
+    parser.add_argument("--rate-ops", type=float,
+                        help=f"每秒檔案操作上限（預設: {IO_RATE_LIMIT_OPS}，0 = 不限制）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    backup = subparsers.add_parser("backup", help="執行一次同步備份")
+    backup.add_argument("source", help="來源資料夾")
+    backup.add_argument("target", help="目的地（外接裝置）")
+    backup.add_argument("--on-source-changed", choices=(POLICY_ABORT, POLICY_RESET),
+                        default=POLICY_ABORT,
+                        help="來源資料夾與上次不同時：abort=中止（預設），reset=清除紀錄並完整備份")
+    backup.add_argument("--on-integrity-failure", choices=(POLICY_ABORT, POLICY_RESET),
+                        default=POLICY_ABORT,
+                        help="備份不完整時：abort=中止（預設），reset=清除紀錄並完整備份")
+    backup.add_argument("--full-check", action="store_true",
+                        help="不論排程，本次完整檢查備份資料夾（預設平時只抽樣檢查）")
+    backup.add_argument("--full-scan", action="store_true",
+                        help="啟用來源索引時，本次仍重新列出所有來源資料夾")
+    backup.add_argument("--json", action="store_true", help="以 JSON 輸出備份紀錄")
+    backup.add_argument("--progress", action="store_true", help="備份進行中將進度輸出到標準錯誤")
+    
+    scrub = subparsers.add_parser("scrub", help="重新讀取部分備份檔案，驗證內容是否損壞")
+    scrub.add_argument("target", help="目的地（外接裝置）")
+    scrub.add_argument("--rate", type=float, default=SCRUB_RATE_LIMIT_MB,
+                       help=f"讀取速率上限 MB/s（預設: {SCRUB_RATE_LIMIT_MB}，0 = 不限速）")
+    scrub.add_argument("--cycle-days", type=int, default=SCRUB_CYCLE_DAYS,
+                       help=f"每次驗證總大小的 1/N（預設: {SCRUB_CYCLE_DAYS}）")
+    scrub.add_argument("--all", action="store_true", help="本次驗證全部剩餘檔案")
+    scrub.add_argument("--json", action="store_true", help="以 JSON 輸出驗證報告")
+    
+    snapshots = subparsers.add_parser("snapshots", help="列出版本快照")
+    snapshots.add_argument("target", help="目的地（外接裝置）")
+    snapshots.add_argument("--prune", action="store_true", help="依保留策略刪除過期快照")
+    
+    watch = subparsers.add_parser("watch", help="持續監看來源變更（Linux），備份時只檢查變動的路徑")
+    watch.add_argument("source", help="來源資料夾")
+    
+    schedule = subparsers.add_parser("schedule", help="常駐執行排程備份（定時、固定時刻、裝置接上時）")
+    schedule.add_argument("source", help="來源資料夾")
+    schedule.add_argument("target", help="目的地（外接裝置）")
+    schedule.add_argument("--interval", type=float, default=SCHEDULE_INTERVAL_MINUTES,
+                          help=f"每隔幾分鐘備份一次（預設: {SCHEDULE_INTERVAL_MINUTES}，0 = 不定時）")
+    schedule.add_argument("--at", action="append", metavar="HH:MM",
+                          help="每日固定時刻備份（可重複指定）")
+    schedule.add_argument("--no-mount", action="store_true", help="目的地裝置接上時不自動備份")
+    schedule.add_argument("--on-changes", action="store_true",
+                          help="watch 子命令記錄到新的變更時備份")
+    schedule.add_argument("--debounce", type=float, default=SCHEDULE_DEBOUNCE_SECONDS,
+                          help=f"觸發後等待幾秒沒有新的觸發才開始（預設: {SCHEDULE_DEBOUNCE_SECONDS}）")
+    schedule.add_argument("--normal-priority", action="store_true", help="不降低 CPU 與 I/O 優先權")
+    return parser
+
+
+def cli_main(argv=None):
+    """CLI 進入點（不載入 tkinter），回傳結束代碼
+    
+    結束代碼: 0 = 完成，1 = 完成但有錯誤，2 = 備份失敗，3 = 已有備份在進行中
+    """
+    args = _build_cli_parser().parse_args(argv)
+    os.makedirs(args.app_dir, exist_ok=True)
+    IO_LIMITER.set_limits(args.rate_mb, args.rate_ops)
+    logger = BackupLogger(os.path.join(args.app_dir, "history.json"))
+    backup_lock = BackupLock(os.path.join(args.app_dir, ".backup.lock"))
+    
+    if args.command == "backup":
+        # 以絕對路徑記錄於 manifest，避免不同工作目錄被誤判為來源改變
+        args.source = os.path.abspath(args.source)
+        args.target = os.path.abspath(args.target)
+        if not os.path.isdir(args.source):
+            print(f"錯誤: 來源資料夾不存在: {args.source}", file=sys.stderr)
+            return 2
+        
+        runner = BackupRunner(
+            logger, backup_lock,
+            confirm_source_changed=lambda stored, current: args.on_source_changed == POLICY_RESET,
+            confirm_integrity_reset=lambda error: args.on_integrity_failure == POLICY_RESET,
+            full_integrity_check=args.full_check,
+            full_source_scan=args.full_scan,
+            app_dir=args.app_dir
+        )
+        if args.progress:
+            runner.progress.add_listener(
+                lambda event: print(BackupProgress.format(event), file=sys.stderr, flush=True)
+            )
+        try:
+            record = runner.run(args.source, args.target)
+        except BackupLockError as e:
+            print(f"錯誤: {e}", file=sys.stderr)
+            return 3
+        
+        _cli_print_record(record, args.json)
+        if runner.error is not None:
+            return 2
+        return 1 if record.get("error") else 0
+    
+    if args.command == "scrub":
+        return _cli_scrub(args, backup_lock)
+    
+    if args.command == "snapshots":
+        snapshots = SnapshotManager(os.path.abspath(args.target))
+        if args.prune:
+            try:
+                backup_lock.acquire()
+            except Exception as e:
+                print(f"錯誤: {e}", file=sys.stderr)
+                return 3
+            try:
+                pruned = snapshots.prune()
+                for name in pruned:
+                    print(f"已刪除: {name}")
+                object_store = ObjectStore(os.path.abspath(args.target))
+                if pruned and DEDUP_STORE and os.path.isdir(object_store.root):
+                    collected, freed = object_store.collect_garbage()
+                    print(f"已清理 {collected} 個物件（{freed / 1e6:.1f} MB）")
+            finally:
+                backup_lock.release()
+        for snapshot_time, path in snapshots.list():
+            print(f"{snapshot_time.strftime('%Y-%m-%d %H:%M:%S')}  {path}")
+        return 0
+    
+    if args.command == "watch":
+        # 與備份使用相同的絕對路徑，才能對應到同一份變更紀錄
+        source = os.path.abspath(args.source)
+        if not ChangeWatcher.available():
+            print("錯誤: 變更監看只支援 Linux（inotify）", file=sys.stderr)
+            return 2
+        if not os.path.isdir(source):
+            print(f"錯誤: 來源資料夾不存在: {source}", file=sys.stderr)
+            return 2
+        import signal
+        stop_event = Event()
+        # 服務管理程式以 SIGTERM 停止時也要寫入最後一批變更與停止狀態
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        print(f"👀 監看 {source}（Ctrl+C 停止）")
+        ChangeWatcher(source, DirtySet.for_source(args.app_dir, source)).run(stop_event)
+        return 0
+    
+    if args.command == "schedule":
+        return _cli_schedule(args, logger, backup_lock)
+    
+    return 2
+
+
+def _cli_print_record(record, as_json=False):
+    """輸出一次備份的紀錄"""
+    if as_json:
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+        return
+    print(f"{record['status']} | 新增: {record.get('addedFiles', 0)} | "
+          f"修改: {record.get('modifiedFiles', 0)} | 刪除: {record.get('deletedFiles', 0)} | "
+          f"搬移: {record.get('movedFiles', 0)}")
+    if record.get("error"):
+        print(f"錯誤: {record['error']}", file=sys.stderr)
+
+
+def _cli_schedule(args, logger, backup_lock):
+    """CLI schedule 子命令：常駐到 Ctrl+C 或 SIGTERM，需要確認的情況一律中止"""
+    source = os.path.abspath(args.source)
+    target = os.path.abspath(args.target)
+    if not os.path.isdir(source):
+        print(f"錯誤: 來源資料夾不存在: {source}", file=sys.stderr)
+        return 2
+    try:
+        scheduler = BackupScheduler(
+            target, interval_minutes=args.interval, times=args.at or (),
+            on_mount=not args.no_mount, debounce_seconds=args.debounce, backup_lock=backup_lock,
+            dirty_set=DirtySet.for_source(args.app_dir, source) if args.on_changes else None
+        )
+    except ValueError as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 2
+    
+    import signal
+    stop_event = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    if not args.normal_priority:
+        # 在建立任何工作執行緒之前降低優先權，之後的執行緒都會繼承
+        BackupScheduler.lower_priority()
+    
+    print(f"⏰ 排程備份 {source} → {target}（Ctrl+C 停止）")
+    try:
+        while not stop_event.is_set():
+            trigger = scheduler.poll()
+            if trigger is not None:
+                runner = BackupRunner(logger, backup_lock, app_dir=args.app_dir, trigger=trigger)
+                try:
+                    _cli_print_record(runner.run(source, target))
+                except BackupLockError as e:
+                    print(f"錯誤: {e}", file=sys.stderr)
+                finally:
+                    scheduler.finished()
+            stop_event.wait(SCHEDULE_POLL_SECONDS)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _cli_scrub(args, backup_lock):
+    """CLI scrub 子命令：與備份共用鎖定，避免同時修改 manifest"""
+    target = os.path.abspath(args.target)
+    manifest_path = BackupManifest.locate(target, migrate=False)
+    if not os.path.exists(manifest_path):
+        print(f"錯誤: 找不到備份紀錄: {manifest_path}", file=sys.stderr)
+        return 2
+    
+    try:
+        backup_lock.acquire()
+    except Exception as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 3
+    try:
+        manifest = BackupManifest.open(manifest_path)
+        # 上次備份中斷時先合併日誌，確保驗證的是最新的檔案清單
+        journal = ManifestJournal.for_manifest(manifest_path)
+        if journal.exists():
+            journal.compact(manifest)
+        object_store = ObjectStore(target)
+        scrubber = BackupScrubber(
+            manifest, os.path.join(target, "backup_data"),
+            rate_limit_mb=args.rate, cycle_days=args.cycle_days,
+            object_store=object_store if os.path.isdir(object_store.root) else None
+        )
+        report = scrubber.run(max_bytes=float('inf') if args.all else None)
+    except Exception as e:
+        print(f"錯誤: 驗證失敗: {e}", file=sys.stderr)
+        return 2
+    finally:
+        backup_lock.release()
+    
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"🔍 驗證 {report['checked']} 個檔案 ({report['bytes'] / 1e6:.1f} MB) | "
+              f"建立摘要: {report['baselined']} | 損壞: {len(report['corrupted'])} | "
+              f"遺失: {len(report['missing'])}"
+              + (" | 已完成一輪完整驗證" if report['passCompleted'] else ""))
+        for path in report['corrupted'] + report['missing']:
+            print(f"  {path}（已從紀錄移除，下次備份將重新複製）", file=sys.stderr)
+    return 1 if report['corrupted'] or report['missing'] else 0
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+備份工具效能基準測試
+
+產生合成資料夾（大量小檔案、少量大型檔案、深層巢狀、中日韓檔名），
+分別計時掃描、差異檢測、複製吞吐量、manifest 讀寫與完整性檢查，
+結果以 JSON 輸出，方便比較不同版本之間的效能變化。
+
+用法:
+    python tests/benchmark_backup.py                      # 結果輸出到標準輸出
+    python tests/benchmark_backup.py --output bench.json  # 結果寫入檔案
+    python tests/benchmark_backup.py --scale 5 --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+
+# 新增模組路徑
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from backup_tool import DeltaBackupEngine, BackupManifest
+
+
+# 合成資料夾設定（乘上 --scale）
+SMALL_FILES = 2000          # 小檔案數量
+SMALL_FILE_SIZE = 4 * 1024  # 小檔案大小上限（位元組）
+HUGE_FILES = 2              # 大型檔案數量
+HUGE_FILE_SIZE = 32 * 1024 * 1024
+DEEP_LEVELS = 40            # 深層巢狀層數
+CJK_FILES = 200             # 中日韓檔名的檔案數量
+CJK_NAMES = ["報告", "資料夾", "写真", "ファイル", "문서", "備份紀錄", "測試檔案"]
+
+
+def generate_tree(root, scale, seed=0):
+    """產生合成資料夾，回傳各類型的檔案數量"""
+    rng = random.Random(seed)
+    counts = {}
+
+    # 大量小檔案（分散在 100 個資料夾）
+    small = SMALL_FILES * scale
+    for i in range(small):
+        folder = os.path.join(root, "small", f"d{i % 100:03d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"f{i:06d}.txt"), 'wb') as f:
+            f.write(rng.randbytes(rng.randint(1, SMALL_FILE_SIZE)))
+    counts["small"] = small
+
+    # 少量大型檔案
+    huge_folder = os.path.join(root, "huge")
+    os.makedirs(huge_folder, exist_ok=True)
+    block = rng.randbytes(1024 * 1024)
+    for i in range(HUGE_FILES):
+        with open(os.path.join(huge_folder, f"image{i}.bin"), 'wb') as f:
+            for _ in range(HUGE_FILE_SIZE * scale // len(block)):
+                f.write(block)
+    counts["huge"] = HUGE_FILES
+
+    # 深層巢狀
+    deep = os.path.join(root, "deep")
+    for level in range(DEEP_LEVELS):
+        deep = os.path.join(deep, f"L{level}")
+    os.makedirs(deep, exist_ok=True)
+    with open(os.path.join(deep, "leaf.txt"), 'w', encoding='utf-8') as f:
+        f.write("深層檔案")
+    counts["deep"] = 1
+
+    # 中日韓檔名
+    cjk = CJK_FILES * scale
+    for i in range(cjk):
+        name = CJK_NAMES[i % len(CJK_NAMES)]
+        folder = os.path.join(root, "多語系", f"{name}{i % 10}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{name}_{i}.txt"), 'w', encoding='utf-8') as f:
+            f.write(name * rng.randint(1, 50))
+    counts["cjk"] = cjk
+
+    return counts
+
+
+def measure(func, repeat, setup=None):
+    """重複執行並回傳計時統計（秒）；setup 於每次計時前執行、不列入計時"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+        "runs": len(timings),
+    }, result
+
+
+def mutate_files(files_info, ratio, seed=1):
+    """複製一份檔案清單並修改其中一部分，模擬上次備份的 manifest"""
+    rng = random.Random(seed)
+    old_files = {path: dict(info) for path, info in files_info.items()}
+    for path in rng.sample(sorted(old_files), int(len(old_files) * ratio)):
+        old_files[path]['size'] += 1
+    return old_files
+
+
+def run_benchmarks(workdir, scale, repeat):
+    """執行所有基準測試並回傳結果字典"""
+    source = os.path.join(workdir, "source")
+    target = os.path.join(workdir, "target")
+    backup_folder = os.path.join(target, "backup_data")
+    os.makedirs(source)
+    os.makedirs(backup_folder)
+
+    results = {}
+    start = time.perf_counter()
+    tree = generate_tree(source, scale)
+    results["generate"] = {"seconds": time.perf_counter() - start, "files": tree}
+
+    # 掃描：單執行緒與平行掃描分開計時
+    stats, files_info = measure(lambda: DeltaBackupEngine.scan_folder(source, workers=1), repeat)
+    results["scan_folder_serial"] = dict(stats, files=len(files_info))
+    stats, files_info = measure(lambda: DeltaBackupEngine.scan_folder(source), repeat)
+    results["scan_folder_parallel"] = dict(stats, files=len(files_info))
+    stats, _ = measure(lambda: sum(1 for _ in DeltaBackupEngine.iter_sorted_scan(source)), repeat)
+    results["iter_sorted_scan"] = stats
+
+    # 差異檢測（10% 檔案視為修改）
+    old_files = mutate_files(files_info, 0.1)
+    stats, changes = measure(lambda: DeltaBackupEngine.detect_changes(old_files, files_info), repeat)
+    results["detect_changes"] = dict(stats, modified=len(changes[1]))
+
+    # 複製吞吐量：小檔案與大型檔案分開計算
+    for label, prefix in (("copy_small", "small" + os.sep), ("copy_huge", "huge" + os.sep)):
+        paths = [path for path in files_info if path.startswith(prefix)]
+        total_bytes = sum(files_info[path]['size'] for path in paths)
+        methods = {}
+
+        def copy_all():
+            for path in paths:
+                result = DeltaBackupEngine.copy_file(
+                    os.path.join(source, path), os.path.join(backup_folder, path)
+                )
+                methods[result['method']] = methods.get(result['method'], 0) + 1
+
+        def clear_copies():
+            shutil.rmtree(os.path.join(backup_folder, prefix), ignore_errors=True)
+
+        stats, _ = measure(copy_all, repeat, setup=clear_copies)
+        results[label] = dict(
+            stats,
+            files=len(paths),
+            bytes=total_bytes,
+            mb_per_second=total_bytes / 1e6 / stats["median"] if stats["median"] else None,
+            files_per_second=len(paths) / stats["median"] if stats["median"] else None,
+            methods=methods,
+        )
+
+    # 其餘檔案也複製到備份，供完整性檢查使用
+    for path in files_info:
+        dst = os.path.join(backup_folder, path)
+        if not os.path.exists(dst):
+            DeltaBackupEngine.copy_file(os.path.join(source, path), dst)
+
+    # manifest 讀寫：JSON 與 SQLite 格式分開計時
+    for label, manifest_path in (("manifest_json", os.path.join(target, ".backup_manifest")),
+                                 ("manifest_sqlite", os.path.join(target, ".backup_manifest.db"))):
+        manifest = BackupManifest.open(manifest_path)
+        stats, _ = measure(lambda: manifest.update(source, target, files_info), repeat)
+        results[f"{label}_save"] = stats
+        stats, _ = measure(lambda: BackupManifest.open(manifest_path).get_files_dict(), repeat)
+        results[f"{label}_load"] = dict(stats, bytes=os.path.getsize(manifest_path))
+
+    # 完整性檢查
+    manifest_files = BackupManifest.open(os.path.join(target, ".backup_manifest.db")).get_files_dict()
+    stats, _ = measure(
+        lambda: DeltaBackupEngine.verify_backup_integrity(manifest_files, backup_folder), repeat
+    )
+    results["verify_backup_integrity"] = stats
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="備份工具效能基準測試")
+    parser.add_argument("--scale", type=int, default=1, help="合成資料夾的規模倍數")
+    parser.add_argument("--repeat", type=int, default=3, help="每項測試重複次數")
+    parser.add_argument("--output", help="結果 JSON 檔案路徑（預設輸出到標準輸出）")
+    parser.add_argument("--workdir", help="測試資料夾位置（預設為系統暫存資料夾）")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "repeat": args.repeat,
+    }
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        report["results"] = run_benchmarks(workdir, args.scale, args.repeat)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
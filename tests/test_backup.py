@@ -8,13 +8,19 @@ import os
 import sys
 import tempfile
 import shutil
+import hashlib
+import time
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # 新增模組路徑
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from backup_tool import DeltaBackupEngine, BackupManifest, BackupLogger
+from backup_tool import (
+    DeltaBackupEngine, BackupManifest, BackupLogger, CopyPipeline, SqliteManifest,
+    ManifestJournal, BackupRunner, BackupLock, BackupScrubber, ObjectStore, PackStore,
+    RetentionPolicy, SnapshotManager, BackupIntegrityError, cli_main
+)
 
 def test_delta_backup():
     """測試差異備份功能"""
@@ -175,11 +181,1672 @@ def test_logger():
     print("\n✅ 日誌系統測試通過\n")
 
 
+def test_scan_result_delta_size():
+    """測試單次掃描結果與差異空間計算"""
+    print("=" * 60)
+    print("測試 4: 單次掃描結果共用")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        os.makedirs(os.path.join(source, "sub"))
+        with open(os.path.join(source, "a.bin"), 'wb') as f:
+            f.write(b"a" * 100)
+        with open(os.path.join(source, "sub", "b.bin"), 'wb') as f:
+            f.write(b"b" * 50)
+        
+        print("\n[步驟1] 掃描來源資料夾...")
+        scan_result = DeltaBackupEngine.scan_source(source)
+        assert len(scan_result) == 2
+        assert scan_result.total_size == 150
+        print(f"✅ 掃描完成: {len(scan_result)} 個檔案, {scan_result.total_size} bytes")
+        
+        print("\n[步驟2] 以差異大小檢查空間...")
+        old_files = {
+            os.path.join("sub", "b.bin"): scan_result.files[os.path.join("sub", "b.bin")],
+            "gone.bin": {"size": 30, "modified": "2026-01-01T00:00:00"}
+        }
+        added, modified, deleted = DeltaBackupEngine.detect_changes(old_files, scan_result.files)
+        required = DeltaBackupEngine.calculate_delta_size(added, modified, deleted)
+        assert required == 70
+        assert DeltaBackupEngine.check_disk_space(source, tmpdir, required_bytes=required)
+        print(f"✅ 差異所需空間: {required} bytes")
+    
+    print("\n✅ 單次掃描測試通過\n")
+
+
+def test_parallel_scan():
+    """測試 os.scandir 平行掃描與單執行緒掃描結果一致"""
+    print("=" * 60)
+    print("測試 5: 平行資料夾掃描")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print("\n[步驟1] 建立多層資料夾...")
+        expected = set()
+        for i in range(5):
+            for j in range(3):
+                rel_path = os.path.join(f"d{i}", f"s{j}", f"檔案{i}{j}.txt")
+                file_path = os.path.join(tmpdir, rel_path)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    f.write("x" * (i + j))
+                expected.add(rel_path)
+        
+        print("[步驟2] 比較單執行緒與多執行緒掃描...")
+        serial = DeltaBackupEngine.scan_folder(tmpdir, workers=1)
+        parallel = DeltaBackupEngine.scan_folder(tmpdir, workers=4)
+        assert set(serial) == expected
+        assert serial == parallel
+        print(f"✅ 兩種掃描結果一致: {len(parallel)} 個檔案")
+    
+    print("\n✅ 平行掃描測試通過\n")
+
+
+def test_copy_pipeline():
+    """測試平行複製管線與失敗順序"""
+    print("=" * 60)
+    print("測試 6: 平行複製管線")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        os.makedirs(source)
+        
+        print("\n[步驟1] 建立小檔案與大檔案...")
+        jobs = []
+        for i in range(20):
+            rel_path = os.path.join(f"d{i % 3}", f"f{i}.bin")
+            size = 2048 if i % 5 == 0 else 16
+            src = os.path.join(source, rel_path)
+            if i not in (4, 9):  # 兩個來源不存在的檔案，模擬複製失敗
+                os.makedirs(os.path.dirname(src), exist_ok=True)
+                with open(src, 'wb') as f:
+                    f.write(b"z" * size)
+            jobs.append((rel_path, src, os.path.join(target, rel_path), size))
+        
+        print("[步驟2] 平行複製...")
+        results = CopyPipeline(small_workers=4, large_workers=1, large_threshold=1024).run(jobs)
+        assert [r[0] for r in results] == [j[0] for j in jobs]
+        failed = [rel_path for rel_path, error in results if error is not None]
+        assert failed == [jobs[4][0], jobs[9][0]]
+        for rel_path, src, dst, size in jobs:
+            if rel_path not in failed:
+                assert os.path.getsize(dst) == size
+        print(f"✅ 複製完成: {len(jobs) - len(failed)} 成功, {len(failed)} 失敗（依順序回報）")
+    
+    print("\n✅ 平行複製測試通過\n")
+
+
+def test_copy_engine():
+    """測試核心加速複製與分塊複製"""
+    print("=" * 60)
+    print("測試 7: 複製引擎")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "src.bin")
+        data = os.urandom(300 * 1024)
+        with open(src, 'wb') as f:
+            f.write(data)
+        
+        print("\n[步驟1] 以預設引擎複製...")
+        dst = os.path.join(tmpdir, "out", "dst.bin")
+        result = DeltaBackupEngine.copy_file(src, dst)
+        with open(dst, 'rb') as f:
+            assert f.read() == data
+        assert result['size'] == len(data)
+        assert result['method'] in ("reflink", "copy_file_range", "sendfile", "chunked")
+        print(f"✅ 複製方式: {result['method']}")
+        
+        print("[步驟2] 以小緩衝區分塊複製...")
+        dst2 = os.path.join(tmpdir, "out", "dst2.bin")
+        with open(src, 'rb') as fsrc, open(dst2, 'wb') as fdst:
+            DeltaBackupEngine._chunked_copy(fsrc, fdst, 4096)
+        with open(dst2, 'rb') as f:
+            assert f.read() == data
+        print("✅ 分塊複製內容一致")
+        
+        print("[步驟3] 核心複製第一次就回傳 0 時改用分塊複製...")
+        dst3 = os.path.join(tmpdir, "out", "dst3.bin")
+        with open(src, 'rb') as fsrc, open(dst3, 'wb') as fdst:
+            assert not DeltaBackupEngine._try_kernel_copy(fsrc, fdst, lambda in_fd, out_fd, count: 0)
+            DeltaBackupEngine._chunked_copy(fsrc, fdst, 4096)
+        with open(dst3, 'rb') as f:
+            assert f.read() == data
+        empty = os.path.join(tmpdir, "empty.bin")
+        open(empty, 'wb').close()
+        with open(empty, 'rb') as fsrc, open(dst3, 'wb') as fdst:
+            assert DeltaBackupEngine._try_kernel_copy(fsrc, fdst, lambda in_fd, out_fd, count: 0)
+        print("✅ 沒有複製任何資料時不視為成功")
+    
+    print("\n✅ 複製引擎測試通過\n")
+
+
+def test_content_hash_mode():
+    """測試內容雜湊模式的差異檢測與雜湊快取"""
+    print("=" * 60)
+    print("測試 8: 內容雜湊模式")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        touched = os.path.join(tmpdir, "touched.txt")
+        rewritten = os.path.join(tmpdir, "rewritten.txt")
+        for path in (touched, rewritten):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("原始內容")
+        
+        print("\n[步驟1] 首次掃描並建立摘要...")
+        files_v1 = DeltaBackupEngine.scan_folder(tmpdir)
+        added, _, _ = DeltaBackupEngine.detect_changes({}, files_v1, hash_source=tmpdir)
+        assert len(added) == 2 and all('hash' in info for info in files_v1.values())
+        
+        print("[步驟2] 只 touch 一個檔案，另一個保留 mtime 改寫內容...")
+        stat = os.stat(rewritten)
+        os.utime(touched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+        # 模擬同步工具：寫入暫存檔後以保留的 mtime 取代原檔（inode 改變）
+        with open(rewritten + ".tmp", 'w', encoding='utf-8') as f:
+            f.write("修改內容")
+        os.utime(rewritten + ".tmp", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(rewritten + ".tmp", rewritten)
+        
+        files_v2 = DeltaBackupEngine.scan_folder(tmpdir)
+        added, modified, deleted = DeltaBackupEngine.detect_changes(
+            files_v1, files_v2, hash_source=tmpdir
+        )
+        assert not added and not deleted
+        assert list(modified) == ["rewritten.txt"]
+        assert files_v2["touched.txt"]['hash'] == files_v1["touched.txt"]['hash']
+        print("✅ touch 不觸發複製，保留 mtime 的修改被偵測")
+        
+        print("[步驟3] 確認 metadata 不變時沿用快取摘要...")
+        files_v3 = DeltaBackupEngine.scan_folder(tmpdir)
+        files_v2["touched.txt"]['hash'] = "cached"
+        DeltaBackupEngine.detect_changes(files_v2, files_v3, hash_source=tmpdir)
+        assert files_v3["touched.txt"]['hash'] == "cached"
+        print("✅ 雜湊快取生效")
+    
+    print("\n✅ 內容雜湊模式測試通過\n")
+
+
+def test_block_delta_copy():
+    """測試大型檔案的區塊差異複製"""
+    print("=" * 60)
+    print("測試 9: 區塊差異複製")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "disk.img")
+        dst = os.path.join(tmpdir, "backup", "disk.img")
+        block = 4096
+        data = bytearray(os.urandom(block * 16))
+        with open(src, 'wb') as f:
+            f.write(data)
+        DeltaBackupEngine.copy_file(src, dst)
+        
+        print("\n[步驟1] 修改一個區塊並截短檔案...")
+        data[block * 5:block * 5 + 10] = b"0123456789"
+        del data[block * 15 + 100:]
+        with open(src, 'wb') as f:
+            f.write(data)
+        
+        print("[步驟2] 執行區塊差異複製...")
+        result = DeltaBackupEngine.block_delta_copy(src, dst, block_size=block)
+        with open(dst, 'rb') as f:
+            assert f.read() == bytes(data)
+        assert result['method'] == "block_delta"
+        assert result['size'] == len(data)
+        assert result['written'] == block
+        print(f"✅ 邏輯大小 {result['size']} bytes，實際寫入 {result['written']} bytes")
+    
+    print("\n✅ 區塊差異複製測試通過\n")
+
+
+def test_compact_manifest():
+    """測試 SQLite 精簡 manifest 與舊版 JSON 遷移"""
+    print("=" * 60)
+    print("測試 10: 精簡 manifest")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files_info = {
+            "b.txt": {"size": 200, "modified": "2026-01-29T10:05:00", "hash": "abc"},
+            "a/檔案.txt": {"size": 100, "modified": "2026-01-29T10:00:00"},
+        }
+        
+        print("\n[步驟1] 建立舊版 JSON manifest...")
+        BackupManifest(os.path.join(tmpdir, ".backup_manifest")).update(
+            "C:\\source", tmpdir, files_info
+        )
+        
+        print("[步驟2] 唯讀查詢不遷移，備份時自動遷移為 SQLite...")
+        assert BackupManifest.locate(tmpdir, migrate=False).endswith(".backup_manifest")
+        assert not os.path.exists(os.path.join(tmpdir, ".backup_manifest.db"))
+        manifest_path = BackupManifest.locate(tmpdir)
+        assert manifest_path.endswith(".backup_manifest.db")
+        assert os.path.exists(os.path.join(tmpdir, ".backup_manifest.migrated"))
+        manifest = BackupManifest.open(manifest_path)
+        assert isinstance(manifest, SqliteManifest)
+        assert manifest.data['sourceFolder'] == "C:\\source"
+        assert manifest.data['filesCount'] == 2
+        assert manifest.get_files_dict() == files_info
+        print("✅ 遷移完成，表頭與檔案清單一致")
+        
+        print("[步驟3] 依路徑順序串流讀取...")
+        assert [path for path, _ in manifest.iter_files()] == sorted(files_info)
+        manifest.reset()
+        assert BackupManifest.open(manifest_path).get_files_dict() == {}
+        print("✅ 串流讀取與重置正常")
+        
+        print("[步驟4] 資料夾 mtime 快照存於獨立資料表...")
+        import sqlite3
+        manifest.record_integrity_state({"a": 1, "b": 2, "c": None})
+        manifest.save()
+        manifest.record_integrity_state({"a": 1, "b": 3})
+        assert BackupManifest.open(manifest_path).data['directoryMtimes'] == {"a": 1, "b": 3}
+        conn = sqlite3.connect(manifest_path)
+        try:
+            assert conn.execute("SELECT value FROM meta WHERE key = 'directoryMtimes'").fetchone() is None
+            assert dict(conn.execute("SELECT path, mtime_ns FROM dirs")) == {"a": 1, "b": 3}
+        finally:
+            conn.close()
+        manifest.reset()
+        assert 'directoryMtimes' not in BackupManifest.open(manifest_path).data
+        print("✅ 表頭不含快照，只更新有變動的資料夾")
+    
+    print("\n✅ 精簡 manifest 測試通過\n")
+
+
+def test_manifest_journal():
+    """測試 manifest 日誌的重播與合併"""
+    print("=" * 60)
+    print("測試 11: manifest 日誌")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest_path = os.path.join(tmpdir, ".backup_manifest.db")
+        manifest = SqliteManifest(manifest_path)
+        manifest.update("C:\\source", tmpdir, {
+            "keep.txt": {"size": 10, "modified": "2026-01-01T00:00:00"},
+            "old.txt": {"size": 20, "modified": "2026-01-01T00:00:00"},
+        })
+        
+        print("\n[步驟1] 模擬中斷的備份（最後一行寫到一半）...")
+        journal = ManifestJournal.for_manifest(manifest_path)
+        journal.record_begin("C:\\source", tmpdir)
+        journal.record_put("new.txt", {"size": 5, "modified": "2026-02-01T00:00:00"})
+        journal.record_put("keep.txt", {"size": 15, "modified": "2026-02-01T00:00:00"})
+        journal.record_delete("old.txt")
+        journal._close()
+        with open(journal.journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "put", "path": "broken')
+        
+        print("[步驟2] 下次備份時合併日誌...")
+        resumed = ManifestJournal.for_manifest(manifest_path)
+        assert resumed.exists()
+        assert resumed.compact(BackupManifest.open(manifest_path)) == 3
+        assert not resumed.exists()
+        
+        reloaded = BackupManifest.open(manifest_path)
+        files = reloaded.get_files_dict()
+        assert sorted(files) == ["keep.txt", "new.txt"]
+        assert files["keep.txt"]["size"] == 15
+        assert reloaded.data['filesCount'] == 2
+        assert reloaded.data['totalSize'] == 20
+        print("✅ 已完成的操作已合併，表頭統計正確")
+        
+        print("[步驟3] 備份失敗時以復原模式合併日誌...")
+        from backup_tool import RecoveryMode
+        assert RecoveryMode.recover_from_failed_backup(manifest_path) is None
+        journal = ManifestJournal.for_manifest(manifest_path)
+        journal.record_delete("new.txt")
+        journal._close()
+        recovery_info = RecoveryMode.recover_from_failed_backup(manifest_path)
+        assert recovery_info["recovered"] and recovery_info["journalOperations"] == 1
+        assert sorted(BackupManifest.open(manifest_path).get_files_dict()) == ["keep.txt"]
+        print("✅ 沒有日誌時不修改 manifest，有日誌時合併已完成的操作")
+    
+    print("\n✅ manifest 日誌測試通過\n")
+
+
+def test_streaming_delta():
+    """測試排序串流掃描與合併比對差異檢測"""
+    print("=" * 60)
+    print("測試 12: 串流差異檢測")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print("\n[步驟1] 建立名稱排序容易出錯的檔案...")
+        for rel_path in ["a-b", os.path.join("a", "x"), "a0", os.path.join("a", "b", "y"), "中文.txt"]:
+            file_path = os.path.join(tmpdir, rel_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(rel_path)
+        
+        streamed = list(DeltaBackupEngine.iter_sorted_scan(tmpdir))
+        assert [path for path, _ in streamed] == sorted(DeltaBackupEngine.scan_folder(tmpdir))
+        print(f"✅ 串流順序與路徑排序一致: {len(streamed)} 個檔案")
+        
+        print("[步驟2] 合併比對結果與 detect_changes 一致...")
+        old_files = dict(streamed)
+        old_files.pop("a0")
+        old_files["gone.txt"] = {"size": 1, "modified": "2026-01-01T00:00:00"}
+        old_files["a-b"] = dict(old_files["a-b"], size=999)
+        new_files = DeltaBackupEngine.scan_folder(tmpdir)
+        
+        events = list(DeltaBackupEngine.iter_changes(
+            iter(sorted(old_files.items())), DeltaBackupEngine.iter_sorted_scan(tmpdir)
+        ))
+        added, modified, deleted = DeltaBackupEngine.detect_changes(old_files, new_files)
+        assert [p for c, p, _ in events if c == "added"] == sorted(added)
+        assert [p for c, p, _ in events if c == "modified"] == sorted(modified)
+        assert [p for c, p, _ in events if c == "deleted"] == sorted(deleted)
+        print("✅ 新增/修改/刪除事件正確")
+    
+    print("\n✅ 串流差異檢測測試通過\n")
+
+
+def test_headless_runner():
+    """測試不依賴圖形介面的 BackupRunner 與 CLI"""
+    print("=" * 60)
+    print("測試 13: 命令列備份")
+    print("=" * 60)
+    
+    assert 'tkinter' not in sys.modules
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        other = os.path.join(tmpdir, "other")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, other, target, app_dir):
+            os.makedirs(folder)
+        with open(os.path.join(source, "a.txt"), 'w', encoding='utf-8') as f:
+            f.write("內容")
+        with open(os.path.join(other, "b.txt"), 'w', encoding='utf-8') as f:
+            f.write("其他")
+        
+        print("\n[步驟1] 以 BackupRunner 備份...")
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        record = runner.run(source, target)
+        assert runner.error is None
+        assert record["addedFiles"] == 1
+        assert os.path.exists(os.path.join(target, "backup_data", "a.txt"))
+        print(f"✅ {record['status']}")
+        
+        print("[步驟2] CLI 來源改變時依策略中止或重置...")
+        assert cli_main(["--app-dir", app_dir, "backup", other, target]) == 2
+        assert not os.path.exists(os.path.join(target, "backup_data", "b.txt"))
+        assert cli_main(["--app-dir", app_dir, "backup", other, target,
+                         "--on-source-changed", "reset"]) == 0
+        assert os.path.exists(os.path.join(target, "backup_data", "b.txt"))
+        print("✅ abort 不修改備份，reset 重新建立紀錄並完整備份")
+    
+    print("\n✅ 命令列備份測試通過\n")
+
+
+def test_tiered_integrity_check():
+    """測試分層完整性檢查（資料夾 mtime 快照 + 抽樣）"""
+    print("=" * 60)
+    print("測試 14: 分層完整性檢查")
+    print("=" * 60)
+    
+    from backup_tool import BackupIntegrityError
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backup_folder = os.path.join(tmpdir, "backup_data")
+        manifest_files = {}
+        for folder in ("a", "b"):
+            os.makedirs(os.path.join(backup_folder, folder))
+            for i in range(10):
+                rel_path = os.path.join(folder, f"f{i}.txt")
+                with open(os.path.join(backup_folder, rel_path), 'w') as f:
+                    f.write("x")
+                manifest_files[rel_path] = DeltaBackupEngine.get_file_info(
+                    os.path.join(backup_folder, rel_path)
+                )
+        
+        print("\n[步驟1] 建立資料夾 mtime 快照並快速檢查...")
+        snapshot = DeltaBackupEngine.snapshot_directory_mtimes(manifest_files.items(), backup_folder)
+        assert set(snapshot) == {"a", "b"}
+        checked = DeltaBackupEngine.sample_backup_integrity(
+            manifest_files.items(), backup_folder, snapshot, sample_ratio=0
+        )
+        assert checked == 0
+        print("✅ 資料夾未變動時不需檢查任何檔案")
+        
+        print("[步驟2] 刪除檔案後只檢查變動的資料夾...")
+        os.utime(os.path.join(backup_folder, "a"), ns=(0, 0))
+        snapshot = DeltaBackupEngine.snapshot_directory_mtimes(manifest_files.items(), backup_folder)
+        os.remove(os.path.join(backup_folder, "a", "f3.txt"))
+        try:
+            DeltaBackupEngine.sample_backup_integrity(
+                manifest_files.items(), backup_folder, snapshot, sample_ratio=0
+            )
+            assert False, "應偵測到缺少的檔案"
+        except BackupIntegrityError as e:
+            assert "f3.txt" in str(e)
+            print(f"✅ 偵測到缺少的檔案: {str(e)[:40]}...")
+        
+        print("[步驟3] 完整檢查排程與 manifest 狀態保留...")
+        manifest = BackupManifest(os.path.join(tmpdir, ".backup_manifest"))
+        assert DeltaBackupEngine.integrity_check_due(manifest.data)
+        manifest.record_integrity_state(snapshot, datetime.now().isoformat())
+        manifest.update("src", "tgt", manifest_files)
+        manifest = BackupManifest(os.path.join(tmpdir, ".backup_manifest"))
+        assert manifest.data['directoryMtimes'] == snapshot
+        assert not DeltaBackupEngine.integrity_check_due(manifest.data)
+        assert DeltaBackupEngine.integrity_check_due(
+            manifest.data, now=datetime.now() + timedelta(days=30)
+        )
+        print("✅ 完整檢查依排程執行")
+    
+    print("\n✅ 分層完整性檢查測試通過\n")
+
+
+def test_backup_scrubber():
+    """測試背景內容驗證（位元衰減偵測與進度續傳）"""
+    print("=" * 60)
+    print("測試 15: 背景內容驗證")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir):
+            os.makedirs(folder)
+        for i in range(4):
+            with open(os.path.join(source, f"f{i}.bin"), 'wb') as f:
+                f.write(bytes([i]) * 1000)
+        
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        runner.run(source, target)
+        manifest_path = BackupManifest.locate(target)
+        backup_folder = os.path.join(target, "backup_data")
+        
+        print("\n[步驟1] 依進度分次驗證並建立基準摘要...")
+        scrubber = BackupScrubber(BackupManifest.open(manifest_path), backup_folder, rate_limit_mb=0)
+        report = scrubber.run(max_bytes=1000)
+        assert report["checked"] == 1 and not report["passCompleted"]
+        scrubber = BackupScrubber(BackupManifest.open(manifest_path), backup_folder, rate_limit_mb=0)
+        report = scrubber.run(max_bytes=float('inf'))
+        assert report["checked"] == 3 and report["passCompleted"]
+        files = BackupManifest.open(manifest_path).get_files_dict()
+        assert all(info.get('hash') for info in files.values())
+        print("✅ 兩次執行驗證完整份備份，摘要已記錄")
+        
+        print("[步驟2] 備份後摘要保留，模擬位元衰減...")
+        runner.run(source, target)
+        files = BackupManifest.open(manifest_path).get_files_dict()
+        assert all(info.get('hash') for info in files.values())
+        with open(os.path.join(backup_folder, "f2.bin"), 'r+b') as f:
+            f.seek(500)
+            f.write(b"\xff")
+        scrubber = BackupScrubber(BackupManifest.open(manifest_path), backup_folder, rate_limit_mb=0)
+        report = scrubber.run(max_bytes=float('inf'))
+        assert report["corrupted"] == ["f2.bin"]
+        assert "f2.bin" not in BackupManifest.open(manifest_path).get_files_dict()
+        print("✅ 偵測到損壞的檔案並從紀錄移除")
+        
+        print("[步驟3] 下次備份重新複製損壞的檔案...")
+        record = runner.run(source, target)
+        assert record["addedFiles"] == 1
+        with open(os.path.join(backup_folder, "f2.bin"), 'rb') as f:
+            assert f.read() == bytes([2]) * 1000
+        print("✅ 損壞的檔案已由來源修復")
+    
+    print("\n✅ 背景內容驗證測試通過\n")
+
+
+def test_fused_hash_copy():
+    """測試複製時同時計算摘要與重新讀取驗證"""
+    print("=" * 60)
+    print("測試 16: 複製同時計算摘要")
+    print("=" * 60)
+    
+    import backup_tool
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "src.bin")
+        with open(src, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        expected = DeltaBackupEngine.compute_hash(src)
+        
+        print("\n[步驟1] 一般複製與區塊差異複製都回傳來源摘要...")
+        dst = os.path.join(tmpdir, "out", "dst.bin")
+        result = DeltaBackupEngine.copy_file(src, dst, digest=True, verify=True)
+        assert result['digest'] == expected
+        assert DeltaBackupEngine.read_back_digest(dst) == expected
+        result = DeltaBackupEngine.block_delta_copy(src, dst, block_size=64 * 1024, digest=True)
+        assert result['digest'] == expected and result['written'] == 0
+        print(f"✅ 摘要一致 ({expected[:16]}...)")
+        
+        print("[步驟2] 備份時將複製摘要寫入 manifest...")
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir):
+            os.makedirs(folder)
+        shutil.copy2(src, os.path.join(source, "a.bin"))
+        
+        backup_tool.FUSED_HASH_COPY = True
+        try:
+            logger = BackupLogger(os.path.join(app_dir, "history.json"))
+            runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+            record = runner.run(source, target)
+        finally:
+            backup_tool.FUSED_HASH_COPY = False
+        assert record["addedFiles"] == 1 and not record["error"]
+        files = BackupManifest.open(BackupManifest.locate(target)).get_files_dict()
+        assert files["a.bin"]["hash"] == expected
+        print("✅ manifest 已記錄複製時計算的摘要")
+    
+    print("\n✅ 複製同時計算摘要測試通過\n")
+
+
+def test_dedup_object_store():
+    """測試內容定址物件庫（重複內容只寫入一次、改名不重新複製）"""
+    print("=" * 60)
+    print("測試 17: 內容定址物件庫")
+    print("=" * 60)
+    
+    import backup_tool
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir, os.path.join(source, "copy")):
+            os.makedirs(folder, exist_ok=True)
+        photo = os.urandom(64 * 1024)
+        for rel_path in ("photo.jpg", os.path.join("copy", "photo.jpg")):
+            with open(os.path.join(source, rel_path), 'wb') as f:
+                f.write(photo)
+        with open(os.path.join(source, "notes.txt"), 'w', encoding='utf-8') as f:
+            f.write("筆記")
+        
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        store = ObjectStore(target)
+        backup_folder = os.path.join(target, "backup_data")
+        backup_tool.DEDUP_STORE = True
+        try:
+            print("\n[步驟1] 重複內容只寫入一次...")
+            record = runner.run(source, target)
+            assert record["addedFiles"] == 3 and not record["error"]
+            assert record["bytesWritten"] == len(photo) + len("筆記".encode('utf-8'))
+            assert record["copyMethods"].get("dedup") == 1
+            digest = DeltaBackupEngine.compute_hash(os.path.join(source, "photo.jpg"))
+            assert os.stat(store.object_path(digest)).st_nlink == 3
+            print(f"✅ 寫入 {record['bytesWritten']} 位元組，copy/photo.jpg 以硬連結共用")
+            
+            print("[步驟2] 複製到新名稱後刪除舊檔（inode 改變），只建立新連結...")
+            shutil.copy2(os.path.join(source, "notes.txt"), os.path.join(source, "renamed.txt"))
+            os.remove(os.path.join(source, "notes.txt"))
+            record = runner.run(source, target)
+            assert record["addedFiles"] == 1 and record["deletedFiles"] == 1
+            assert record["bytesWritten"] == 0
+            with open(os.path.join(backup_folder, "renamed.txt"), encoding='utf-8') as f:
+                assert f.read() == "筆記"
+            print("✅ 相同內容的新檔案未重新寫入資料")
+            
+            print("[步驟3] 清理沒有連結的物件...")
+            os.remove(os.path.join(source, "photo.jpg"))
+            os.remove(os.path.join(source, "copy", "photo.jpg"))
+            record = runner.run(source, target)
+            assert record["objectsCollected"] == 1
+            assert not os.path.exists(store.object_path(digest))
+            print(f"✅ 釋放 {record['bytesFreed']} 位元組")
+        finally:
+            backup_tool.DEDUP_STORE = False
+    
+    print("\n✅ 內容定址物件庫測試通過\n")
+
+
+def test_move_detection():
+    """測試搬移偵測（刪除與新增配對為備份資料夾內的改名）"""
+    print("=" * 60)
+    print("測試 18: 搬移偵測")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (os.path.join(source, "photos", "2024"), target, app_dir):
+            os.makedirs(folder)
+        for i in range(5):
+            with open(os.path.join(source, "photos", "2024", f"img{i}.jpg"), 'wb') as f:
+                f.write(os.urandom(1024))
+        
+        print("\n[步驟1] 配對規則...")
+        deleted = {
+            "a.txt": {'size': 10, 'modified': 'm', 'mtime_ns': 1, 'inode': 100},
+            "b.txt": {'size': 10, 'modified': 'm', 'mtime_ns': 1, 'inode': 200},
+            "c.txt": {'size': 10, 'modified': 'm', 'mtime_ns': 1},
+        }
+        added = {
+            "x/a.txt": {'size': 10, 'modified': 'm', 'mtime_ns': 1, 'inode': 100},
+            "x/c.txt": {'size': 10, 'modified': 'm', 'mtime_ns': 1, 'inode': 300},
+        }
+        moves = DeltaBackupEngine.detect_moves(added, deleted)
+        assert moves == {"x/a.txt": "a.txt"}
+        print("✅ 只有 inode 相同的檔案被配對，大小與時間相同但 inode 不同的不配對")
+        
+        print("[步驟2] 搬移資料夾只在備份內改名...")
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        runner.run(source, target)
+        os.rename(os.path.join(source, "photos"), os.path.join(source, "相片"))
+        record = runner.run(source, target)
+        assert record["movedFiles"] == 5
+        assert record["addedFiles"] == 0 and record["deletedFiles"] == 0
+        assert record["bytesWritten"] == 0
+        backup_folder = os.path.join(target, "backup_data")
+        assert sorted(DeltaBackupEngine.scan_folder(backup_folder)) == \
+            sorted(DeltaBackupEngine.scan_folder(source))
+        files = BackupManifest.open(BackupManifest.locate(target)).get_files_dict()
+        assert all(path.startswith("相片") for path in files)
+        print(f"✅ 搬移 {record['movedFiles']} 個檔案，未複製任何資料")
+    
+    print("\n✅ 搬移偵測測試通過\n")
+
+
+def test_snapshots():
+    """測試硬連結版本快照與保留策略"""
+    print("=" * 60)
+    print("測試 19: 版本快照")
+    print("=" * 60)
+    
+    import backup_tool
+    
+    print("\n[步驟1] 保留策略...")
+    start = datetime(2025, 1, 1, 12, 0)
+    times = [start + timedelta(days=i) for i in range(120)]
+    times.append(times[-1] + timedelta(hours=1))  # 同一天的兩個快照
+    keep = RetentionPolicy(last=1, daily=7, weekly=4, monthly=3).select(times)
+    assert times[-1] in keep and times[-2] not in keep
+    assert len([t for t in keep if t.date() >= (times[-1] - timedelta(days=6)).date()]) == 7
+    assert len(keep) <= 7 + 4 + 3
+    print(f"✅ {len(times)} 個快照保留 {len(keep)} 個")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir):
+            os.makedirs(folder)
+        for name, content in (("doc.txt", "版本一"), ("static.txt", "不變")):
+            with open(os.path.join(source, name), 'w', encoding='utf-8') as f:
+                f.write(content)
+        
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        snapshots = SnapshotManager(target)
+        backup_tool.SNAPSHOTS = True
+        try:
+            print("[步驟2] 每次有變更的備份建立新快照...")
+            first = runner.run(source, target)
+            with open(os.path.join(source, "doc.txt"), 'w', encoding='utf-8') as f:
+                f.write("版本二")
+            second = runner.run(source, target)
+            third = runner.run(source, target)
+        finally:
+            backup_tool.SNAPSHOTS = False
+        assert first["snapshot"] and second["snapshot"] and "snapshot" not in third
+        assert [os.path.basename(p) for _, p in snapshots.list()] == \
+            [first["snapshot"], second["snapshot"]]
+        
+        old_path, new_path = (p for _, p in snapshots.list())
+        with open(os.path.join(old_path, "doc.txt"), encoding='utf-8') as f:
+            assert f.read() == "版本一"
+        with open(os.path.join(target, "backup_data", "doc.txt"), encoding='utf-8') as f:
+            assert f.read() == "版本二"
+        assert os.stat(os.path.join(old_path, "static.txt")).st_ino == \
+            os.stat(os.path.join(new_path, "static.txt")).st_ino
+        print("✅ 修改的檔案保留舊版本，未變更的檔案以硬連結共用")
+        
+        print("[步驟4] 圖形介面啟動時的清理與備份共用鎖定...")
+        from types import SimpleNamespace
+        from backup_tool import BackupToolGUI
+        lock = BackupLock(os.path.join(tmpdir, ".cleanup.lock"))
+        gui = SimpleNamespace(target_folder=SimpleNamespace(get=lambda: target), backup_lock=lock,
+                              logger=BackupLogger(os.path.join(tmpdir, "gui_history.json")),
+                              _update_history_display=lambda: None)
+        saved = backup_tool.RETENTION_LAST, backup_tool.RETENTION_DAILY
+        backup_tool.RETENTION_LAST, backup_tool.RETENTION_DAILY = 1, 0
+        try:
+            with open(lock.lock_file, 'w') as f:
+                f.write(str(os.getppid()))
+            BackupToolGUI._cleanup_old_backups(gui)
+            assert len(snapshots.list()) == 2
+            os.remove(lock.lock_file)
+            BackupToolGUI._cleanup_old_backups(gui)
+            assert [p for _, p in snapshots.list()] == [new_path]
+            assert not os.path.exists(lock.lock_file)
+        finally:
+            backup_tool.RETENTION_LAST, backup_tool.RETENTION_DAILY = saved
+        print("✅ 其他程序持有鎖定時略過，鎖定釋放後才清理")
+    
+    print("\n✅ 版本快照測試通過\n")
+
+
+def test_compression():
+    """測試串流壓縮存放與透明還原"""
+    print("=" * 60)
+    print("測試 20: 串流壓縮")
+    print("=" * 60)
+    
+    import backup_tool
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir):
+            os.makedirs(folder)
+        text = ("備份紀錄 log line\n" * 20000).encode('utf-8')
+        contents = {
+            "log.txt": text,
+            "photo.jpg": os.urandom(50 * 1024),
+            "random.bin": os.urandom(50 * 1024),
+            "tricky.bin": backup_tool.BACKUP_FRAME_MAGIC + b"\x01 not really compressed",
+        }
+        for name, data in contents.items():
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(data)
+        # 內容本身是完整的壓縮檔（例如從其他備份複製來的檔案）
+        DeltaBackupEngine.compress_file(os.path.join(source, "log.txt"),
+                                        os.path.join(source, "copied.bkz"), "zlib")
+        with open(os.path.join(source, "copied.bkz"), 'rb') as f:
+            contents["copied.bkz"] = f.read()
+        
+        print("\n[步驟1] 編碼選擇與單檔壓縮...")
+        backup_tool.COMPRESSION_CODEC = "lzma"
+        try:
+            assert DeltaBackupEngine.select_codec(os.path.join(source, "photo.jpg"), 50 * 1024) is None
+            assert DeltaBackupEngine.select_codec(os.path.join(source, "log.txt"), len(text)) == "lzma"
+            dst = os.path.join(tmpdir, "single", "log.txt")
+            result = DeltaBackupEngine.compress_file(os.path.join(source, "log.txt"), dst, "zlib")
+            assert result['method'] == "compress_zlib" and result['written'] < len(text) / 10
+            result = DeltaBackupEngine.compress_file(
+                os.path.join(source, "random.bin"), os.path.join(tmpdir, "single", "random.bin"), "zlib"
+            )
+            assert result['method'] != "compress_zlib"
+            print("✅ 文字檔壓縮、不可壓縮的檔案原樣複製")
+            
+            print("[步驟2] 備份時以行程池壓縮...")
+            logger = BackupLogger(os.path.join(app_dir, "history.json"))
+            runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+            record = runner.run(source, target)
+        finally:
+            backup_tool.COMPRESSION_CODEC = None
+        assert not record["error"], record["error"]
+        assert record["copyMethods"].get("compress_lzma") == 1
+        assert record["copyMethods"].get("compress_raw") == 2
+        assert record["bytesWritten"] < record["bytesCopied"]
+        print(f"✅ 寫入 {record['bytesWritten']} / {record['bytesCopied']} 位元組")
+        
+        print("[步驟3] 背景驗證與透明還原...")
+        backup_folder = os.path.join(target, "backup_data")
+        scrubber = BackupScrubber(BackupManifest.open(BackupManifest.locate(target)),
+                                  backup_folder, rate_limit_mb=0)
+        report = scrubber.run(max_bytes=float('inf'))
+        assert report["checked"] == 5 and not report["corrupted"]
+        restore_to = os.path.join(tmpdir, "restored")
+        DeltaBackupEngine.restore_tree(backup_folder, restore_to)
+        for name, data in contents.items():
+            with open(os.path.join(restore_to, name), 'rb') as f:
+                assert f.read() == data, name
+        print("✅ 還原內容與來源完全相同")
+        
+        print("[步驟4] 未啟用壓縮時，以壓縮檔標頭開頭的檔案同樣能還原...")
+        for name, dedup in (("plain", False), ("dedup", True)):
+            plain_target = os.path.join(tmpdir, f"{name}_target")
+            os.makedirs(plain_target)
+            backup_tool.DEDUP_STORE = dedup
+            try:
+                record = runner.run(source, plain_target)
+            finally:
+                backup_tool.DEDUP_STORE = False
+            assert record["status"] == "✅ 備份完成", record
+            assert record["copyMethods"].get("compress_raw") == 2, record["copyMethods"]
+            backup_folder = os.path.join(plain_target, "backup_data")
+            scrubber = BackupScrubber(BackupManifest.open(BackupManifest.locate(plain_target)),
+                                      backup_folder, rate_limit_mb=0)
+            report = scrubber.run(max_bytes=float('inf'))
+            assert report["checked"] == 5 and not report["corrupted"], report
+            restore_to = os.path.join(tmpdir, f"{name}_restored")
+            DeltaBackupEngine.restore_tree(backup_folder, restore_to)
+            for file_name, data in contents.items():
+                with open(os.path.join(restore_to, file_name), 'rb') as f:
+                    assert f.read() == data, (name, file_name)
+        print("✅ 一般複製與物件庫都加上 raw 標頭存放，還原與驗證結果正確")
+    
+    print("\n✅ 串流壓縮測試通過\n")
+
+
+def test_pack_small_files():
+    """測試小檔案封裝到區段檔"""
+    print("=" * 60)
+    print("測試 21: 小檔案封裝")
+    print("=" * 60)
+    
+    import backup_tool
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (os.path.join(source, "notes", "2024"), target, app_dir):
+            os.makedirs(folder)
+        contents = {}
+        for i in range(20):
+            rel_path = os.path.join("notes", "2024", f"筆記{i}.txt")
+            contents[rel_path] = os.urandom(100 + i)
+        contents["large.bin"] = os.urandom(8192)
+        for rel_path, data in contents.items():
+            with open(os.path.join(source, rel_path), 'wb') as f:
+                f.write(data)
+        
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        backup_folder = os.path.join(target, "backup_data")
+        pack_store = PackStore(target)
+        backup_tool.PACK_THRESHOLD = 4096
+        try:
+            print("\n[步驟1] 小檔案寫入區段，大型檔案維持個別檔案...")
+            record = runner.run(source, target)
+            assert record["status"] == "✅ 備份完成", record
+            assert record["copyMethods"].get("pack") == 20
+            assert sorted(DeltaBackupEngine.scan_folder(backup_folder)) == ["large.bin"]
+            assert len(pack_store.list_segments()) == 1
+            files = BackupManifest.open(BackupManifest.locate(target)).get_files_dict()
+            packed = PackStore.packed_entries(files.items())
+            assert len(packed) == 20
+            for rel_path, info in packed.items():
+                assert pack_store.read(info) == contents[rel_path]
+            print(f"✅ 20 個小檔案寫入 {pack_store.list_segments()[0]}")
+            
+            print("[步驟2] 未變更與搬移的檔案保留區段位置...")
+            segment = pack_store.segment_path(pack_store.list_segments()[0])
+            segment_size = os.path.getsize(segment)
+            record = runner.run(source, target)
+            assert record["changedFiles"] == 0
+            os.rename(os.path.join(source, "notes"), os.path.join(source, "筆記"))
+            record = runner.run(source, target)
+            assert record["movedFiles"] == 20 and record["bytesWritten"] == 0
+            assert os.path.getsize(segment) == segment_size
+            files = BackupManifest.open(BackupManifest.locate(target)).get_files_dict()
+            assert len(PackStore.packed_entries(files.items())) == 20
+            print("✅ 搬移只更新 manifest，區段未寫入任何資料")
+            
+            print("[步驟3] 完整性檢查只 stat 區段檔...")
+            DeltaBackupEngine.verify_backup_integrity(files, backup_folder)
+            directory_mtimes = DeltaBackupEngine.snapshot_directory_mtimes(
+                files.items(), backup_folder
+            )
+            assert DeltaBackupEngine.sample_backup_integrity(
+                files.items(), backup_folder, directory_mtimes, sample_ratio=0
+            ) == 20
+            with open(segment, 'r+b') as f:
+                f.seek(-1, os.SEEK_END)
+                last_byte = f.read()
+                f.truncate(segment_size - 1)
+            try:
+                DeltaBackupEngine.verify_backup_integrity(files, backup_folder)
+                assert False, "區段被截斷時應偵測到缺少檔案"
+            except BackupIntegrityError:
+                pass
+            with open(segment, 'ab') as f:
+                f.write(last_byte)
+            print("✅ 區段被截斷時完整性檢查失敗")
+            
+            print("[步驟4] 背景驗證讀取區段範圍...")
+            scrubber = BackupScrubber(
+                BackupManifest.open(BackupManifest.locate(target)), backup_folder, rate_limit_mb=0
+            )
+            report = scrubber.run(max_bytes=float("inf"))
+            assert report["checked"] == 21 and not report["missing"]
+            print(f"✅ 驗證 {report['checked']} 個檔案")
+            
+            print("[步驟5] 刪除大部分檔案後重新封裝區段...")
+            for i in range(15):
+                os.remove(os.path.join(source, "筆記", "2024", f"筆記{i}.txt"))
+            record = runner.run(source, target)
+            assert record["deletedFiles"] == 15
+            assert record["segmentsRepacked"] == 1 and record["packBytesFreed"] > 0
+            assert os.path.getsize(pack_store.segment_path(pack_store.list_segments()[0])) == \
+                sum(len(contents[os.path.join("notes", "2024", f"筆記{i}.txt")]) for i in range(15, 20))
+            print(f"✅ 釋放 {record['packBytesFreed']} 位元組")
+            
+            print("[步驟6] 依 manifest 還原封裝的檔案...")
+            files = BackupManifest.open(BackupManifest.locate(target)).get_files_dict()
+            restore_to = os.path.join(tmpdir, "restored")
+            restored = pack_store.restore_entries(
+                PackStore.packed_entries(files.items()), "筆記", restore_to
+            )
+            assert restored == 5
+            for i in range(15, 20):
+                with open(os.path.join(restore_to, "2024", f"筆記{i}.txt"), 'rb') as f:
+                    assert f.read() == contents[os.path.join("notes", "2024", f"筆記{i}.txt")]
+            print("✅ 還原內容與來源完全相同")
+            
+            print("[步驟7] 封裝新增與已封裝的檔案時不存取備份資料夾...")
+            deleted_paths, verified_paths = [], []
+            delete_file, verify_backup = DeltaBackupEngine.delete_file, DeltaBackupEngine.verify_backup
+            backup_tool.DeltaBackupEngine.delete_file = staticmethod(
+                lambda path: (deleted_paths.append(path), delete_file(path))[1]
+            )
+            backup_tool.DeltaBackupEngine.verify_backup = staticmethod(
+                lambda src, dst, paths: (verified_paths.extend(paths), verify_backup(src, dst, paths))[1]
+            )
+            try:
+                with open(os.path.join(source, "新增.txt"), 'wb') as f:
+                    f.write(b"added")
+                with open(os.path.join(source, "筆記", "2024", "筆記15.txt"), 'wb') as f:
+                    f.write(b"modified")
+                record = runner.run(source, target)
+                assert (record["addedFiles"], record["modifiedFiles"]) == (1, 1)
+                assert deleted_paths == [] and verified_paths == []
+                
+                # 未啟用封裝時存為個別檔案，之後修改並封裝時移除舊的備份檔
+                backup_tool.PACK_THRESHOLD = 0
+                with open(os.path.join(source, "新增.txt"), 'wb') as f:
+                    f.write(b"unpacked")
+                runner.run(source, target)
+                assert os.path.exists(os.path.join(backup_folder, "新增.txt"))
+                backup_tool.PACK_THRESHOLD = 4096
+                with open(os.path.join(source, "新增.txt"), 'wb') as f:
+                    f.write(b"packed again")
+                record = runner.run(source, target)
+                assert record["copyMethods"] == {"pack": 1}
+                assert deleted_paths == [os.path.join(backup_folder, "新增.txt")]
+                assert not os.path.exists(deleted_paths[0])
+            finally:
+                backup_tool.DeltaBackupEngine.delete_file = staticmethod(delete_file)
+                backup_tool.DeltaBackupEngine.verify_backup = staticmethod(verify_backup)
+            print("✅ 只有原本以個別檔案存放的檔案需要刪除舊備份檔")
+        finally:
+            backup_tool.PACK_THRESHOLD = 0
+    
+    print("\n✅ 小檔案封裝測試通過\n")
+
+
+def test_resumable_copy():
+    """測試大型檔案複製進度檢查點與中斷後續傳"""
+    print("=" * 60)
+    print("測試 22: 可續傳複製")
+    print("=" * 60)
+    
+    import backup_tool
+    
+    class Interrupted(Exception):
+        pass
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir):
+            os.makedirs(folder)
+        data = os.urandom(1024 * 1024 + 123)
+        src = os.path.join(source, "影片.mp4")
+        with open(src, 'wb') as f:
+            f.write(data)
+        
+        saved = (backup_tool.CHECKPOINT_THRESHOLD, backup_tool.CHECKPOINT_INTERVAL)
+        backup_tool.CHECKPOINT_THRESHOLD = 256 * 1024
+        backup_tool.CHECKPOINT_INTERVAL = 256 * 1024
+        try:
+            print("\n[步驟1] 中斷後從檢查點繼續...")
+            dst = os.path.join(tmpdir, "copy", "影片.mp4")
+            checkpoints = []
+            
+            def interrupt(position):
+                checkpoints.append(position)
+                if len(checkpoints) == 2:
+                    raise Interrupted()
+            
+            try:
+                DeltaBackupEngine.resumable_copy(src, dst, checkpoint=interrupt,
+                                                 buffer_size=64 * 1024, digest=True)
+                assert False, "應在第二個檢查點中斷"
+            except Interrupted:
+                pass
+            offset = checkpoints[-1]
+            assert offset >= 2 * 256 * 1024 and os.path.getsize(dst) >= offset
+            result = DeltaBackupEngine.resumable_copy(src, dst, offset, digest=True)
+            assert result['method'] == "resumed"
+            assert result['written'] == len(data) - offset
+            assert result['digest'] == hashlib.sha256(data).hexdigest()
+            with open(dst, 'rb') as f:
+                assert f.read() == data
+            print(f"✅ 從位移 {offset} 繼續，只寫入 {result['written']} 位元組")
+            
+            print("[步驟2] 合併日誌時保留複製進度...")
+            manifest_path = BackupManifest.locate(target)
+            journal = ManifestJournal.for_manifest(manifest_path)
+            info = DeltaBackupEngine.scan_folder(source)["影片.mp4"]
+            backup_file = os.path.join(target, "backup_data", "影片.mp4")
+            os.makedirs(os.path.dirname(backup_file))
+            with open(backup_file, 'wb') as f:
+                f.write(data[:offset])
+            journal.record_partial("影片.mp4", offset, info)
+            # 來源已刪除的檔案寫到一半的備份
+            orphan = os.path.join(target, "backup_data", "已刪除.bin")
+            with open(orphan, 'wb') as f:
+                f.write(b"x" * 1000)
+            journal.record_partial("已刪除.bin", 1000, {'size': 5000, 'mtime_ns': 1})
+            journal.compact(BackupManifest.open(manifest_path))
+            assert set(journal.read_partials()) == {"影片.mp4", "已刪除.bin"}
+            print("✅ 合併後進度仍保留在日誌中")
+            
+            print("[步驟3] 下次備份從斷點繼續，不重新複製已完成的部分...")
+            logger = BackupLogger(os.path.join(app_dir, "history.json"))
+            runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+            record = runner.run(source, target)
+            assert record["status"] == "✅ 備份完成", record
+            assert record["resumedFiles"] == 1
+            assert record["copyMethods"] == {"resumed": 1}
+            assert record["bytesWritten"] == len(data) - offset
+            with open(backup_file, 'rb') as f:
+                assert f.read() == data
+            assert not os.path.exists(orphan)
+            assert not journal.exists()
+            print(f"✅ 續傳寫入 {record['bytesWritten']} 位元組，寫到一半的孤立檔案已移除")
+        finally:
+            backup_tool.CHECKPOINT_THRESHOLD, backup_tool.CHECKPOINT_INTERVAL = saved
+    
+    print("\n✅ 可續傳複製測試通過\n")
+
+
+def test_source_index():
+    """測試來源索引（mtime 未變的資料夾不重新列出）"""
+    print("=" * 60)
+    print("測試 23: 來源索引")
+    print("=" * 60)
+    
+    import backup_tool
+    from backup_tool import SourceIndex
+    
+    def age_directories(folder, seconds=60):
+        """將資料夾 mtime 設為過去，避開剛修改過不寫入索引的保護"""
+        past = time.time_ns() - seconds * 10**9
+        for root, dirs, _ in os.walk(folder):
+            for name in dirs:
+                os.utime(os.path.join(root, name), ns=(past, past))
+        os.utime(folder, ns=(past, past))
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for i in range(3):
+            for j in range(3):
+                folder = os.path.join(source, f"專案{i}", f"子資料夾{j}")
+                os.makedirs(folder)
+                with open(os.path.join(folder, "data.txt"), 'w', encoding='utf-8') as f:
+                    f.write(f"{i}-{j}")
+        for folder in (target, app_dir):
+            os.makedirs(folder)
+        age_directories(source)
+        total_dirs = 1 + 3 + 9
+        
+        print("\n[步驟1] 第一次完整掃描並建立索引...")
+        index = SourceIndex.for_source(app_dir, source)
+        files = index.scan()
+        assert files == DeltaBackupEngine.scan_folder(source)
+        assert index.stats == {'full': True, 'dirsListed': total_dirs, 'dirsReused': 0}
+        print(f"✅ 列出 {total_dirs} 個資料夾")
+        
+        print("[步驟2] 未變更的資料夾沿用索引...")
+        assert SourceIndex.for_source(app_dir, source).scan(workers=1) == files
+        index = SourceIndex.for_source(app_dir, source)
+        assert index.scan() == files
+        assert index.stats == {'full': False, 'dirsListed': 0, 'dirsReused': total_dirs}
+        print("✅ 沒有重新列出任何資料夾")
+        
+        print("[步驟3] 只重新列出有變動的資料夾...")
+        with open(os.path.join(source, "專案1", "子資料夾2", "new.txt"), 'w') as f:
+            f.write("new")
+        shutil.rmtree(os.path.join(source, "專案2", "子資料夾0"))
+        files = index.scan()
+        assert files == DeltaBackupEngine.scan_folder(source)
+        assert index.stats['dirsListed'] == 2
+        print(f"✅ 重新列出 {index.stats['dirsListed']} 個資料夾")
+        
+        print("[步驟4] 到期時完整掃描...")
+        saved = backup_tool.SOURCE_INDEX_FULL_SCAN_HOURS
+        backup_tool.SOURCE_INDEX_FULL_SCAN_HOURS = 0
+        try:
+            index.scan()
+            assert index.stats['full']
+        finally:
+            backup_tool.SOURCE_INDEX_FULL_SCAN_HOURS = saved
+        print("✅ 完整掃描忽略索引")
+        
+        print("[步驟5] 備份流程使用來源索引...")
+        age_directories(source)
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        backup_tool.SOURCE_INDEX = True
+        try:
+            record = runner.run(source, target)
+            assert record["addedFiles"] == 9
+            record = runner.run(source, target)
+            assert record["changedFiles"] == 0
+            assert record["sourceScan"]["dirsListed"] == 0
+        finally:
+            backup_tool.SOURCE_INDEX = False
+        print("✅ 沒有變更的備份不需重新列出來源資料夾")
+    
+    print("\n✅ 來源索引測試通過\n")
+
+
+def test_change_watcher():
+    """測試變更監看模式（依 dirty set 只檢查變動的路徑）"""
+    print("=" * 60)
+    print("測試 24: 變更監看模式")
+    print("=" * 60)
+    
+    import threading
+    from backup_tool import DirtySet, ChangeWatcher
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for i in range(3):
+            folder = os.path.join(source, f"資料夾{i}")
+            os.makedirs(folder)
+            for j in range(3):
+                with open(os.path.join(folder, f"file{j}.txt"), 'w', encoding='utf-8') as f:
+                    f.write(f"{i}-{j}")
+        for folder in (target, app_dir):
+            os.makedirs(folder)
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")))
+        
+        # 以目前程序模擬執行中的監看程式
+        dirty_set = DirtySet.for_source(app_dir, source)
+        dirty_set.write_status("session-1")
+        
+        print("\n[步驟1] 第一次備份（尚未涵蓋工作階段）完整掃描...")
+        record = runner.run(source, target)
+        assert record["addedFiles"] == 9
+        assert "sourceScan" not in record
+        assert DirtySet._read_json(dirty_set.consumed_path) == {
+            "session": "session-1", "manifestGeneration": 0
+        }
+        print("✅ 完整掃描後記錄已涵蓋的工作階段")
+        
+        print("[步驟2] 只檢查變更路徑...")
+        with open(os.path.join(source, "資料夾0", "file0.txt"), 'w') as f:
+            f.write("modified")
+        os.makedirs(os.path.join(source, "資料夾3"))
+        with open(os.path.join(source, "資料夾3", "new.txt"), 'w') as f:
+            f.write("new")
+        os.remove(os.path.join(source, "資料夾1", "file1.txt"))
+        dirty_set.write_batch("session-1", [
+            os.path.join("資料夾0", "file0.txt"), "資料夾3", os.path.join("資料夾1", "file1.txt")
+        ])
+        record = runner.run(source, target)
+        assert record["sourceScan"] == {"watcher": True, "dirtyPaths": 3}
+        assert (record["addedFiles"], record["modifiedFiles"], record["deletedFiles"]) == (1, 1, 1)
+        assert dirty_set.list_batches() == []
+        manifest = BackupManifest.open(os.path.join(target, ".backup_manifest.db"))
+        assert manifest.get_files_dict() == DeltaBackupEngine.scan_folder(source)
+        print("✅ 依變更路徑偵測到新增、修改與刪除")
+        
+        print("[步驟3] 佇列溢位時改為完整掃描...")
+        with open(os.path.join(source, "資料夾2", "file2.txt"), 'w') as f:
+            f.write("missed")
+        dirty_set.write_batch("session-1", [], overflow=True)
+        record = runner.run(source, target)
+        assert "sourceScan" not in record
+        assert record["modifiedFiles"] == 1
+        assert dirty_set.list_batches() == []
+        print("✅ 溢位後完整掃描並清除批次")
+        
+        print("[步驟4] 工作階段中斷時改為完整掃描...")
+        dirty_set.write_status("session-2")
+        dirty_set.write_batch("session-1", ["資料夾0"])
+        assert dirty_set.consume()["paths"] is None
+        record = runner.run(source, target)
+        assert "sourceScan" not in record
+        assert dirty_set.consume()["paths"] == set()
+        print("✅ 新工作階段需先完整掃描一次")
+        
+        print("[步驟5] scrub 移除紀錄後改為完整掃描，重新複製遺失的檔案...")
+        lost = os.path.join("資料夾0", "file1.txt")
+        os.remove(os.path.join(target, "backup_data", lost))
+        manifest_path = BackupManifest.locate(target)
+        report = BackupScrubber(BackupManifest.open(manifest_path),
+                                os.path.join(target, "backup_data"), rate_limit_mb=0
+                                ).run(max_bytes=float('inf'))
+        assert report["missing"] == [lost]
+        assert BackupManifest.open(manifest_path).data["manifestGeneration"] == 1
+        assert dirty_set.consume(1)["paths"] is None
+        record = runner.run(source, target)
+        assert "sourceScan" not in record and record["addedFiles"] == 1
+        assert os.path.exists(os.path.join(target, "backup_data", lost))
+        assert dirty_set.consume(1)["paths"] == set()
+        record = runner.run(source, target)
+        assert record["sourceScan"]["watcher"] and record["changedFiles"] == 0
+        print("✅ 遺失的檔案重新複製，之後恢復只檢查變更路徑")
+        
+        if ChangeWatcher.available():
+            print("[步驟6] inotify 監看程式記錄變更...")
+            watcher = ChangeWatcher(source, dirty_set, batch_seconds=0.1)
+            stop_event = threading.Event()
+            thread = threading.Thread(target=watcher.run, args=(stop_event,))
+            thread.start()
+            try:
+                deadline = time.time() + 5
+                while (DirtySet._read_json(dirty_set.status_path) or {}).get("session") != watcher.session:
+                    assert time.time() < deadline
+                    time.sleep(0.05)
+                # 監看程式啟動後先完整掃描一次，讓工作階段被涵蓋
+                record = runner.run(source, target)
+                assert "sourceScan" not in record
+                with open(os.path.join(source, "資料夾2", "file0.txt"), 'w') as f:
+                    f.write("watched")
+                while not dirty_set.list_batches():
+                    assert time.time() < deadline
+                    time.sleep(0.05)
+                assert dirty_set.consume(1)["paths"] == {os.path.join("資料夾2", "file0.txt")}
+                record = runner.run(source, target)
+                assert record["sourceScan"]["watcher"]
+                assert record["modifiedFiles"] == 1
+            finally:
+                stop_event.set()
+                thread.join()
+            assert dirty_set.consume()["paths"] is None
+            print("✅ 監看程式停止後不再信任變更紀錄")
+    
+    print("\n✅ 變更監看模式測試通過\n")
+
+
+def test_backup_scheduler():
+    """測試排程備份（觸發、延遲合併與鎖定）"""
+    print("=" * 60)
+    print("測試 25: 排程備份")
+    print("=" * 60)
+    
+    import threading
+    from backup_tool import BackupScheduler, DirtySet
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "usb", "backup")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, app_dir):
+            os.makedirs(folder)
+        with open(os.path.join(source, "file.txt"), 'w') as f:
+            f.write("data")
+        backup_lock = BackupLock(os.path.join(app_dir, ".backup.lock"))
+        start = time.time()
+        
+        print("\n[步驟1] 目的地接上時觸發，等待延遲後才開始...")
+        scheduler = BackupScheduler(target, interval_minutes=0, times=(), on_mount=True,
+                                    debounce_seconds=30, backup_lock=backup_lock, now=start)
+        assert scheduler.poll(now=start + 10) is None
+        os.makedirs(target)
+        assert scheduler.poll(now=start + 20) is None
+        assert scheduler.pending == "mount"
+        assert scheduler.poll(now=start + 49) is None
+        assert scheduler.poll(now=start + 50) == "mount"
+        print("✅ 裝置接上 30 秒後開始備份")
+        
+        print("[步驟2] 備份進行中的觸發合併為一次...")
+        for offset in (60, 61, 62):
+            scheduler.trigger("changes", now=start + offset)
+        assert scheduler.poll(now=start + 200) is None
+        scheduler.finished(now=start + 300)
+        assert scheduler.poll(now=start + 301) == "changes"
+        scheduler.finished(now=start + 302)
+        assert scheduler.poll(now=start + 1000) is None
+        print("✅ 執行期間的 3 次觸發只產生 1 次備份")
+        
+        print("[步驟3] 連續觸發最多延後 max_delay 秒...")
+        scheduler = BackupScheduler(target, interval_minutes=0, times=(), on_mount=False,
+                                    debounce_seconds=30, max_delay_seconds=100, now=start)
+        results = []
+        for offset in range(0, 120, 10):
+            scheduler.trigger("changes", now=start + offset)
+            results.append(scheduler.poll(now=start + offset))
+        assert results.index("changes") == 10
+        print("✅ 觸發不斷時第 100 秒仍會開始備份")
+        
+        print("[步驟4] 定時與固定時刻觸發...")
+        scheduler = BackupScheduler(target, interval_minutes=60, times=(), on_mount=False,
+                                    debounce_seconds=0, now=start)
+        assert scheduler.poll(now=start + 3599) is None
+        assert scheduler.poll(now=start + 3600) == "interval"
+        moment = datetime.fromtimestamp(start) + timedelta(minutes=5)
+        scheduler = BackupScheduler(target, interval_minutes=0, times=[moment.strftime("%H:%M")],
+                                    on_mount=False, debounce_seconds=0, now=start)
+        assert scheduler.poll(now=start + 4 * 60 - moment.second) is None
+        assert scheduler.poll(now=start + 5 * 60) == "time"
+        scheduler.finished(now=start + 5 * 60)
+        assert scheduler.poll(now=start + 6 * 60) is None
+        try:
+            BackupScheduler(target, times=["25:00"])
+            assert False, "應拒絕錯誤的時刻"
+        except ValueError:
+            pass
+        print("✅ 每 60 分鐘與每日固定時刻觸發")
+        
+        print("[步驟5] 其他程序持有鎖定時延後...")
+        scheduler = BackupScheduler(target, interval_minutes=0, times=(), on_mount=False,
+                                    debounce_seconds=0, backup_lock=backup_lock, now=start)
+        scheduler.trigger("changes", now=start)
+        with open(backup_lock.lock_file, 'w') as f:
+            f.write(str(os.getppid()))
+        assert backup_lock.holder() == os.getppid()
+        assert scheduler.poll(now=start + 1) is None
+        os.remove(backup_lock.lock_file)
+        assert backup_lock.holder() is None
+        assert scheduler.poll(now=start + 2) == "changes"
+        print("✅ 鎖定釋放後才開始")
+        
+        print("[步驟6] 新的變更批次觸發，排程備份記錄觸發原因...")
+        dirty_set = DirtySet.for_source(app_dir, source)
+        scheduler = BackupScheduler(target, interval_minutes=0, times=(), on_mount=False,
+                                    debounce_seconds=0, dirty_set=dirty_set, now=start)
+        assert scheduler.poll(now=start) is None
+        dirty_set.write_batch("session-1", ["file.txt"])
+        trigger = scheduler.poll(now=start + 1)
+        assert trigger == "changes"
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        record = BackupRunner(logger, backup_lock, trigger=trigger).run(source, target)
+        scheduler.finished(now=start + 2)
+        assert record["trigger"] == "changes" and record["addedFiles"] == 1
+        # 監看程式未執行，批次不被確認；已看過的批次不再觸發
+        assert scheduler.poll(now=start + 3) is None
+        print("✅ 同一批變更只觸發一次")
+        
+        print("[步驟7] 降低優先權...")
+        applied = {}
+        thread = threading.Thread(target=lambda: applied.update(BackupScheduler.lower_priority()))
+        thread.start()
+        thread.join()
+        if hasattr(os, "nice"):
+            assert applied["nice"] is not None
+        print(f"✅ 套用設定: {applied}")
+        
+        print("[步驟8] 圖形介面切換排程只保留一個檢查迴圈...")
+        from types import SimpleNamespace
+        from backup_tool import BackupToolGUI
+        queued = {}
+        job_ids = iter(range(1, 100))
+        
+        def after(delay, callback):
+            job = next(job_ids)
+            queued[job] = callback
+            return job
+        enabled = SimpleNamespace(value=True)
+        gui = SimpleNamespace(
+            root=SimpleNamespace(after=after, after_cancel=lambda job: queued.pop(job)),
+            schedule_enabled=SimpleNamespace(get=lambda: enabled.value,
+                                             set=lambda value: setattr(enabled, 'value', value)),
+            source_folder=SimpleNamespace(get=lambda: source),
+            target_folder=SimpleNamespace(get=lambda: target),
+            backup_lock=backup_lock, backup_running=False,
+            scheduler=None, schedule_poll_job=None
+        )
+        gui._poll_schedule = lambda: BackupToolGUI._poll_schedule(gui)
+        BackupToolGUI._on_schedule_toggle(gui)
+        enabled.value = False
+        BackupToolGUI._on_schedule_toggle(gui)
+        assert queued == {} and gui.scheduler is None
+        enabled.value = True
+        BackupToolGUI._on_schedule_toggle(gui)
+        assert len(queued) == 1
+        queued.pop(gui.schedule_poll_job)()
+        assert len(queued) == 1 and gui.schedule_poll_job in queued
+        print("✅ 停用時取消已排入的檢查，重新啟用後只有一個")
+    
+    print("\n✅ 排程備份測試通過\n")
+
+
+def test_rate_limiter():
+    """測試 I/O 限速（權杖桶）"""
+    print("=" * 60)
+    print("測試 26: I/O 限速")
+    print("=" * 60)
+    
+    import threading
+    import backup_tool
+    from backup_tool import RateLimiter
+    
+    print("\n[步驟1] 位元組限速...")
+    limiter = RateLimiter(mb_per_second=10, burst_seconds=0.1)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.consume(1_000_000)
+    elapsed = time.monotonic() - start
+    # 桶容量 1 MB 可立即使用，其餘 4 MB 以 10 MB/s 補充
+    assert 0.35 <= elapsed < 1.5, elapsed
+    print(f"✅ 5 MB 花費 {elapsed:.2f} 秒")
+    
+    print("[步驟2] 檔案操作限速...")
+    limiter = RateLimiter(ops_per_second=50, burst_seconds=0.1)
+    start = time.monotonic()
+    for _ in range(25):
+        limiter.consume(ops=1)
+    elapsed = time.monotonic() - start
+    assert 0.35 <= elapsed < 1.5, elapsed
+    print(f"✅ 25 次操作花費 {elapsed:.2f} 秒")
+    
+    print("[步驟3] 執行中調整上限立即生效...")
+    limiter = RateLimiter(mb_per_second=1, burst_seconds=0.1)
+    done = threading.Event()
+    def consume_slowly():
+        for _ in range(10):
+            limiter.consume(100_000)
+        # 不調整時約需 0.9 秒以上
+        limiter.consume(10_000_000)
+        done.set()
+    start = time.monotonic()
+    thread = threading.Thread(target=consume_slowly)
+    thread.start()
+    time.sleep(0.2)
+    limiter.set_limits(mb_per_second=0)
+    thread.join()
+    assert done.is_set() and time.monotonic() - start < 1.0
+    assert limiter.limits == {"mbPerSecond": 0.0, "opsPerSecond": 0.0} and not limiter.enabled
+    print("✅ 解除限速後立即完成")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        os.makedirs(source)
+        os.makedirs(target)
+        with open(os.path.join(source, "big.bin"), 'wb') as f:
+            f.write(os.urandom(3_000_000))
+        
+        print("[步驟4] 複製與備份流程共用限速器...")
+        backup_tool.IO_LIMITER.set_limits(mb_per_second=2)
+        try:
+            start = time.monotonic()
+            DeltaBackupEngine.copy_file(os.path.join(source, "big.bin"), os.path.join(tmpdir, "copy.bin"))
+            elapsed = time.monotonic() - start
+            # 桶容量 2 MB，其餘 1 MB 以 2 MB/s 複製
+            assert elapsed >= 0.4, elapsed
+            backup_tool.IO_LIMITER.set_limits(mb_per_second=100, ops_per_second=100)
+            logger = BackupLogger(os.path.join(tmpdir, "history.json"))
+            record = BackupRunner(logger, BackupLock(os.path.join(tmpdir, ".backup.lock"))).run(source, target)
+            assert record["addedFiles"] == 1
+            assert record["rateLimit"] == {"mbPerSecond": 100.0, "opsPerSecond": 100.0}
+        finally:
+            backup_tool.IO_LIMITER.set_limits(0, 0)
+        print(f"✅ 3 MB 檔案以 2 MB/s 限速複製花費 {elapsed:.2f} 秒")
+        
+        print("[步驟5] 壓縮行程池同樣受限速...")
+        compressed_source = os.path.join(tmpdir, "compressed_source")
+        compressed_target = os.path.join(tmpdir, "compressed_target")
+        os.makedirs(compressed_source)
+        os.makedirs(compressed_target)
+        with open(os.path.join(compressed_source, "text.txt"), 'w') as f:
+            f.write("backup tool rate limit\n" * 140_000)   # 約 3 MB
+        saved = backup_tool.COMPRESSION_CODEC, backup_tool.COMPRESSION_PROCESSES
+        backup_tool.COMPRESSION_CODEC, backup_tool.COMPRESSION_PROCESSES = "zlib", 2
+        backup_tool.IO_LIMITER.set_limits(mb_per_second=2)
+        try:
+            start = time.monotonic()
+            record = BackupRunner(logger, BackupLock(os.path.join(tmpdir, ".backup.lock"))).run(
+                compressed_source, compressed_target
+            )
+            elapsed = time.monotonic() - start
+        finally:
+            backup_tool.COMPRESSION_CODEC, backup_tool.COMPRESSION_PROCESSES = saved
+            backup_tool.IO_LIMITER.set_limits(0, 0)
+        assert record["copyMethods"] == {"compress_zlib": 1}
+        # 每個行程 1 MB/s、桶容量 1 MB，其餘約 2 MB 需 2 秒
+        assert elapsed >= 1.5, elapsed
+        print(f"✅ 3 MB 檔案於子行程壓縮，仍以限速花費 {elapsed:.2f} 秒")
+    
+    print("\n✅ I/O 限速測試通過\n")
+
+
+def test_backup_progress():
+    """測試備份進度事件（批次產生、各階段統計與 ETA）"""
+    print("=" * 60)
+    print("測試 27: 備份進度")
+    print("=" * 60)
+    
+    import io
+    import contextlib
+    from backup_tool import BackupProgress, PHASE_SCAN, PHASE_SYNC, PHASE_VERIFY, PHASE_FINALIZE
+    
+    print("\n[步驟1] 累計處理量並估計剩餘時間...")
+    progress = BackupProgress(interval=0)
+    events = []
+    progress.add_listener(events.append)
+    progress.start_phase(PHASE_SYNC, files_total=4, bytes_total=400)
+    time.sleep(0.05)
+    progress.advance(1, 100)
+    progress.advance(1, 100)
+    event = progress.snapshot()
+    assert (event["files"], event["bytes"]) == (2, 200)
+    assert event["bytesPerSecond"] > 0 and event["eta"] is not None
+    assert "同步檔案" in BackupProgress.format(event) and "2/4" in BackupProgress.format(event)
+    progress.finish()
+    progress.finish()
+    assert events[-1]["finished"] and events[-1]["eta"] is None
+    assert len(events) == 4
+    assert progress.summary()[PHASE_SYNC]["files"] == 2
+    print("✅ 2/4 個檔案，已估計剩餘時間")
+    
+    print("[步驟2] 事件依時間間隔批次產生...")
+    progress = BackupProgress(interval=60)
+    events = []
+    progress.add_listener(events.append)
+    progress.start_phase(PHASE_SYNC)
+    for _ in range(10000):
+        progress.advance(1, 4096)
+    progress.finish()
+    assert len(events) == 2
+    assert progress.snapshot()["files"] == 10000
+    print("✅ 10000 個檔案只產生開始與結束 2 個事件")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source")
+        target = os.path.join(tmpdir, "target")
+        app_dir = os.path.join(tmpdir, "app")
+        for folder in (source, target, app_dir):
+            os.makedirs(folder)
+        for i in range(5):
+            with open(os.path.join(source, f"file{i}.txt"), 'w') as f:
+                f.write("x" * (i + 1) * 100)
+        logger = BackupLogger(os.path.join(app_dir, "history.json"))
+        
+        print("[步驟3] 備份流程回報各階段進度並記錄於歷史...")
+        progress = BackupProgress()
+        phases = []
+        progress.add_listener(lambda event: phases.append(event["phase"]))
+        runner = BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")), progress=progress)
+        record = runner.run(source, target)
+        assert phases[-1] == PHASE_FINALIZE and progress.finished
+        for phase in (PHASE_SCAN, PHASE_SYNC, PHASE_VERIFY, PHASE_FINALIZE):
+            assert phase in record["phases"], phase
+        assert record["phases"][PHASE_SYNC]["files"] == 5
+        assert record["phases"][PHASE_SYNC]["bytes"] == 1500
+        assert progress.phases[PHASE_SYNC]["filesTotal"] == 5
+        assert logger.get_recent(1)[0]["phases"] == record["phases"]
+        print(f"✅ 階段: {list(record['phases'])}")
+        
+        print("[步驟4] CLI 輸出進度...")
+        os.remove(os.path.join(source, "file0.txt"))
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), contextlib.redirect_stdout(io.StringIO()):
+            assert cli_main(["--app-dir", app_dir, "backup", source, target, "--progress"]) == 0
+        output = stderr.getvalue()
+        assert "檢查備份" in output and "同步檔案 | 0/1 個檔案" in output and "更新紀錄" in output
+        print("✅ 每個階段開始時輸出一行進度")
+        
+        print("[步驟5] 掃描階段逐資料夾回報進度...")
+        nested = os.path.join(tmpdir, "nested")
+        for d in range(3):
+            os.makedirs(os.path.join(nested, f"dir{d}"))
+            for i in range(d + 1):
+                with open(os.path.join(nested, f"dir{d}", f"file{i}.txt"), 'w') as f:
+                    f.write("y")
+        counts = []
+        DeltaBackupEngine.scan_source(nested, workers=2, on_directory=counts.append)
+        assert sorted(counts) == [0, 1, 2, 3]
+        progress = BackupProgress(interval=0)
+        scan_files = []
+        progress.add_listener(
+            lambda event: scan_files.append(event["files"]) if event["phase"] == PHASE_SCAN else None
+        )
+        nested_target = os.path.join(tmpdir, "nested_target")
+        os.makedirs(nested_target)
+        BackupRunner(logger, BackupLock(os.path.join(app_dir, ".backup.lock")),
+                     progress=progress).run(nested, nested_target)
+        # 開始事件 + 每個資料夾一次，計數逐步增加到 6
+        assert len(scan_files) == 5 and scan_files[-1] == 6, scan_files
+        assert scan_files == sorted(scan_files)
+        print(f"✅ 掃描進度: {scan_files}")
+    
+    print("\n✅ 備份進度測試通過\n")
+
+
 if __name__ == "__main__":
     try:
         test_delta_backup()
         test_manifest()
         test_logger()
+        test_scan_result_delta_size()
+        test_parallel_scan()
+        test_copy_pipeline()
+        test_copy_engine()
+        test_content_hash_mode()
+        test_block_delta_copy()
+        test_compact_manifest()
+        test_manifest_journal()
+        test_streaming_delta()
+        test_headless_runner()
+        test_tiered_integrity_check()
+        test_backup_scrubber()
+        test_fused_hash_copy()
+        test_dedup_object_store()
+        test_move_detection()
+        test_snapshots()
+        test_compression()
+        test_pack_small_files()
+        test_resumable_copy()
+        test_source_index()
+        test_change_watcher()
+        test_backup_scheduler()
+        test_rate_limiter()
+        test_backup_progress()
         print("=" * 60)
         print("✅ 所有測試通過!")
         print("=" * 60)